@@ -0,0 +1,161 @@
+# answer_cache.py — two-tier (exact + semantic) answer cache in front of the LLM
+import os
+import re
+import time
+import threading
+from collections import OrderedDict
+from typing import Callable, Dict, List, Optional
+import numpy as np
+from metrics import annotate, count
+from vector_index import INDEX_MANIFEST, IndexManifest
+
+MAX_ENTRIES = int(os.getenv("ANSWER_CACHE_ENTRIES", "1024"))  # 0 turns the cache off (e.g. load tests)
+TTL_SECONDS = 6 * 3600
+SEMANTIC_THRESHOLD = 0.92  # Cosine similarity of normalized MiniLM query vectors
+RECENT_VECTORS = 256       # Query embeddings remembered between get() and put()
+
+def normalize_query(query: str) -> str:
+    """'How do I authenticate?' and 'how do i  authenticate' share one exact-tier key."""
+    return " ".join(re.sub(r"[^\w/.\-]+", " ", query.lower()).split()).strip(" .")
+
+class AnswerCache:
+    """LRU + TTL answer cache with an exact tier and a semantic tier.
+
+    1. Exact: the normalized query string.
+    2. Semantic: cosine similarity of the query embedding against cached
+       questions (same MiniLM model as the index), above `threshold`.
+
+    If `index_folder` is given, the cache is cleared whenever that index's
+    manifest changes (new corpus, model or chunking), so answers never
+    outlive the documents they were generated from.
+    """
+
+    def __init__(self, embed: Optional[Callable[[str], List[float]]] = None,
+                 index_folder: Optional[str] = None, max_entries: int = MAX_ENTRIES,
+                 ttl: float = TTL_SECONDS, threshold: float = SEMANTIC_THRESHOLD):
+        self.embed = embed
+        self.index_folder = index_folder
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.threshold = threshold
+        self.entries: "OrderedDict[str, Dict]" = OrderedDict()
+        self.matrix: Optional[np.ndarray] = None  # Rows follow self.keys; rebuilt when entries change
+        self.keys: List[str] = []
+        self.lock = threading.Lock()
+        self.recent_vectors: "OrderedDict[str, np.ndarray]" = OrderedDict()
+        self.manifest_mtime = None
+        self.manifest_version = None
+        self.stats = {"exact": 0, "semantic": 0, "miss": 0}
+
+    # --- Invalidation ---
+    def _manifest_version(self):
+        path = os.path.join(self.index_folder, INDEX_MANIFEST)
+        try:
+            mtime = os.stat(path).st_mtime_ns
+        except OSError:
+            return None
+        if mtime != self.manifest_mtime:  # Only re-read the manifest when the file was rewritten
+            manifest = IndexManifest.load(self.index_folder)
+            self.manifest_mtime = mtime
+            self.manifest_version = manifest and (manifest.embedding_model, manifest.corpus_fingerprint,
+                                                  repr(sorted(manifest.chunk_params.items())))
+        return self.manifest_version
+
+    def _check_manifest(self):
+        if self.index_folder is None:
+            return
+        previous = self.manifest_version
+        current = self._manifest_version()
+        if previous is not None and current != previous and self.entries:
+            print(f"♻️ Index changed, dropping {len(self.entries)} cached answers.")
+            self.clear()
+
+    def clear(self):
+        self.entries.clear()
+        self.matrix = None
+        self.keys = []
+
+    # --- Lookup / store ---
+    def _semantic_match(self, vector: np.ndarray) -> Optional[str]:
+        if self.matrix is None:
+            self.keys = [key for key, entry in self.entries.items() if entry["vector"] is not None]
+            self.matrix = (np.stack([self.entries[key]["vector"] for key in self.keys])
+                           if self.keys else np.zeros((0, len(vector)), dtype=np.float32))
+        if not self.keys:
+            return None
+        scores = self.matrix @ vector
+        best = int(np.argmax(scores))
+        return self.keys[best] if scores[best] >= self.threshold else None
+
+    def _vector(self, query: str, vector=None) -> Optional[np.ndarray]:
+        """Normalized query embedding; a miss's vector is kept so put() does not embed again.
+
+        A caller that already embedded the query (batch mode) passes `vector` in.
+        """
+        if self.embed is None:
+            return None
+        if vector is None:
+            with self.lock:
+                remembered = self.recent_vectors.get(query)
+            if remembered is not None:
+                return remembered
+            vector = self.embed(query)
+        vector = np.asarray(vector, dtype=np.float32)
+        vector = vector / max(float(np.linalg.norm(vector)), 1e-12)
+        with self.lock:
+            self.recent_vectors[query] = vector
+            while len(self.recent_vectors) > RECENT_VECTORS:
+                self.recent_vectors.popitem(last=False)
+        return vector
+
+    def get(self, query: str, vector=None) -> Optional[Dict]:
+        """Cached {"answer", "sources", "cache"} for this question, or None."""
+        if self.max_entries <= 0:  # Disabled: no lookup, no embedding
+            return None
+        key = normalize_query(query)
+        with self.lock:
+            self._check_manifest()
+            tier = "exact" if key in self.entries else None
+        if tier is None and self.embed is not None and self.entries:
+            vector = self._vector(query, vector)  # Embedded outside the lock
+            with self.lock:
+                match = self._semantic_match(vector)
+                if match is not None and match in self.entries:
+                    key, tier = match, "semantic"
+        with self.lock:
+            if tier is not None and key in self.entries and \
+                    time.time() - self.entries[key]["created"] >= self.ttl:
+                del self.entries[key]  # Expired
+                self.matrix = None
+            if tier is None or key not in self.entries:
+                self.stats["miss"] += 1
+                count("answer_cache_lookups", result="miss")
+                annotate(cache="miss")
+                return None
+            self.entries.move_to_end(key)
+            self.stats[tier] += 1
+            count("answer_cache_lookups", result=tier)
+            annotate(cache=tier)
+            entry = self.entries[key]
+            return {"answer": entry["answer"], "sources": list(entry["sources"]), "cache": tier}
+
+    def put(self, query: str, answer: str, sources: List[str], vector=None):
+        if self.max_entries <= 0:  # Disabled: don't pay for an embedding that is evicted at once
+            return
+        key = normalize_query(query)
+        vector = self._vector(query, vector)
+        with self.lock:
+            self._check_manifest()
+            self.entries[key] = {"answer": answer, "sources": list(sources), "vector": vector,
+                                 "created": time.time()}
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+            self.matrix = None
+
+    def report(self):
+        total = sum(self.stats.values())
+        hits = self.stats["exact"] + self.stats["semantic"]
+        rate = hits / total if total else 0.0
+        print(f"🗃️ Answer cache: {self.stats['exact']} exact + {self.stats['semantic']} semantic hits, "
+              f"{self.stats['miss']} misses ({rate:.0%} hit rate), {len(self.entries)} entries")
@@ -0,0 +1,83 @@
+# batch_qa.py — answer a JSONL file of questions in bulk: one embedding matrix, one FAISS search, concurrent LLM calls
+import sys
+import json
+import time
+import argparse
+import contextlib
+from typing import Dict, Iterable, Iterator, List, Optional
+from dotenv import load_dotenv
+from metrics import trace
+
+BATCH_SIZE = 256           # Questions embedded and searched together
+MAX_BATCH_QUESTIONS = 2000  # Per /ask_batch request
+
+def parse_questions(lines: Iterable[str]) -> List[Dict]:
+    """JSONL records with a "question" (or "query") field; a JSON string or a plain text line is a question too."""
+    records = []
+    for number, line in enumerate(lines, start=1):
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            record = json.loads(line)
+        except json.JSONDecodeError:
+            record = line
+        if isinstance(record, str):
+            record = {"question": record}
+        question = (record.get("question") or record.get("query")) if isinstance(record, dict) else None
+        if not isinstance(question, str) or not question.strip():
+            raise ValueError(f"Line {number}: no \"question\" field.")
+        records.append({**record, "question": question.strip()})
+    return records
+
+def run_batch(service, records: List[Dict], concurrency: Optional[int] = None,
+              batch_size: int = BATCH_SIZE) -> Iterator[Dict]:
+    """Each input record plus "index", "answer", "sources" (and "cache" or "error"), as answers complete."""
+    for offset in range(0, len(records), batch_size):
+        chunk = records[offset:offset + batch_size]
+        with trace("batch", f"{len(chunk)} questions from #{offset}") as batch_trace:
+            hits = 0
+            for position, result in service.answer_batch([record["question"] for record in chunk], concurrency):
+                hits += "cache" in result
+                yield {"index": offset + position, **chunk[position], **result}
+            batch_trace.set(questions=len(chunk), cache=f"{hits} hits")
+
+def main():
+    parser = argparse.ArgumentParser(description="Answer a JSONL file of questions (one {\"question\": ...} per line)")
+    parser.add_argument("input", help="Questions JSONL ('-' for stdin)")
+    parser.add_argument("-o", "--output", default="-", help="Answers JSONL, written as they complete ('-' for stdout)")
+    parser.add_argument("--concurrency", type=int, help="LLM calls in flight (default: GEMINI_MAX_CONCURRENCY)")
+    parser.add_argument("--batch-size", type=int, default=BATCH_SIZE, help="Questions embedded and searched together")
+    args = parser.parse_args()
+
+    # Answers go to the real stdout; every print (ours and the index / service warm-up) goes to
+    # stderr so `python batch_qa.py q.jsonl > answers.jsonl` stays pure JSONL
+    output = sys.stdout if args.output == "-" else open(args.output, "w", encoding="utf-8")
+    with contextlib.redirect_stdout(sys.stderr):
+        load_dotenv()
+        from rag_service import get_service
+
+        source = sys.stdin if args.input == "-" else open(args.input, "r", encoding="utf-8")
+        with source:
+            records = parse_questions(source)
+        print(f"⏳ {len(records)} questions from {args.input}")
+        service = get_service().warm()
+
+        start_time = time.time()
+        answered = cached = failed = 0
+        try:
+            for result in run_batch(service, records, args.concurrency, args.batch_size):
+                output.write(json.dumps(result, ensure_ascii=False) + "\n")
+                output.flush()
+                answered += 1
+                cached += "cache" in result
+                failed += "error" in result
+        finally:
+            if args.output != "-":
+                output.close()
+        elapsed = time.time() - start_time
+        print(f"✅ {answered} answers in {elapsed:.1f}s ({answered / max(elapsed, 1e-9):.1f}/s): "
+              f"{cached} from cache, {failed} failed.")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,106 @@
+# bench_ann.py — recall vs latency of ANN index settings against the exact flat index
+import os
+import json
+import time
+import argparse
+from typing import Dict, List
+import faiss
+import numpy as np
+from vector_index import build_ann_index, index_config, set_search_params
+from test1 import EMBEDDING_MODEL, VECTOR_STORE_PATH
+
+# Build settings to compare, each swept over its query-time knob
+SWEEPS = [
+    ({"type": "ivf"}, "nprobe", [1, 2, 4, 8, 16, 32]),
+    ({"type": "ivf", "fp16": True}, "nprobe", [4, 8, 16]),
+    ({"type": "hnsw"}, "ef_search", [16, 32, 64, 128, 256]),
+    ({"type": "hnsw", "fp16": True}, "ef_search", [32, 64, 128]),
+    ({"type": "ivfpq"}, "nprobe", [4, 8, 16, 32]),
+]
+
+def load_queries(vectors: np.ndarray, count: int, questions: str = None) -> np.ndarray:
+    """Embed real questions (one per line) or, by default, sample stored chunk vectors."""
+    if questions:
+        from sentence_transformers import SentenceTransformer
+        with open(questions, "r", encoding="utf-8") as f:
+            lines = [line.strip() for line in f if line.strip()]
+        model = SentenceTransformer(EMBEDDING_MODEL, device="cpu")
+        return model.encode(lines, convert_to_numpy=True, normalize_embeddings=True).astype(np.float32)
+    rng = np.random.default_rng(1)
+    return vectors[rng.choice(len(vectors), size=min(count, len(vectors)), replace=False)]
+
+def timed_search(index: faiss.Index, queries: np.ndarray, k: int):
+    """One query at a time (like the chatbot) to get per-query latency."""
+    latencies, results = [], []
+    for query in queries:
+        start = time.perf_counter()
+        _, ids = index.search(query[None, :], k)
+        latencies.append((time.perf_counter() - start) * 1000)
+        results.append(ids[0])
+    return np.array(results), np.array(latencies)
+
+def recall_at_k(results: np.ndarray, truth: np.ndarray) -> float:
+    hits = sum(len(set(found) & set(expected)) for found, expected in zip(results, truth))
+    return hits / truth.size
+
+def index_size_mb(index: faiss.Index) -> float:
+    return faiss.serialize_index(index).nbytes / 1e6
+
+def main():
+    parser = argparse.ArgumentParser(description="Recall-vs-latency report for ANN index types")
+    parser.add_argument("--index", default=VECTOR_STORE_PATH, help="Folder holding the flat index.faiss")
+    parser.add_argument("--queries", type=int, default=500, help="Sampled chunk vectors used as queries")
+    parser.add_argument("--questions", help="File with one question per line (overrides sampling)")
+    parser.add_argument("--k", type=int, default=3, help="Neighbours per query (K_RETRIEVAL)")
+    parser.add_argument("--json", help="Also write the report to this file")
+    args = parser.parse_args()
+
+    flat = faiss.read_index(os.path.join(args.index, "index.faiss"))
+    vectors = flat.reconstruct_n(0, flat.ntotal)
+    queries = load_queries(vectors, args.queries, args.questions)
+    print(f"⏱️ {flat.ntotal} vectors, {len(queries)} queries, k={args.k}\n")
+
+    truth, flat_latency = timed_search(flat, queries, args.k)
+    report: List[Dict] = [{
+        "index": "flat", "param": "-", "value": None, "recall": 1.0,
+        "p50_ms": round(float(np.percentile(flat_latency, 50)), 3),
+        "p95_ms": round(float(np.percentile(flat_latency, 95)), 3),
+        "build_s": 0.0, "size_mb": round(index_size_mb(flat), 1),
+    }]
+
+    for overrides, knob, values in SWEEPS:
+        config = index_config(**overrides)
+        name = config["type"] + ("+fp16" if config["fp16"] else "")
+        start = time.time()
+        try:
+            index = build_ann_index(vectors, config)
+        except (ValueError, RuntimeError) as e:
+            print(f"⚠️ Skipping {name}: {e}")
+            continue
+        build_seconds = time.time() - start
+        size = index_size_mb(index)
+        for value in values:
+            config[knob] = value
+            set_search_params(index, config)
+            results, latency = timed_search(index, queries, args.k)
+            report.append({
+                "index": name, "param": knob, "value": value,
+                "recall": round(recall_at_k(results, truth), 4),
+                "p50_ms": round(float(np.percentile(latency, 50)), 3),
+                "p95_ms": round(float(np.percentile(latency, 95)), 3),
+                "build_s": round(build_seconds, 2), "size_mb": round(size, 1),
+            })
+
+    print(f"{'index':<12}{'param':<11}{'value':>6}{'recall@k':>10}{'p50 ms':>9}{'p95 ms':>9}{'build s':>9}{'MB':>8}")
+    for row in report:
+        value = "" if row["value"] is None else row["value"]
+        print(f"{row['index']:<12}{row['param']:<11}{value:>6}{row['recall']:>10.3f}{row['p50_ms']:>9.3f}"
+              f"{row['p95_ms']:>9.3f}{row['build_s']:>9.2f}{row['size_mb']:>8.1f}")
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+        print(f"\n💾 Report written to {args.json}")
+
+if __name__ == "__main__":
+    main()
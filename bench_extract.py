@@ -0,0 +1,107 @@
+# bench_extract.py — compare HTML extraction backends against the original extractor
+import os
+import json
+import time
+import argparse
+from typing import Callable, Dict, List
+from bs4 import BeautifulSoup
+from corpus import iter_corpus
+from extract import available_backends, extract_blocks
+
+SAMPLE_DIR = "data/html_samples"
+
+def legacy_extract(html: str) -> List[str]:
+    """The original scraper.extract_page_content (html.parser + overlapping find_all)."""
+    soup = BeautifulSoup(html, 'html.parser')
+    content_div = soup.find('div', class_='main-content') or \
+                  soup.find('article') or \
+                  soup.find('div', role='main') or \
+                  soup.find('main')
+    if not content_div:
+        content_div = soup
+    elements = content_div.find_all(['p', 'h1', 'h2', 'h3', 'h4', 'li', 'pre', 'code', 'table'])
+    texts = []
+    for el in elements:
+        text = el.get_text().strip()
+        if text and len(text) > 15:
+            texts.append(text)
+    return texts
+
+def download_samples(count: int, out_dir: str = SAMPLE_DIR) -> List[str]:
+    """Fetch `count` raw pages listed in the corpus so the benchmark has real HTML."""
+    from scraper import fetch
+    os.makedirs(out_dir, exist_ok=True)
+    paths = []
+    for i, doc in enumerate(iter_corpus()):
+        if i >= count:
+            break
+        path = os.path.join(out_dir, f"{i:05d}.html")
+        if not os.path.exists(path):
+            print(f"⬇️ {doc['url']}")
+            with open(path, "w", encoding="utf-8") as f:
+                f.write(fetch(doc["url"]).text)
+        paths.append(path)
+    return paths
+
+def load_pages(html_dir: str) -> List[str]:
+    names = sorted(name for name in os.listdir(html_dir) if name.endswith((".html", ".htm")))
+    pages = []
+    for name in names:
+        with open(os.path.join(html_dir, name), "r", encoding="utf-8", errors="replace") as f:
+            pages.append(f.read())
+    return pages
+
+def run(name: str, extractor: Callable[[str], List[str]], pages: List[str], repeat: int) -> Dict:
+    blocks = [extractor(html) for html in pages]  # Warm-up, and the output we measure
+    start = time.perf_counter()
+    for _ in range(repeat):
+        for html in pages:
+            extractor(html)
+    elapsed = time.perf_counter() - start
+    chars = sum(len("\n\n".join(page_blocks)) for page_blocks in blocks)
+    num_blocks = sum(len(page_blocks) for page_blocks in blocks)
+    unique = sum(len(set(page_blocks)) for page_blocks in blocks)
+    return {
+        "backend": name,
+        "pages_per_sec": round(len(pages) * repeat / elapsed, 1),
+        "output_chars": chars,
+        "blocks": num_blocks,
+        "duplicate_blocks": num_blocks - unique,
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark HTML extraction backends")
+    parser.add_argument("--html-dir", default=SAMPLE_DIR, help="Directory of saved .html pages")
+    parser.add_argument("--sample", type=int, default=0,
+                        help="First download this many corpus pages into --html-dir")
+    parser.add_argument("--repeat", type=int, default=3, help="Timed passes over the page set")
+    parser.add_argument("--json", help="Also write the results to this file")
+    args = parser.parse_args()
+
+    if args.sample:
+        download_samples(args.sample, args.html_dir)
+    pages = load_pages(args.html_dir)
+    if not pages:
+        print(f"❌ No HTML pages in {args.html_dir}. Use --sample N to download some.")
+        return
+    print(f"⏱️ {len(pages)} pages × {args.repeat} passes\n")
+
+    results = [run("legacy (html.parser, find_all)", legacy_extract, pages, args.repeat)]
+    for backend in available_backends():
+        results.append(run(backend, lambda html, b=backend: extract_blocks(html, b), pages, args.repeat))
+
+    baseline = results[0]
+    print(f"{'backend':<32}{'pages/s':>10}{'speedup':>9}{'chars':>12}{'size':>8}{'blocks':>8}{'dupes':>7}")
+    for r in results:
+        speedup = r["pages_per_sec"] / baseline["pages_per_sec"]
+        size = r["output_chars"] / max(baseline["output_chars"], 1)
+        print(f"{r['backend']:<32}{r['pages_per_sec']:>10}{speedup:>8.2f}x{r['output_chars']:>12}"
+              f"{size:>7.0%}{r['blocks']:>8}{r['duplicate_blocks']:>7}")
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+        print(f"\n💾 Results written to {args.json}")
+
+if __name__ == "__main__":
+    main()
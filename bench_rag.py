@@ -0,0 +1,460 @@
+# bench_rag.py — retrieval recall/latency on a question set, and a concurrent load test of /ask
+import os
+import sys
+import json
+import time
+import random
+import re
+import argparse
+import threading
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, List
+import numpy as np
+
+EVAL_SET = "data/eval_questions.jsonl"
+K_VALUES = [1, 3, 5, 10]
+BATCH_SIZE = 64
+STUB_PORT = 8765
+STUB_LATENCY = 0.8  # Seconds; roughly a short gemini-2.5-flash answer
+STUB_ANSWER = "Use OAuth 2.0 Bearer Token. Header: 'Authorization: Bearer <token>'."
+# Context for the offline generation benchmark (a typical packed retrieval, no index needed)
+SAMPLE_SOURCE = "https://docs.capillarytech.com/reference/authentication"
+SAMPLE_CONTEXT = """# Authentication
+All API requests are authenticated with OAuth 2.0. Request a token from /v3/oauth/token/generate
+with your client key and secret, then send it in the header Authorization: Bearer <token>.
+Tokens expire after 24 hours; request a new one when a call returns 401.
+
+## Create customer
+POST /v2/customers with mobile_number (E.164) and country_code. first_name, last_name and email
+are optional. A 409 response means the customer is already enrolled in the loyalty program."""
+
+# --- Reports ---
+def percentiles(values_ms: List[float]) -> Dict:
+    if not values_ms:
+        return {}
+    values = np.asarray(values_ms, dtype=np.float64)
+    return {"p50": round(float(np.percentile(values, 50)), 2), "p95": round(float(np.percentile(values, 95)), 2),
+            "p99": round(float(np.percentile(values, 99)), 2), "mean": round(float(values.mean()), 2),
+            "max": round(float(values.max()), 2)}
+
+def flatten(report, prefix: str = "") -> Dict[str, float]:
+    """{"a": {"b": 1}} -> {"a.b": 1}, numbers only (what --baseline compares)."""
+    flat = {}
+    for key, value in report.items():
+        name = f"{prefix}{key}"
+        if isinstance(value, dict):
+            flat.update(flatten(value, name + "."))
+        elif isinstance(value, (int, float)) and not isinstance(value, bool):
+            flat[name] = value
+    return flat
+
+def compare(report: Dict, baseline_path: str):
+    with open(baseline_path, "r", encoding="utf-8") as f:
+        baseline = flatten(json.load(f))
+    print(f"\n📊 Changes against {baseline_path}:")
+    changed = False
+    for name, value in flatten(report).items():
+        before = baseline.get(name)
+        if before is None or before == value:
+            continue
+        delta = f" ({(value - before) / before:+.1%})" if before else ""
+        print(f"   {name:<40}{before:>12} -> {value:<12}{delta}")
+        changed = True
+    if not changed:
+        print("   (no metric changed)")
+
+def write_report(report: Dict, args):
+    print("\n" + json.dumps(report, indent=2))
+    if args.baseline:
+        compare(report, args.baseline)
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2, sort_keys=True)
+        print(f"\n💾 Report written to {args.json}")
+
+# --- Question set ---
+def normalize_source(url: str) -> str:
+    return url.strip().rstrip("/")
+
+def load_eval_set(path: str) -> List[Dict]:
+    """JSONL: {"question": ..., "sources": [expected URL, ...]} (or a single "source") per line."""
+    items = []
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            if not line.strip() or line.lstrip().startswith("#"):
+                continue
+            record = json.loads(line)
+            sources = record.get("sources") or [record["source"]]
+            items.append({"question": record["question"], "sources": {normalize_source(s) for s in sources}})
+    return items
+
+def chunk_topic(doc) -> str:
+    """The chunk's own heading, else the innermost heading above it, else the page's URL slug.
+
+    "section" is the trail *above* a chunk (repeated at the top of its text),
+    so a chunk that starts with a heading is about that heading, not the trail's last one.
+    """
+    section = doc.metadata.get("section") or ""
+    body = doc.page_content
+    if section and body.startswith(section):
+        body = body[len(section):]
+    match = re.match(r"#{1,6}\s+(.*)", body.strip().split("\n", 1)[0])
+    if match:
+        return match.group(1).strip()
+    if section:
+        return section.split(" > ")[-1].strip()
+    slug = normalize_source(doc.metadata["source"]).rsplit("/", 1)[-1]
+    return re.sub(r"[-_]+", " ", slug).strip()
+
+def synthetic_eval_set(vectorstore, count: int, seed: int = 1) -> List[Dict]:
+    """Headings of random chunks (see chunk_topic) as questions, their page as the expected source."""
+    rng = random.Random(seed)
+    rows = list(range(vectorstore.index.ntotal))
+    rng.shuffle(rows)
+    items, seen = [], set()
+    for pos in rows:
+        doc = vectorstore.docstore.search(vectorstore.index_to_docstore_id[pos])
+        if not hasattr(doc, "metadata"):  # Missing chunk ("ID ... not found.")
+            continue
+        heading = chunk_topic(doc)
+        if len(heading) < 3 or heading in seen:
+            continue
+        seen.add(heading)
+        items.append({"question": heading, "sources": {normalize_source(doc.metadata["source"])}})
+        if len(items) >= count:
+            break
+    return items
+
+# --- Retrieval benchmark ---
+def source_ranking(documents) -> List[str]:
+    return list(dict.fromkeys(normalize_source(doc.metadata["source"]) for doc in documents))
+
+def score(rankings: List[List[str]], items: List[Dict], k_values: List[int]) -> Dict:
+    """recall@k (share of expected sources found), hit@k (any found) and MRR over the top sources."""
+    result = {}
+    for k in k_values:
+        recall = [len(set(ranking[:k]) & item["sources"]) / len(item["sources"])
+                  for ranking, item in zip(rankings, items)]
+        hit = [bool(set(ranking[:k]) & item["sources"]) for ranking, item in zip(rankings, items)]
+        result[f"recall@{k}"] = round(float(np.mean(recall)), 4)
+        result[f"hit@{k}"] = round(float(np.mean(hit)), 4)
+    reciprocal = []
+    for ranking, item in zip(rankings, items):
+        rank = next((i for i, source in enumerate(ranking, start=1) if source in item["sources"]), None)
+        reciprocal.append(1.0 / rank if rank else 0.0)
+    result["mrr"] = round(float(np.mean(reciprocal)), 4)
+    return result
+
+def run_retrieval(args):
+    from context_packer import pack_context
+    from rag_service import get_service
+    from vector_index import IndexManifest
+
+    service = get_service().warm()
+    vectorstore = service.vectorstore
+    hybrid = service.retriever.base  # Serving settings (K_RETRIEVAL); `wide` ranks deep enough for every k
+    max_k = max(args.k)
+    wide = hybrid.model_copy(update={"k": max_k, "fetch_k": max(hybrid.fetch_k, max_k)})
+    items = synthetic_eval_set(vectorstore, args.synthetic) if args.synthetic else load_eval_set(args.eval)
+    if not items:
+        sys.exit("❌ The question set is empty.")
+    questions = [item["question"] for item in items]
+    print(f"⏱️ {len(items)} questions, {vectorstore.index.ntotal} chunks, k={args.k}, batch={args.batch_size}")
+
+    # Batched: one embedding call and one FAISS search per batch of questions
+    rankings = {"dense": [], "hybrid": [], "packed": []}
+    timings = Counter()
+    start = time.perf_counter()
+    for i in range(0, len(questions), args.batch_size):
+        batch = questions[i:i + args.batch_size]
+        t0 = time.perf_counter()
+        vectors = np.asarray(vectorstore.embeddings.embed_documents(batch), dtype=np.float32)
+        t1 = time.perf_counter()
+        vector_rows = wide.vector_search_many(vectors)
+        t2 = time.perf_counter()
+        for question, rows in zip(batch, vector_rows):
+            rankings["dense"].append(source_ranking(wide.to_documents([(pos, 0.0) for pos in rows[:max_k]])))
+            fused = wide.fused_rows(question, rows)
+            rankings["hybrid"].append(source_ranking(wide.to_documents(fused)))
+            # What the LLM actually sees: the top K_RETRIEVAL chunks, packed
+            packed = pack_context(wide.to_documents(fused[:hybrid.k]), service.retriever.budget)
+            rankings["packed"].append(source_ranking(packed))
+        timings["embed"] += t1 - t0
+        timings["faiss"] += t2 - t1
+        timings["fuse_and_pack"] += time.perf_counter() - t2
+    batched_seconds = time.perf_counter() - start
+
+    # Serving path: one question at a time through the same retriever as /ask
+    latencies = []
+    for question in questions[:args.single]:
+        t0 = time.perf_counter()
+        service.retrieve(question)
+        latencies.append((time.perf_counter() - t0) * 1000)
+
+    manifest = IndexManifest.load(service.index_folder)
+    report = {
+        "mode": "retrieval",
+        "setup": {"index": service.index_folder, "index_type": type(vectorstore.index).__name__,
+                  "chunks": int(vectorstore.index.ntotal), "k_retrieval": hybrid.k, "fetch_k": hybrid.fetch_k,
+                  "context_budget": service.retriever.budget,
+                  "chunk_params": manifest.chunk_params if manifest else None,
+                  "embedding_model": manifest.embedding_model if manifest else None},
+        "questions": len(items),
+        "quality": {name: score(ranked, items, args.k) for name, ranked in rankings.items()},
+        "batched": {"batch_size": args.batch_size, "qps": round(len(items) / batched_seconds, 1),
+                    "ms_per_query": {stage: round(seconds * 1000 / len(items), 3)
+                                     for stage, seconds in timings.items()}},
+        "single": {"queries": len(latencies), "latency_ms": percentiles(latencies),
+                   "qps": round(len(latencies) / (sum(latencies) / 1000), 1) if latencies else None},
+    }
+    print(f"\n{'retriever':<10}" + "".join(f"{'R@' + str(k):>8}" for k in args.k) + f"{'MRR':>8}")
+    for name, quality in report["quality"].items():
+        print(f"{name:<10}" + "".join(f"{quality[f'recall@{k}']:>8.3f}" for k in args.k) + f"{quality['mrr']:>8.3f}")
+    write_report(report, args)
+
+# --- Stub LLM server ---
+class StubGeminiHandler(BaseHTTPRequestHandler):
+    """generateContent / streamGenerateContent with a fixed delay and a canned answer."""
+
+    def do_POST(self):
+        request_bytes = len(self.rfile.read(int(self.headers.get("Content-Length") or 0)))
+        self.server.requests += 1
+        time.sleep(self.server.latency)
+        # Rough token counts, so the LLM token counters have something to count
+        usage = {"promptTokenCount": request_bytes // 4, "candidatesTokenCount": len(self.server.answer) // 4}
+        if ":streamGenerateContent" in self.path:
+            self.send_response(200)
+            self.send_header("Content-Type", "text/event-stream")
+            self.end_headers()
+            words = self.server.answer.split(" ")
+            for i, word in enumerate(words):
+                event = {"candidates": [{"content": {"parts": [{"text": word + " "}]}}]}
+                if i == len(words) - 1:
+                    event["usageMetadata"] = usage
+                self.wfile.write(f"data: {json.dumps(event)}\r\n\r\n".encode("utf-8"))
+                self.wfile.flush()
+            return
+        body = json.dumps({"candidates": [{"content": {"parts": [{"text": self.server.answer}]},
+                                           "finishReason": "STOP"}], "usageMetadata": usage}).encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+def start_stub(port: int = STUB_PORT, latency: float = STUB_LATENCY, answer: str = STUB_ANSWER) -> ThreadingHTTPServer:
+    server = ThreadingHTTPServer(("127.0.0.1", port), StubGeminiHandler)
+    server.daemon_threads = True
+    server.latency, server.answer, server.requests = latency, answer, 0
+    threading.Thread(target=server.serve_forever, name="stub-gemini", daemon=True).start()
+    return server
+
+def stub_base_url(port: int) -> str:
+    return f"http://127.0.0.1:{port}/v1beta"
+
+def run_stub(args):
+    start_stub(args.port, args.stub_latency)
+    print(f"🧪 Stub Gemini on {stub_base_url(args.port)} ({args.stub_latency}s per answer). "
+          f"Start the app with GEMINI_BASE_URL={stub_base_url(args.port)} GEMINI_RPM=0. Ctrl+C to stop.")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        pass
+
+# --- Load test ---
+def start_app(port: int) -> str:
+    """withinterface.app on a local threaded server (its Gemini calls go to GEMINI_BASE_URL)."""
+    import logging
+    from werkzeug.serving import make_server
+    from withinterface import app
+    logging.getLogger("werkzeug").setLevel(logging.WARNING)  # No access-log line per request
+    server = make_server("127.0.0.1", port, app, threaded=True)
+    threading.Thread(target=server.serve_forever, name="bench-app", daemon=True).start()
+    return f"http://127.0.0.1:{port}"
+
+def wait_ready(client, url: str, timeout: float):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            if client.get(f"{url}/ready").status_code == 200:
+                return
+        except Exception:
+            pass
+        time.sleep(0.5)
+    sys.exit(f"❌ {url} did not become ready within {timeout:.0f}s.")
+
+def one_request(client, url: str, endpoint: str, question: str) -> Dict:
+    start = time.perf_counter()
+    result = {"status": None, "ttft_ms": None, "cache": None}
+    try:
+        if endpoint == "/ask_stream":
+            with client.stream("POST", url + endpoint, json={"query": question}) as response:
+                result["status"] = response.status_code
+                for line in response.iter_lines():
+                    if line.startswith("event: token") and result["ttft_ms"] is None:
+                        result["ttft_ms"] = (time.perf_counter() - start) * 1000
+                    elif line.startswith("event: error"):
+                        result["status"] = "stream-error"
+                    elif line.startswith("data:") and '"cache"' in line:
+                        result["cache"] = json.loads(line[5:]).get("cache")
+        else:
+            response = client.post(url + endpoint, json={"query": question})
+            result["status"] = response.status_code
+            if response.status_code == 200:
+                result["cache"] = response.json().get("cache")
+    except Exception as e:
+        result["status"] = type(e).__name__
+    result["latency_ms"] = (time.perf_counter() - start) * 1000
+    return result
+
+def run_load(args):
+    import httpx
+    stub = None
+    if not args.url:
+        # Everything in this process: stub Gemini + the Flask app pointed at it
+        stub = start_stub(args.stub_port, args.stub_latency)
+        os.environ["GEMINI_BASE_URL"] = stub_base_url(args.stub_port)
+        os.environ.setdefault("GEMINI_API_KEY", "stub")
+        os.environ.setdefault("GEMINI_RPM", "0")  # The stub has no quota; measure the app, not the limiter
+        if not args.with_cache:  # Every request goes through retrieval + the LLM
+            os.environ["ANSWER_CACHE_ENTRIES"] = "0"
+        url = start_app(args.port)
+    else:
+        url = args.url.rstrip("/")
+    questions = [item["question"] for item in load_eval_set(args.eval)]
+    if args.with_cache:
+        request_questions = [questions[i % len(questions)] for i in range(args.requests)]
+    else:
+        # A unique suffix per request: identical prompts in flight would be coalesced into
+        # one Gemini call (and hit the answer cache of a --url app), hiding the upstream load
+        request_questions = [f"{questions[i % len(questions)]} (request {i})" for i in range(args.requests)]
+
+    limits = httpx.Limits(max_connections=args.concurrency, max_keepalive_connections=args.concurrency)
+    with httpx.Client(timeout=args.timeout, limits=limits) as client:
+        wait_ready(client, url, args.ready_timeout)
+        print(f"🚦 {args.requests} requests to {url}{args.endpoint}, {args.concurrency} concurrent clients")
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+            results = list(pool.map(lambda question: one_request(client, url, args.endpoint, question),
+                                    request_questions))
+        wall = time.perf_counter() - start
+
+    ok = [r for r in results if r["status"] == 200]
+    report = {
+        "mode": "load",
+        "setup": {"url": url, "endpoint": args.endpoint, "concurrency": args.concurrency,
+                  "requests": args.requests, "stub_latency_s": args.stub_latency if stub else None},
+        "ok": len(ok),
+        "errors": {str(status): count for status, count in Counter(r["status"] for r in results).items()
+                   if status != 200},
+        "qps": round(len(ok) / wall, 2),
+        "latency_ms": percentiles([r["latency_ms"] for r in ok]),
+        "cache_hits": sum(1 for r in ok if r["cache"]),
+    }
+    if args.endpoint == "/ask_stream":
+        report["ttft_ms"] = percentiles([r["ttft_ms"] for r in ok if r["ttft_ms"] is not None])
+    if stub:
+        report["llm_calls"] = stub.requests
+    write_report(report, args)
+
+# --- Generation throughput ---
+def run_generate(args):
+    """Requests/s and tokens/s of an LLM backend on RAG-shaped prompts (offline for the local backend)."""
+    from langchain.docstore.document import Document
+    from llm_backends import create_backend
+    from rag_service import MAX_OUTPUT_TOKENS, SYSTEM_PROMPT, TEMPERATURE, build_prompt
+
+    options = {}
+    if args.backend == "local":
+        options = {"max_batch": args.max_batch, "prefix_cache": not args.no_prefix_cache}
+        if args.model:
+            options["model_name"] = args.model
+        if args.max_new_tokens:
+            options["max_new_tokens"] = args.max_new_tokens
+    backend = create_backend(args.backend, **options).load()
+    questions = [item["question"] for item in load_eval_set(args.eval)]
+    documents = [Document(page_content=SAMPLE_CONTEXT, metadata={"source": SAMPLE_SOURCE})]
+    # Unique per request, so the Gemini client cannot coalesce identical prompts in flight
+    prompts = [build_prompt(f"{questions[i % len(questions)]} (request {i})", documents) for i in range(args.requests)]
+
+    def one(prompt: str) -> float:
+        start = time.perf_counter()
+        backend.generate(prompt, system=SYSTEM_PROMPT, temperature=TEMPERATURE, max_tokens=MAX_OUTPUT_TOKENS)
+        return (time.perf_counter() - start) * 1000
+
+    one(prompts[0])  # Warm-up: first forward pass, system-prompt cache
+    before = backend.report()
+    print(f"🧮 {args.requests} prompts through {backend.describe()}, {args.concurrency} concurrent callers")
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+        latencies = list(pool.map(one, prompts))
+    wall = time.perf_counter() - start
+    after = backend.report()
+
+    tokens_out = after.get("tokens_out", 0) - before.get("tokens_out", 0)
+    batches = after.get("batches", 0) - before.get("batches", 0)
+    report = {
+        "mode": "generate",
+        "setup": {"backend": backend.describe(), "concurrency": args.concurrency, "requests": args.requests,
+                  **{key: value for key, value in options.items() if key != "model_name"}},
+        "requests_per_s": round(args.requests / wall, 3),
+        "tokens_out_per_s": round(tokens_out / wall, 1) if tokens_out else None,
+        "mean_batch": round(args.requests / batches, 2) if batches else None,
+        "latency_ms": percentiles(latencies),
+    }
+    write_report(report, args)
+
+def main():
+    parser = argparse.ArgumentParser(description="Retrieval quality / latency, /ask load and LLM throughput benchmarks")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    retrieval = sub.add_parser("retrieval", help="recall@k, MRR and latency of the retrievers on a question set")
+    retrieval.add_argument("--eval", default=EVAL_SET, help="JSONL of {question, sources}")
+    retrieval.add_argument("--synthetic", type=int, help="Use N chunk headings as questions instead of --eval")
+    retrieval.add_argument("--k", type=int, nargs="+", default=K_VALUES, help="Cut-offs for recall@k")
+    retrieval.add_argument("--batch-size", type=int, default=BATCH_SIZE, help="Questions embedded per call")
+    retrieval.add_argument("--single", type=int, default=200, help="Questions timed one at a time (serving path)")
+
+    load = sub.add_parser("load", help="Concurrent clients against /ask or /ask_stream")
+    load.add_argument("--eval", default=EVAL_SET, help="JSONL of {question, sources} (questions only are used)")
+    load.add_argument("--url", help="Running app to test (default: start the app here against a stub LLM)")
+    load.add_argument("--endpoint", default="/ask", choices=["/ask", "/ask_stream"])
+    load.add_argument("--concurrency", type=int, default=8)
+    load.add_argument("--requests", type=int, default=200)
+    load.add_argument("--with-cache", action="store_true",
+                      help="Repeat the eval questions verbatim and keep the in-process app's answer cache on "
+                           "(otherwise every request gets a unique suffix so none is cached or coalesced)")
+    load.add_argument("--port", type=int, default=5055, help="Port of the in-process app")
+    load.add_argument("--stub-port", type=int, default=STUB_PORT)
+    load.add_argument("--stub-latency", type=float, default=STUB_LATENCY, help="Seconds per stub LLM answer")
+    load.add_argument("--timeout", type=float, default=60.0, help="Per-request client timeout")
+    load.add_argument("--ready-timeout", type=float, default=300.0, help="Wait this long for /ready")
+
+    generate = sub.add_parser("generate", help="Throughput of an LLM backend alone (requests/s, tokens/s)")
+    generate.add_argument("--backend", default="local", choices=["local", "gemini"])
+    generate.add_argument("--eval", default=EVAL_SET, help="JSONL of {question, sources} (questions only are used)")
+    generate.add_argument("--requests", type=int, default=32)
+    generate.add_argument("--concurrency", type=int, default=8, help="Callers submitting at once")
+    generate.add_argument("--model", help="Local model (default: LOCAL_LLM_MODEL)")
+    generate.add_argument("--max-batch", type=int, default=8, help="Local dynamic batch size (1 = no batching)")
+    generate.add_argument("--max-new-tokens", type=int, help="Local answer length cap")
+    generate.add_argument("--no-prefix-cache", action="store_true", help="Recompute the system prompt every batch")
+
+    stub = sub.add_parser("stub", help="Only run the stub LLM server (for --url runs against another process)")
+    stub.add_argument("--port", type=int, default=STUB_PORT)
+    stub.add_argument("--stub-latency", type=float, default=STUB_LATENCY)
+
+    for command in (retrieval, load, generate):
+        command.add_argument("--json", help="Write the report to this file")
+        command.add_argument("--baseline", help="Earlier --json report to print metric changes against")
+    args = parser.parse_args()
+    {"retrieval": run_retrieval, "load": run_load, "generate": run_generate, "stub": run_stub}[args.command](args)
+
+if __name__ == "__main__":
+    main()
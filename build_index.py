@@ -0,0 +1,193 @@
+# build_index.py — cold-build the FAISS index with batched, multi-process embedding
+import os
+import time
+import argparse
+import multiprocessing
+from typing import Dict, Iterable, Iterator, List, Tuple
+import numpy as np
+from langchain.docstore.document import Document
+from langchain_core.embeddings import Embeddings
+from embedding_cache import CachedEmbeddings
+from vector_index import (INDEX_TYPES, IndexManifest, attach_ann_index, chunk_ids, document_hash,
+                          index_config, save_store, split_documents)
+from test1 import CHUNK_PARAMS, EMBEDDING_MODEL, INDEX_CONFIG, VECTOR_STORE_PATH, get_text_splitter, iter_documents
+
+BATCH_SIZE = 64      # Sentences per forward pass
+BLOCK_SIZE = 2048    # Chunks handed to the encoder (and added to FAISS) at a time
+PROCESSES = os.cpu_count() or 1
+
+def _vm_hwm_kb(pid) -> int:
+    """Peak RSS of a live process from /proc (0 if it is gone or /proc is missing)."""
+    try:
+        with open(f"/proc/{pid}/status", "r", encoding="ascii") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1])
+    except (OSError, ValueError):
+        pass
+    return 0
+
+def peak_rss_mb() -> float:
+    """Peak resident memory of this process plus the sum of its live encoder workers' peaks, in MB.
+
+    Workers are sampled while they run (RUSAGE_CHILDREN only sees reaped
+    children, and only the largest one); without /proc (macOS, Windows)
+    this is the main process alone, or 0.
+    """
+    own = _vm_hwm_kb("self")
+    if not own:
+        try:
+            import resource
+        except ImportError:  # Windows
+            return 0.0
+        own = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss  # KB on Linux
+    return (own + sum(_vm_hwm_kb(worker.pid) for worker in multiprocessing.active_children())) / 1024
+
+class SentenceTransformerEncoder(Embeddings):
+    """Direct sentence-transformers encoder with explicit batch size and process pool.
+
+    Vectors are L2-normalized exactly once, here, on the whole block, so the
+    FAISS distances match the normalized query embeddings used at search time.
+    """
+
+    def __init__(self, model_name: str = EMBEDDING_MODEL, batch_size: int = BATCH_SIZE,
+                 processes: int = PROCESSES, threads: int = 0):
+        import torch
+        from sentence_transformers import SentenceTransformer
+        if threads:
+            torch.set_num_threads(threads)
+        self.model_name = model_name
+        self.batch_size = batch_size
+        self.model = SentenceTransformer(model_name, device="cpu")
+        self.pool = self.model.start_multi_process_pool(["cpu"] * processes) if processes > 1 else None
+
+    @property
+    def dimension(self) -> int:
+        return self.model.get_sentence_embedding_dimension()
+
+    def encode(self, texts: List[str]) -> np.ndarray:
+        if self.pool is not None:
+            vectors = self.model.encode_multi_process(texts, self.pool, batch_size=self.batch_size)
+        else:
+            vectors = self.model.encode(texts, batch_size=self.batch_size, convert_to_numpy=True,
+                                        show_progress_bar=False, normalize_embeddings=False)
+        vectors = np.asarray(vectors, dtype=np.float32)
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        return vectors / np.maximum(norms, 1e-12)
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        return self.encode(texts).tolist()
+
+    def embed_query(self, text: str) -> List[float]:
+        return self.encode([text])[0].tolist()
+
+    def close(self):
+        if self.pool is not None:
+            self.model.stop_multi_process_pool(self.pool)
+            self.pool = None
+
+def iter_chunk_blocks(documents: Iterable[Document], split, manifest: IndexManifest,
+                      block_size: int) -> Iterator[Tuple[List[Document], List[str]]]:
+    """Split documents lazily and yield (chunks, ids) blocks of about `block_size` chunks."""
+    chunks, ids = [], []
+    for document, doc_chunks in split_documents(documents, split):
+        doc_ids = chunk_ids(document.metadata["source"], len(doc_chunks))
+        manifest.documents[document.metadata["source"]] = {
+            "hash": document_hash(document.page_content), "ids": doc_ids}
+        chunks.extend(doc_chunks)
+        ids.extend(doc_ids)
+        if len(chunks) >= block_size:
+            yield chunks, ids
+            chunks, ids = [], []
+    if chunks:
+        yield chunks, ids
+
+def build_index(output: str = VECTOR_STORE_PATH, batch_size: int = BATCH_SIZE,
+                block_size: int = BLOCK_SIZE, processes: int = PROCESSES, threads: int = 0,
+                use_cache: bool = True, config: Dict = INDEX_CONFIG) -> Dict:
+    """Stream the corpus through the encoder block by block into a new FAISS index.
+
+    The flat index is always written; a non-flat `config` also derives the
+    ANN index (ann.faiss) so the first load does not have to train it.
+    """
+    import faiss
+    from langchain_community.docstore.in_memory import InMemoryDocstore
+    from langchain_community.vectorstores import FAISS
+
+    print(f"⏳ Loading {EMBEDDING_MODEL} ({processes} process(es), batch size {batch_size})...")
+    encoder = SentenceTransformerEncoder(EMBEDDING_MODEL, batch_size, processes, threads)
+    embeddings = CachedEmbeddings(encoder, model_name=EMBEDDING_MODEL) if use_cache else encoder
+    vectorstore = FAISS(
+        embedding_function=embeddings,
+        index=faiss.IndexFlatL2(encoder.dimension),
+        docstore=InMemoryDocstore(),
+        index_to_docstore_id={},
+    )
+    manifest = IndexManifest(EMBEDDING_MODEL, CHUNK_PARAMS)
+    text_splitter = get_text_splitter()
+
+    total = 0
+    peak_mb = 0.0  # Highest sample while the workers were alive
+    start_time = time.time()
+    try:
+        blocks = iter_chunk_blocks(iter_documents(), text_splitter, manifest, block_size)
+        for chunks, ids in blocks:
+            texts = [chunk.page_content for chunk in chunks]
+            vectors = embeddings.embed_documents(texts)
+            vectorstore.add_embeddings(list(zip(texts, vectors)),
+                                       metadatas=[chunk.metadata for chunk in chunks], ids=ids)
+            total += len(chunks)
+            elapsed = time.time() - start_time
+            peak_mb = max(peak_mb, peak_rss_mb())
+            print(f"📦 {total} chunks from {len(manifest.documents)} documents — "
+                  f"{total / max(elapsed, 1e-9):.1f} chunks/s, peak RSS {peak_mb:.0f} MB")
+    finally:
+        encoder.close()
+
+    save_store(vectorstore, output)
+    manifest.save(output)
+    attach_ann_index(vectorstore, output, manifest, config)
+    elapsed = time.time() - start_time
+    stats = {
+        "documents": len(manifest.documents),
+        "chunks": total,
+        "seconds": round(elapsed, 2),
+        "chunks_per_sec": round(total / max(elapsed, 1e-9), 1),
+        "peak_rss_mb": round(max(peak_mb, peak_rss_mb()), 1),
+    }
+    print(f"✅ Built '{output}': {stats['chunks']} chunks in {stats['seconds']}s "
+          f"({stats['chunks_per_sec']} chunks/s, peak RSS {stats['peak_rss_mb']} MB)")
+    text_splitter.report()
+    if use_cache:
+        embeddings.report()
+    return stats
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Build the FAISS index from data/docs.jsonl")
+    parser.add_argument("--output", default=VECTOR_STORE_PATH, help="Index folder")
+    parser.add_argument("--batch-size", type=int, default=BATCH_SIZE, help="Sentences per forward pass")
+    parser.add_argument("--block-size", type=int, default=BLOCK_SIZE, help="Chunks per encode/add step")
+    parser.add_argument("--processes", type=int, default=PROCESSES, help="Encoder processes (1 = in-process)")
+    parser.add_argument("--threads", type=int, default=0, help="Torch threads for in-process encoding")
+    parser.add_argument("--no-cache", action="store_true", help="Ignore the embedding cache")
+    parser.add_argument("--index-type", choices=INDEX_TYPES, default=INDEX_CONFIG["type"], help="Search index type")
+    parser.add_argument("--nlist", type=int, help="IVF lists (default: about 4*sqrt(n))")
+    parser.add_argument("--train-size", type=int, help="Vectors sampled to train IVF/PQ")
+    parser.add_argument("--hnsw-m", type=int, help="HNSW graph degree")
+    parser.add_argument("--pq-m", type=int, help="PQ sub-quantizers")
+    parser.add_argument("--pq-bits", type=int, help="Bits per PQ code")
+    parser.add_argument("--fp16", action="store_true", default=None, help="Store vectors as float16")
+    return parser.parse_args()
+
+if __name__ == "__main__":
+    args = parse_args()
+    build_index(
+        output=args.output,
+        batch_size=args.batch_size,
+        block_size=args.block_size,
+        processes=args.processes,
+        threads=args.threads,
+        use_cache=not args.no_cache,
+        config=index_config(type=args.index_type, nlist=args.nlist, train_size=args.train_size,
+                            hnsw_m=args.hnsw_m, pq_m=args.pq_m, pq_bits=args.pq_bits, fp16=args.fp16),
+    )
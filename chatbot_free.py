@@ -1,57 +1,25 @@
-# chatbot_free.py — NOW WITH GEMINI 1.5 FLASH 🚀
-import os
-import json
-from langchain.docstore.document import Document
-from langchain.text_splitter import RecursiveCharacterTextSplitter
-from langchain_huggingface import HuggingFaceEmbeddings
-from langchain_community.vectorstores import FAISS
-from langchain.chains import RetrievalQA
-from langchain_google_genai import ChatGoogleGenerativeAI  # ✅ Gemini Integration
+# chatbot_free.py — NOW WITH GEMINI 1.5 FLASH 🚀 (or a local CPU model: LLM_BACKEND=local)
 from dotenv import load_dotenv
 
-load_dotenv()
+load_dotenv()  # Before the RAG modules read LLM_BACKEND / QUERY_LOG
 
-# --- Load scraped docs ---
-with open("data/docs.json", "r", encoding="utf-8") as f:
-    raw_docs = json.load(f)
+from llm_backends import get_backend
+from metrics import trace
+from rag_service import get_service
 
-documents = [
-    Document(page_content=doc["content"], metadata={"source": doc["url"]})
-    for doc in raw_docs
-]
-
-# --- Split text ---
-text_splitter = RecursiveCharacterTextSplitter(chunk_size=500, chunk_overlap=50)
-splits = text_splitter.split_documents(documents)
-
-# --- Embeddings (FREE LOCAL) ---
-embeddings = HuggingFaceEmbeddings(model_name="sentence-transformers/all-MiniLM-L6-v2")
-
-# --- Vector Store ---
-vectorstore = FAISS.from_documents(splits, embeddings)
-
-# --- LLM: GEMINI 2.5 FLASH (FREE & FAST) ---
-llm = ChatGoogleGenerativeAI(
-    model="gemini-2.5-flash",       # ✅ Super fast, great for docs
-    google_api_key=os.getenv("GEMINI_API_KEY"),
-    temperature=0.1,
-    max_tokens=512,
-)
-
-# --- QA Chain ---
-qa_chain = RetrievalQA.from_chain_type(
-    llm=llm,
-    retriever=vectorstore.as_retriever(search_kwargs={"k": 2}),
-    return_source_documents=True
-)
+# --- RAG Service (shared with the web app) ---
+# Nothing is built at import: the persisted index, embeddings (FREE LOCAL) and the
+# LLM backend load once, on the first question or in __main__ below.
+service = get_service()
 
 # --- Chat Interface ---
 def ask_question(query):
     print(f"\n💬 You: {query}")
     try:
-        # Use .invoke() — modern LangChain
-        result = qa_chain.invoke({"query": query})
-        answer = result["result"]
+        # Retrieval (BM25 + vector) and the LLM backend, or the answer cache for repeat questions
+        with trace("cli", query) as query_trace:
+            result = service.warm().answer(query)
+        answer = result["answer"]
 
         # Clean verbose output (if any)
         if "Answer:" in answer:
@@ -59,16 +27,17 @@ def ask_question(query):
         if "Question:" in answer:
             answer = answer.split("Question:")[0].strip()
 
-        print(f"🤖 Bot: {answer}")
-        sources = [doc.metadata["source"] for doc in result["source_documents"]]
-        print(f"📚 Source: {', '.join(sources[:2])}")  # Show top 2 sources
+        print(f"🤖 Bot{' (cached)' if 'cache' in result else ''}: {answer}")
+        print(f"📚 Source: {', '.join(result['sources'][:2])}")  # Show top 2 sources
+        print(f"⏱️ {query_trace.summary()}")
 
     except Exception as e:
         print(f"❌ Error: {e}")
         print("💡 Tip: Check your GEMINI_API_KEY in .env or internet connection.")
 
 if __name__ == "__main__":
-    print("🚀 CapillaryTech Chatbot (Powered by Gemini 1.5 Flash) Ready!")
+    service.warm()
+    print(f"🚀 CapillaryTech Chatbot (Powered by {get_backend().describe()}) Ready!")
     print("Ask me anything about Capillary APIs, customers, or campaigns.\n")
 
     # Example queries
@@ -80,5 +49,6 @@ if __name__ == "__main__":
     while True:
         q = input("\n💬 You: ")
         if q.lower() in ["exit", "quit"]:
+            service.answer_cache.report()
             break
         ask_question(q)
\ No newline at end of file
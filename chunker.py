@@ -0,0 +1,310 @@
+# chunker.py — structure-aware, token-sized chunking of extracted doc text (parallel + cached per document)
+import os
+import re
+import json
+import sqlite3
+import hashlib
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Tuple
+from langchain.docstore.document import Document
+
+CHUNKER_VERSION = 1            # Bump when the chunking rules change (invalidates the cache and the index)
+CHUNK_TOKENS = 200             # Target size; all-MiniLM-L6-v2 truncates its input at 256 word pieces
+CHUNK_CACHE_PATH = "data/chunk_cache.sqlite"
+CHUNK_WORKERS = os.cpu_count() or 1
+PARALLEL_MIN_DOCS = 16         # Below this many uncached documents, a process pool is not worth starting
+BATCH_DOCS = 256               # Documents read ahead from the stream per pool round
+CHARS_PER_TOKEN = 4            # Fallback estimate when no tokenizer is available
+
+# Chunks are counted in worker processes; the Rust tokenizer's own thread pool would only fight the pool
+os.environ.setdefault("TOKENIZERS_PARALLELISM", "false")
+
+FENCE = "```"
+HEADING_RE = re.compile(r"^(#{1,6})\s+(.*)$")
+SENTENCE_RE = re.compile(r"(?<=[.!?:;])\s+")
+
+# --- Token counting (one tokenizer per process, loaded on first use) ---
+_counters: Dict[str, Callable[[str], int]] = {}
+
+def estimate_tokens(text: str) -> int:
+    return max(1, (len(text) + CHARS_PER_TOKEN - 1) // CHARS_PER_TOKEN)
+
+def token_counter(tokenizer: Optional[str]) -> Callable[[str], int]:
+    """len(word pieces) with the embedding model's fast tokenizer, or a character estimate."""
+    if not tokenizer:
+        return estimate_tokens
+    if tokenizer not in _counters:
+        try:
+            from transformers import AutoTokenizer
+            tok = AutoTokenizer.from_pretrained(tokenizer)
+            _counters[tokenizer] = lambda text: len(tok.encode(text, add_special_tokens=False))
+        except Exception as e:  # Not installed / offline: sizes become approximate
+            print(f"⚠️ Tokenizer '{tokenizer}' unavailable ({type(e).__name__}), estimating tokens from length.")
+            _counters[tokenizer] = estimate_tokens
+    return _counters[tokenizer]
+
+def effective_tokenizer(tokenizer: Optional[str]) -> Optional[str]:
+    """`tokenizer` if it loads in this process, else None: the name of what actually counts tokens."""
+    if not tokenizer or token_counter(tokenizer) is estimate_tokens:
+        return None
+    return tokenizer
+
+# --- Block parsing ---
+def parse_blocks(text: str) -> List[Tuple[str, str]]:
+    """Split extracted text into (kind, text) blocks: heading, code, table, list or text.
+
+    Blocks are separated by blank lines, except inside ``` fences, which are
+    kept whole however many blank lines they contain.
+    """
+    blocks, paragraph, code = [], [], None
+    for line in text.split("\n"):
+        if code is not None:
+            code.append(line)
+            if line.strip() == FENCE:
+                blocks.append(("code", "\n".join(code)))
+                code = None
+            continue
+        if line.strip().startswith(FENCE):
+            if paragraph:
+                blocks.append(_classify(paragraph))
+                paragraph = []
+            code = [line]
+            continue
+        if not line.strip():
+            if paragraph:
+                blocks.append(_classify(paragraph))
+                paragraph = []
+            continue
+        if HEADING_RE.match(line) and paragraph:  # A heading always starts its own block
+            blocks.append(_classify(paragraph))
+            paragraph = []
+        paragraph.append(line)
+        if HEADING_RE.match(line):
+            blocks.append(_classify(paragraph))
+            paragraph = []
+    if code is not None:  # Unterminated fence
+        blocks.append(("code", "\n".join(code + [FENCE])))
+    if paragraph:
+        blocks.append(_classify(paragraph))
+    return blocks
+
+def _classify(lines: List[str]) -> Tuple[str, str]:
+    text = "\n".join(lines)
+    if len(lines) == 1 and HEADING_RE.match(lines[0]):
+        return "heading", text
+    if len(lines) > 1 and all(" | " in line for line in lines):
+        return "table", text
+    if lines[0].startswith("- "):
+        return "list", text
+    return "text", text
+
+# --- Splitting oversized blocks ---
+def _pack_pieces(pieces: List[str], limit: int, count: Callable[[str], int], joiner: str,
+                 header: str = "", footer: str = "") -> List[str]:
+    """Greedily join pieces into parts of at most `limit` tokens, each wrapped in header/footer."""
+    parts, current, size = [], [], count(header + footer) if header or footer else 0
+    base = size
+    for piece in pieces:
+        piece_tokens = count(piece)
+        if current and size + piece_tokens > limit:
+            parts.append(header + joiner.join(current) + footer)
+            current, size = [], base
+        current.append(piece)
+        size += piece_tokens
+    if current:
+        parts.append(header + joiner.join(current) + footer)
+    return parts
+
+def split_block(kind: str, text: str, limit: int, count: Callable[[str], int]) -> List[str]:
+    """A block larger than `limit`, cut at boundaries that keep each part readable on its own."""
+    if kind == "code":
+        lines = text.split("\n")
+        opening = lines[0] + "\n"
+        body = lines[1:-1] if lines[-1].strip() == FENCE else lines[1:]
+        return _pack_pieces(body, limit, count, "\n", header=opening, footer="\n" + FENCE)
+    if kind == "table":
+        header, *rows = text.split("\n")
+        return _pack_pieces(rows, limit, count, "\n", header=header + "\n")  # Repeat the header row
+    pieces = []
+    for sentence in SENTENCE_RE.split(text):
+        if count(sentence) <= limit:
+            pieces.append(sentence)
+        else:  # One huge "sentence" (minified JSON, long URL lists): fall back to words
+            pieces.extend(_pack_pieces(sentence.split(" "), limit, count, " "))
+    return _pack_pieces(pieces, limit, count, " ")
+
+# --- Chunking ---
+def chunk_text(text: str, chunk_tokens: int = CHUNK_TOKENS, tokenizer: Optional[str] = None) -> List[Dict]:
+    """Structure-aware chunks of one document: [{"text", "section"}].
+
+    - A chunk never ends with a heading; a heading starts a new chunk.
+    - Code fences and tables are not cut unless they alone exceed the
+      budget (then code is re-fenced and table headers repeated per part).
+    - Each chunk is prefixed with the headings above it ("Page > Section")
+      when it does not start with them, so it stands on its own when
+      retrieved.
+    """
+    count = token_counter(tokenizer)
+    chunks: List[Dict] = []
+    trail: List[Tuple[int, str]] = []
+    current: List[str] = []
+    current_tokens = 0
+    current_trail = ""
+    has_body = False
+
+    def start():
+        nonlocal current_trail, current_tokens
+        current_trail = " > ".join(title for _, title in trail)
+        current_tokens = count(current_trail) if current_trail else 0
+
+    def flush():
+        nonlocal current, current_tokens, has_body
+        if has_body:
+            body = "\n\n".join(current)
+            chunks.append({"text": f"{current_trail}\n\n{body}" if current_trail else body,
+                           "section": current_trail})
+        current, current_tokens, has_body = [], 0, False
+
+    for kind, block in parse_blocks(text):
+        if kind == "heading":
+            if has_body:
+                flush()
+            level, title = HEADING_RE.match(block).groups()
+            while trail and trail[-1][0] >= len(level):
+                trail.pop()
+            if not current:
+                start()
+            trail.append((len(level), title.strip()))
+            current.append(block)
+            current_tokens += count(block)
+            continue
+        block_tokens = count(block)
+        parts = [block] if block_tokens <= chunk_tokens else split_block(kind, block, chunk_tokens, count)
+        for part in parts:
+            part_tokens = block_tokens if len(parts) == 1 else count(part)
+            if has_body and current_tokens + part_tokens > chunk_tokens:
+                flush()
+            if not current:
+                start()
+            current.append(part)
+            current_tokens += part_tokens
+            has_body = True
+    flush()
+    return chunks
+
+def _chunk_job(args: Tuple[str, int, Optional[str]]) -> List[Dict]:
+    return chunk_text(*args)
+
+def chunker_params(chunk_tokens: int = CHUNK_TOKENS, tokenizer: Optional[str] = None) -> Dict:
+    """Recorded in the index manifest: a change re-chunks and re-embeds the corpus.
+
+    After a tokenizer fallback the estimate is recorded, so estimate-sized chunks
+    are redone once the tokenizer becomes available.
+    """
+    return {"splitter": "structure", "version": CHUNKER_VERSION, "chunk_tokens": chunk_tokens,
+            "tokenizer": effective_tokenizer(tokenizer)}
+
+# --- Cache ---
+class ChunkCache:
+    """SQLite map of (chunker params + document hash) -> chunk list, used from the parent process only."""
+
+    def __init__(self, path: str = CHUNK_CACHE_PATH):
+        self.path = path
+        self.lock = threading.Lock()
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("CREATE TABLE IF NOT EXISTS chunks (key TEXT PRIMARY KEY, chunks TEXT NOT NULL)")
+
+    def get_many(self, keys: List[str]) -> Dict[str, List[Dict]]:
+        found = {}
+        with self.lock:
+            for i in range(0, len(keys), 500):
+                batch = keys[i:i + 500]
+                rows = self.conn.execute(
+                    f"SELECT key, chunks FROM chunks WHERE key IN ({','.join('?' * len(batch))})", batch)
+                found.update((key, json.loads(value)) for key, value in rows)
+        return found
+
+    def put_many(self, items: Dict[str, List[Dict]]):
+        with self.lock:
+            self.conn.executemany("INSERT OR REPLACE INTO chunks (key, chunks) VALUES (?, ?)",
+                                  [(key, json.dumps(value, ensure_ascii=False)) for key, value in items.items()])
+            self.conn.commit()
+
+class StructureChunker:
+    """Drop-in for the LangChain text splitter (`split_documents`) plus a parallel, cached `map`.
+
+    `chunker(document)` chunks one document; `chunker.map(documents)` streams
+    (document, chunks) pairs, reading unchanged documents from the cache and
+    chunking the rest across a process pool.
+    """
+
+    def __init__(self, chunk_tokens: int = CHUNK_TOKENS, tokenizer: Optional[str] = None,
+                 workers: int = CHUNK_WORKERS, cache_path: Optional[str] = CHUNK_CACHE_PATH):
+        self.chunk_tokens = chunk_tokens
+        self.tokenizer = effective_tokenizer(tokenizer)  # Workers count with what the params record
+        self.workers = workers
+        self.cache = ChunkCache(cache_path) if cache_path else None
+        self.stats = {"cached": 0, "chunked": 0}
+
+    @property
+    def params(self) -> Dict:
+        return chunker_params(self.chunk_tokens, self.tokenizer)
+
+    def cache_key(self, text: str) -> str:
+        params = json.dumps(self.params, sort_keys=True)
+        return hashlib.sha256(f"{params}\0{text}".encode("utf-8")).hexdigest()
+
+    def to_documents(self, document: Document, chunks: List[Dict]) -> List[Document]:
+        return [Document(page_content=chunk["text"],
+                         metadata={**document.metadata, "section": chunk["section"]})
+                for chunk in chunks]
+
+    def map(self, documents: Iterable[Document]) -> Iterator[Tuple[Document, List[Document]]]:
+        pool = None
+        try:
+            batch: List[Document] = []
+            for document in documents:
+                batch.append(document)
+                if len(batch) >= BATCH_DOCS:
+                    pool = yield from self._map_batch(batch, pool)
+                    batch = []
+            if batch:
+                pool = yield from self._map_batch(batch, pool)
+        finally:
+            if pool is not None:
+                pool.shutdown()
+
+    def _map_batch(self, batch: List[Document], pool):
+        keys = [self.cache_key(document.page_content) for document in batch]
+        cached = self.cache.get_many(list(set(keys))) if self.cache else {}
+        missing = [i for i, key in enumerate(keys) if key not in cached]
+        jobs = [(batch[i].page_content, self.chunk_tokens, self.tokenizer) for i in missing]
+        if len(jobs) >= PARALLEL_MIN_DOCS and self.workers > 1:
+            if pool is None:
+                pool = ProcessPoolExecutor(max_workers=self.workers)
+            results = list(pool.map(_chunk_job, jobs, chunksize=max(1, len(jobs) // (self.workers * 4))))
+        else:
+            results = [_chunk_job(job) for job in jobs]
+        computed = {keys[i]: chunks for i, chunks in zip(missing, results)}
+        if self.cache and computed:
+            self.cache.put_many(computed)
+        self.stats["cached"] += len(batch) - len(missing)
+        self.stats["chunked"] += len(missing)
+        for document, key in zip(batch, keys):
+            yield document, self.to_documents(document, cached[key] if key in cached else computed[key])
+        return pool
+
+    def __call__(self, document: Document) -> List[Document]:
+        return next(self.map([document]))[1]
+
+    def split_documents(self, documents: Iterable[Document]) -> List[Document]:
+        return [chunk for _, chunks in self.map(documents) for chunk in chunks]
+
+    def report(self):
+        total = self.stats["cached"] + self.stats["chunked"]
+        print(f"✂️ Chunker: {self.stats['chunked']} documents chunked, {self.stats['cached']} from cache "
+              f"({total} total)")
+        self.stats = {"cached": 0, "chunked": 0}
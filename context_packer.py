@@ -0,0 +1,153 @@
+# context_packer.py — merge, de-duplicate and token-budget the retrieved chunks before the LLM call
+import os
+import re
+from typing import Callable, Dict, List, Optional, Set
+from langchain.docstore.document import Document
+from langchain_core.callbacks import CallbackManagerForRetrieverRun
+from langchain_core.retrievers import BaseRetriever
+from metrics import annotate, span
+
+CONTEXT_TOKEN_BUDGET = int(os.getenv("CONTEXT_TOKEN_BUDGET", "800"))
+MAX_OVERLAP_CHARS = 400     # Longest chunk overlap searched for (overlapping character splitters)
+MIN_OVERLAP_CHARS = 12      # Shorter suffix/prefix matches are treated as coincidence
+DUPLICATE_CONTAINMENT = 0.8 # Share of a chunk's word 3-grams already in the context -> drop it
+CHARS_PER_TOKEN = 4         # Gemini / MiniLM-ish average for English technical text
+TRUNCATION_MARKER = " …"    # Ends a passage cut to fit the budget
+
+def estimate_tokens(text: str) -> int:
+    return max(1, (len(text) + CHARS_PER_TOKEN - 1) // CHARS_PER_TOKEN)
+
+def chunk_position(doc: Document) -> Optional[int]:
+    """Index of the chunk inside its source document, from its "<hash>:<i>" chunk id."""
+    chunk_id = doc.metadata.get("chunk_id")
+    if not chunk_id or ":" not in chunk_id:
+        return None
+    try:
+        return int(chunk_id.rsplit(":", 1)[1])
+    except ValueError:
+        return None
+
+def merge_overlap(first: str, second: str) -> Optional[str]:
+    """first + second without the text they share (second starting with first's tail), else None."""
+    limit = min(len(first), len(second), MAX_OVERLAP_CHARS)
+    for size in range(limit, MIN_OVERLAP_CHARS - 1, -1):
+        if first.endswith(second[:size]):
+            return first + second[size:]
+    return None
+
+def shingles(text: str, n: int = 3) -> Set[str]:
+    words = re.findall(r"\w+", text.lower())
+    if len(words) < n:
+        return {" ".join(words)} if words else set()
+    return {" ".join(words[i:i + n]) for i in range(len(words) - n + 1)}
+
+def _merge_neighbours(documents: List[Document]) -> List[Dict]:
+    """Group chunks by source and join consecutive / overlapping ones; keep the best rank of each group."""
+    groups: List[Dict] = []
+    by_source: Dict[str, List[Dict]] = {}
+    for rank, doc in enumerate(documents):
+        source = doc.metadata.get("source")
+        position = chunk_position(doc)
+        merged = False
+        for group in by_source.get(source, []):
+            if position is not None and group["last"] is not None and position == group["last"] + 1:
+                group["text"] = merge_overlap(group["text"], doc.page_content) or \
+                    group["text"] + "\n" + doc.page_content
+            elif position is not None and group["first"] is not None and position == group["first"] - 1:
+                group["text"] = merge_overlap(doc.page_content, group["text"]) or \
+                    doc.page_content + "\n" + group["text"]
+            else:
+                joined = merge_overlap(group["text"], doc.page_content)
+                if joined is None:
+                    continue
+                group["text"] = joined
+            if position is not None:
+                group["first"] = position if group["first"] is None else min(group["first"], position)
+                group["last"] = position if group["last"] is None else max(group["last"], position)
+            group["chunks"].append(doc)
+            merged = True
+            break
+        if not merged:
+            group = {"rank": rank, "source": source, "text": doc.page_content,
+                     "first": position, "last": position, "chunks": [doc]}
+            groups.append(group)
+            by_source.setdefault(source, []).append(group)
+    return groups
+
+def _truncate(text: str, budget: int, count_tokens: Callable[[str], int]) -> str:
+    """Longest prefix within `budget` tokens (marker included), cut at a line or sentence
+    boundary when possible, else between words, and ended with TRUNCATION_MARKER."""
+    low, high = 0, len(text)
+    while low < high:  # Binary search on the prefix length
+        mid = (low + high + 1) // 2
+        if count_tokens(text[:mid] + TRUNCATION_MARKER) <= budget:
+            low = mid
+        else:
+            high = mid - 1
+    prefix = text[:low]
+    cut = max(prefix.rfind("\n"), prefix.rfind(". "))
+    if cut > len(prefix) // 2:
+        prefix = prefix[:cut + 1]
+    elif low < len(text) and not text[low].isspace():  # Mid-word: back off to the last whitespace
+        space = max(prefix.rfind(" "), prefix.rfind("\n"), prefix.rfind("\t"))
+        if space > 0:
+            prefix = prefix[:space]
+    prefix = prefix.rstrip()
+    return prefix + TRUNCATION_MARKER if prefix else ""
+
+def pack_context(documents: List[Document], budget: int = CONTEXT_TOKEN_BUDGET,
+                 count_tokens: Callable[[str], int] = estimate_tokens) -> List[Document]:
+    """Retrieved chunks (best first) -> merged, de-duplicated context that fits in `budget` tokens.
+
+    1. Neighbouring / overlapping chunks of the same source become one passage.
+    2. A passage whose word 3-grams are mostly already in the context is dropped.
+    3. Passages are added in relevance order while they fit; the first one is
+       truncated rather than dropped so the context is never empty.
+    """
+    packed, seen, used = [], set(), 0
+    for group in sorted(_merge_neighbours(documents), key=lambda g: g["rank"]):
+        grams = shingles(group["text"])
+        if grams and len(grams & seen) / len(grams) >= DUPLICATE_CONTAINMENT:
+            continue
+        text = group["text"]
+        tokens = count_tokens(text)
+        if used + tokens > budget:
+            if packed:
+                continue  # A later, shorter passage may still fit
+            text = _truncate(text, budget, count_tokens)
+            tokens = count_tokens(text)
+        seen |= grams
+        used += tokens
+        chunks = group["chunks"]
+        metadata = {**chunks[0].metadata, "tokens": tokens, "merged_chunks": len(chunks)}
+        ids = [doc.metadata["chunk_id"] for doc in chunks if doc.metadata.get("chunk_id")]
+        if ids:
+            metadata["chunk_id"] = ids[0]
+            metadata["chunk_ids"] = ids
+        packed.append(Document(page_content=text, metadata=metadata))
+    return packed
+
+def context_tokens(documents: List[Document], count_tokens: Callable[[str], int] = estimate_tokens) -> int:
+    return sum(count_tokens(doc.page_content) for doc in documents)
+
+class PackedRetriever(BaseRetriever):
+    """Wraps a retriever so every consumer (the `stuff` chain, the RAG service) gets a packed context."""
+
+    base: BaseRetriever
+    budget: int = CONTEXT_TOKEN_BUDGET
+
+    def _get_relevant_documents(self, query: str, *, run_manager: CallbackManagerForRetrieverRun) -> List[Document]:
+        documents = self.base.invoke(query, config={"callbacks": run_manager.get_child()})
+        with span("pack"):
+            packed = pack_context(documents, self.budget)
+        annotate(retrieved=len(documents), packed=len(packed), context_tokens=context_tokens(packed))
+        return packed
+
+    def batch_documents(self, queries: List[str], vectors=None) -> List[List[Document]]:
+        """Packed contexts for many queries, through the base retriever's batched search when it has one."""
+        if hasattr(self.base, "batch_documents"):
+            results = self.base.batch_documents(queries, vectors)
+        else:
+            results = self.base.batch(list(queries))
+        with span("pack"):
+            return [pack_context(documents, self.budget) for documents in results]
@@ -0,0 +1,101 @@
+# corpus.py — streaming JSONL corpus shared by the scrapers and the RAG loaders
+import os
+import json
+from typing import Dict, Iterator, Optional, Set
+
+CORPUS_FILE = "data/docs.jsonl"        # One {"url", "content"} record per line
+LEGACY_CORPUS_FILE = "data/docs.json"  # Old single-array format, still readable
+
+def resolve_corpus_path(path: Optional[str] = None) -> str:
+    """Use the given path, else the JSONL corpus, else fall back to the legacy docs.json."""
+    if path:
+        return path
+    if os.path.exists(CORPUS_FILE) or not os.path.exists(LEGACY_CORPUS_FILE):
+        return CORPUS_FILE
+    return LEGACY_CORPUS_FILE
+
+def _read_records(path: str) -> Iterator[Dict]:
+    """Yield raw JSONL records, tolerating a torn last line from an interrupted write."""
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            if not line.strip():
+                continue
+            try:
+                yield json.loads(line)
+            except json.JSONDecodeError:
+                print(f"⚠️ Skipping unreadable corpus line in {path}")
+
+def iter_corpus(path: Optional[str] = None) -> Iterator[Dict]:
+    """Lazily yield the live {"url", "content"} records of a corpus.
+
+    The JSONL file is append-only: a later record for the same URL replaces
+    an earlier one and {"url", "deleted": true} removes it. A first pass only
+    remembers which line holds the latest record per URL, so memory stays
+    proportional to the number of URLs, not to the size of the corpus.
+    """
+    path = resolve_corpus_path(path)
+    if path.endswith(".json"):
+        with open(path, "r", encoding="utf-8") as f:
+            yield from json.load(f)
+        return
+
+    latest: Dict[str, int] = {}
+    for line_no, record in enumerate(_read_records(path)):
+        latest[record["url"]] = line_no
+    for line_no, record in enumerate(_read_records(path)):
+        if latest.get(record["url"]) == line_no and not record.get("deleted"):
+            yield record
+
+def compact(path: str = CORPUS_FILE):
+    """Rewrite the corpus keeping only live records (drops superseded versions and tombstones)."""
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        for record in iter_corpus(path):
+            f.write(json.dumps(record, ensure_ascii=False) + "\n")
+    os.replace(tmp_path, path)
+
+class CorpusWriter:
+    """Appends one JSONL record per scraped page, flushed immediately.
+
+    With `resume=True` an existing corpus is kept and `urls` holds the pages
+    it already contains, so a crashed crawl can pick up where it stopped.
+    Otherwise the file is truncated and the crawl starts from scratch.
+    """
+
+    def __init__(self, path: str = CORPUS_FILE, resume: bool = False):
+        self.path = path
+        self.urls: Set[str] = set()
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        torn = False
+        if resume and os.path.exists(path):
+            self.urls = {record["url"] for record in iter_corpus(path)}
+            with open(path, "rb") as f:
+                f.seek(0, os.SEEK_END)
+                if f.tell():
+                    f.seek(-1, os.SEEK_END)
+                    torn = f.read(1) != b"\n"
+        self.file = open(path, "a" if resume else "w", encoding="utf-8")
+        if torn:
+            self.file.write("\n")  # Don't glue the next record onto a half-written line
+
+    def write(self, url: str, content: str):
+        self._append({"url": url, "content": content})
+        self.urls.add(url)
+
+    def delete(self, url: str):
+        """Record a tombstone so readers stop returning this URL."""
+        self._append({"url": url, "deleted": True})
+        self.urls.discard(url)
+
+    def _append(self, record: Dict):
+        self.file.write(json.dumps(record, ensure_ascii=False) + "\n")
+        self.file.flush()
+
+    def close(self):
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
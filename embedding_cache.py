@@ -0,0 +1,123 @@
+# embedding_cache.py — on-disk embedding cache keyed by hash(model name + chunk text)
+import os
+import sqlite3
+import hashlib
+import threading
+from array import array
+from collections import OrderedDict
+from typing import Dict, List, Optional
+from langchain_core.embeddings import Embeddings
+
+EMBEDDING_CACHE_PATH = "data/embedding_cache.sqlite"
+SQL_BATCH = 500  # Keys per SELECT ... IN (...) (SQLite caps bound parameters)
+QUERY_CACHE_ENTRIES = int(os.getenv("QUERY_EMBEDDING_CACHE_ENTRIES", "1024"))  # In memory, per process
+
+def cache_key(model_name: str, text: str, kind: str = "doc") -> str:
+    return hashlib.sha256(f"{kind}\0{model_name}\0{text}".encode("utf-8")).hexdigest()
+
+class CachedEmbeddings(Embeddings):
+    """Wraps any LangChain Embeddings and stores chunk vectors in SQLite as float32.
+
+    Chunks whose (model, text) hash is already in the cache are never
+    re-encoded, so a small docs change only pays for the chunks it touched.
+    Query vectors (arbitrary user input) only go to a bounded in-memory LRU.
+    The connection is opened lazily per process, so a store created before
+    a gunicorn fork is safe to use in the workers. Hit/miss counters are
+    kept for report().
+    """
+
+    def __init__(self, base: Embeddings, model_name: Optional[str] = None,
+                 path: str = EMBEDDING_CACHE_PATH):
+        self.base = base
+        self.model_name = model_name or getattr(base, "model_name", type(base).__name__)
+        self.path = path
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+        self.queries: "OrderedDict[str, List[float]]" = OrderedDict()
+        self._conn, self._pid = None, None
+
+    @property
+    def conn(self) -> sqlite3.Connection:
+        """Call with self.lock held."""
+        if self._pid != os.getpid():
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            self._conn = sqlite3.connect(self.path, check_same_thread=False)
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("CREATE TABLE IF NOT EXISTS embeddings (key TEXT PRIMARY KEY, vector BLOB NOT NULL)")
+            self._pid = os.getpid()
+        return self._conn
+
+    def _lookup(self, keys: List[str]) -> Dict[str, List[float]]:
+        found = {}
+        with self.lock:
+            for i in range(0, len(keys), SQL_BATCH):
+                batch = keys[i:i + SQL_BATCH]
+                placeholders = ",".join("?" * len(batch))
+                rows = self.conn.execute(
+                    f"SELECT key, vector FROM embeddings WHERE key IN ({placeholders})", batch)
+                for key, blob in rows:
+                    found[key] = array("f", blob).tolist()
+        return found
+
+    def _store(self, items: Dict[str, List[float]]):
+        with self.lock:
+            self.conn.executemany(
+                "INSERT OR REPLACE INTO embeddings (key, vector) VALUES (?, ?)",
+                [(key, array("f", vector).tobytes()) for key, vector in items.items()])
+            self.conn.commit()
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        keys = [cache_key(self.model_name, text) for text in texts]
+        vectors = self._lookup(list(set(keys)))
+
+        # Encode each missing text once, even if it appears several times
+        missing = {}
+        for key, text in zip(keys, texts):
+            if key not in vectors:
+                missing.setdefault(key, text)
+        self.hits += len(texts) - sum(1 for key in keys if key in missing)
+        self.misses += len(missing)
+        if missing:
+            computed = self.base.embed_documents(list(missing.values()))
+            new_vectors = dict(zip(missing.keys(), computed))
+            self._store(new_vectors)
+            vectors.update(new_vectors)
+        return [vectors[key] for key in keys]
+
+    def embed_query(self, text: str) -> List[float]:
+        return self.embed_queries([text])[0]
+
+    def embed_queries(self, texts: List[str]) -> List[List[float]]:
+        """Many queries in one base.embed_documents call, through the in-memory LRU only."""
+        vectors = {}
+        with self.lock:
+            for text in texts:
+                vector = self.queries.get(text)
+                if vector is not None:
+                    self.queries.move_to_end(text)
+                    vectors[text] = vector
+        missing = list(dict.fromkeys(text for text in texts if text not in vectors))
+        if len(missing) == 1:
+            vectors[missing[0]] = self.base.embed_query(missing[0])
+        elif missing:
+            vectors.update(zip(missing, self.base.embed_documents(missing)))
+        with self.lock:
+            for text in missing:
+                self.queries[text] = vectors[text]
+            while len(self.queries) > QUERY_CACHE_ENTRIES:
+                self.queries.popitem(last=False)
+        return [vectors[text] for text in texts]
+
+    def report(self):
+        """Print and reset the hit/miss counters of the last build."""
+        total = self.hits + self.misses
+        rate = self.hits / total if total else 0.0
+        print(f"🧠 Embedding cache: {self.hits} hits, {self.misses} misses ({rate:.0%} hit rate) — {self.path}")
+        self.hits = self.misses = 0
+
+def embed_queries(embeddings: Embeddings, texts: List[str]) -> List[List[float]]:
+    """Batch query embedding that never writes to the persistent chunk cache."""
+    if hasattr(embeddings, "embed_queries"):
+        return embeddings.embed_queries(texts)
+    return embeddings.embed_documents(texts)
\ No newline at end of file
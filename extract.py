@@ -0,0 +1,278 @@
+# extract.py — single-pass HTML → text extraction with selectable parser backends
+from typing import Dict, Iterator, List, Optional, Tuple
+
+# Fastest first; the first importable one is the default
+BACKENDS = ("selectolax", "lxml", "html.parser")
+MIN_BLOCK_CHARS = 15  # Plain-text blocks shorter than this are navigation noise
+
+HEADING_TAGS = {"h1", "h2", "h3", "h4", "h5", "h6"}
+SKIP_TAGS = {"head", "script", "style", "noscript", "template", "svg", "iframe", "button", "form"}
+BLOCK_TAGS = {
+    "p", "div", "section", "article", "main", "aside", "header", "footer", "nav",
+    "ul", "ol", "dl", "dt", "dd", "blockquote", "figure", "figcaption", "details",
+    "summary", "hr", "body", "html",
+}
+
+_BR = "\x00"  # Marks a <br> inside inline text; all other whitespace collapses
+
+# --- Parser adapters ---
+# Each adapter exposes parse(html), root(tree), children(node) and hrefs(tree);
+# children yields (None, text) for text nodes and (tag_name, node) for
+# elements, with comments already dropped, so the walker below is backend
+# independent.
+
+class _Bs4Adapter:
+    def __init__(self, parser: str = "html.parser"):
+        from bs4 import BeautifulSoup
+        from bs4.element import NavigableString, PreformattedString, Tag
+        self.BeautifulSoup = BeautifulSoup
+        self.NavigableString = NavigableString
+        self.PreformattedString = PreformattedString
+        self.Tag = Tag
+        self.parser = parser
+
+    def parse(self, html: str):
+        return self.BeautifulSoup(html, self.parser)
+
+    def root(self, soup):
+        # Main content container (based on inspection of CapillaryTech docs structure)
+        return soup.find('div', class_='main-content') or \
+               soup.find('article') or \
+               soup.find('div', role='main') or \
+               soup.find('main') or \
+               soup
+
+    def children(self, node) -> Iterator[Tuple[Optional[str], object]]:
+        for child in node.children:
+            if isinstance(child, self.Tag):
+                yield child.name, child
+            elif isinstance(child, self.NavigableString) and not isinstance(child, self.PreformattedString):
+                yield None, str(child)
+
+    def hrefs(self, soup) -> List[str]:
+        return [a_tag['href'] for a_tag in soup.find_all('a', href=True)]
+
+class _LxmlAdapter:
+    def __init__(self):
+        import lxml.etree
+        import lxml.html
+        self.lxml_html = lxml.html
+        self.etree = lxml.etree
+
+    def parse(self, html: str):
+        try:
+            return self.lxml_html.document_fromstring(html)
+        except ValueError:  # A str with an <?xml ... encoding=...?> declaration: hand lxml UTF-8 bytes
+            parser = self.lxml_html.HTMLParser(encoding="utf-8")
+            try:
+                return self.lxml_html.document_fromstring(html.encode("utf-8"), parser=parser)
+            except self.etree.ParserError:
+                pass
+        except self.etree.ParserError:  # "Document is empty": blank or comment-only page
+            pass
+        return self.lxml_html.document_fromstring("<html><body></body></html>")
+
+    def root(self, doc):
+        for xpath in ("//div[contains(concat(' ', normalize-space(@class), ' '), ' main-content ')]",
+                      "//article", "//div[@role='main']", "//main"):
+            found = doc.xpath(xpath)
+            if found:
+                return found[0]
+        return doc
+
+    def children(self, node):
+        if node.text:
+            yield None, node.text
+        for child in node:
+            if isinstance(child.tag, str):  # Comments / PIs have a callable tag
+                yield child.tag.lower(), child
+            if child.tail:
+                yield None, child.tail
+
+    def hrefs(self, doc):
+        return [str(href) for href in doc.xpath("//a/@href")]
+
+class _SelectolaxAdapter:
+    def __init__(self):
+        from selectolax.lexbor import LexborHTMLParser
+        self.Parser = LexborHTMLParser
+
+    def parse(self, html: str):
+        return self.Parser(html)
+
+    def root(self, tree):
+        for selector in ("div.main-content", "article", 'div[role="main"]', "main"):
+            found = tree.css_first(selector)
+            if found is not None:
+                return found
+        return tree.body or tree.root
+
+    def children(self, node):
+        for child in node.iter(include_text=True):
+            tag = child.tag
+            if tag == "-text":
+                yield None, child.text_content or ""
+            elif not tag.startswith(("-", "_", "!")):
+                yield tag, child
+
+    def hrefs(self, tree):
+        return [node.attributes.get("href") or "" for node in tree.css("a[href]")]
+
+_ADAPTERS: Dict[str, object] = {}
+
+def available_backends() -> List[str]:
+    """Backends whose parser library is installed, fastest first."""
+    names = []
+    for name in BACKENDS:
+        try:
+            get_adapter(name)
+            names.append(name)
+        except ImportError:
+            pass
+    return names
+
+def default_backend() -> str:
+    return available_backends()[0]
+
+def fastest_bs4_parser() -> str:
+    """Parser name for BeautifulSoup: lxml's C parser when installed, else the stdlib one."""
+    try:
+        import lxml  # noqa: F401
+        return "lxml"
+    except ImportError:
+        return "html.parser"
+
+def get_adapter(backend: Optional[str] = None):
+    """Return the (cached) adapter for a backend name; bs4 parser names are accepted too."""
+    backend = backend or default_backend()
+    if backend not in _ADAPTERS:
+        if backend == "selectolax":
+            _ADAPTERS[backend] = _SelectolaxAdapter()
+        elif backend == "lxml":
+            _ADAPTERS[backend] = _LxmlAdapter()
+        elif backend in ("html.parser", "bs4"):
+            _ADAPTERS[backend] = _Bs4Adapter("html.parser")
+        elif backend.startswith("bs4-"):
+            _ADAPTERS[backend] = _Bs4Adapter(backend[4:])
+        else:
+            raise ValueError(f"Unknown extraction backend: {backend}")
+    return _ADAPTERS[backend]
+
+# --- Single-pass walker ---
+class _BlockWalker:
+    """Visits every node once and emits non-overlapping text blocks.
+
+    Inline text accumulates until a block boundary. Headings become
+    markdown '#' lines, <pre> becomes a fenced code block (whitespace kept),
+    tables become ' | '-separated rows and list items get a '- ' prefix.
+    Nested blocks (a <p> inside an <li>, <code> inside <pre>) are never
+    emitted twice, and repeated identical blocks are dropped.
+    """
+
+    def __init__(self, adapter):
+        self.adapter = adapter
+        self.blocks: List[str] = []
+        self.seen = set()
+        self.buffer: List[str] = []
+        self.prefix = ""
+
+    def walk(self, node):
+        for tag, child in self.adapter.children(node):
+            if tag is None:
+                self.buffer.append(child)
+            elif tag in SKIP_TAGS:
+                continue
+            elif tag == "br":
+                self.buffer.append(_BR)
+            elif tag in HEADING_TAGS:
+                self.flush()
+                text = self.inline_text(child)
+                if text:
+                    self.emit("#" * int(tag[1]) + " " + text)
+            elif tag == "pre":
+                self.flush()
+                code = self.raw_text(child).strip("\n")
+                if code.strip():
+                    self.emit("```\n" + code + "\n```")
+            elif tag == "table":
+                self.flush()
+                rows = [" | ".join(cells) for cells in self.table_rows(child) if any(cells)]
+                if rows:
+                    self.emit("\n".join(rows))
+            elif tag == "li":
+                self.flush()
+                self.prefix = "- "
+                self.walk(child)
+                self.flush()
+                self.prefix = ""
+            elif tag in BLOCK_TAGS:
+                self.flush()
+                self.walk(child)
+                self.flush()
+            else:
+                self.walk(child)  # Inline element: its text joins the current block
+
+    def flush(self):
+        lines = (" ".join(line.split()) for line in "".join(self.buffer).split(_BR))
+        text = "\n".join(line for line in lines if line)
+        self.buffer = []
+        if len(text) > MIN_BLOCK_CHARS:  # Avoid tiny fragments
+            self.emit(self.prefix + text)
+            self.prefix = ""
+
+    def emit(self, block: str):
+        key = " ".join(block.split())
+        if key not in self.seen:
+            self.seen.add(key)
+            self.blocks.append(block)
+
+    def raw_text(self, node) -> str:
+        parts = []
+        for tag, child in self.adapter.children(node):
+            if tag is None:
+                parts.append(child)
+            elif tag == "br":
+                parts.append("\n")
+            elif tag not in SKIP_TAGS:
+                parts.append(self.raw_text(child))
+        return "".join(parts)
+
+    def inline_text(self, node) -> str:
+        return " ".join(self.raw_text(node).split())
+
+    def table_rows(self, node) -> List[List[str]]:
+        rows = []
+        for tag, child in self.adapter.children(node):
+            if tag == "tr":
+                rows.append([self.inline_text(cell) for cell_tag, cell in self.adapter.children(child)
+                             if cell_tag in ("td", "th")])
+            elif tag in ("thead", "tbody", "tfoot"):
+                rows.extend(self.table_rows(child))
+        return rows
+
+def extract_blocks_from_tree(tree, backend: Optional[str] = None) -> List[str]:
+    """Extract deduplicated text blocks from an already parsed document."""
+    adapter = get_adapter(backend)
+    walker = _BlockWalker(adapter)
+    walker.walk(adapter.root(tree))
+    walker.flush()
+    return walker.blocks
+
+def extract_blocks(html: str, backend: Optional[str] = None) -> List[str]:
+    """Parse HTML with the chosen backend and return its content blocks."""
+    if not html or not html.strip():
+        return []
+    adapter = get_adapter(backend)
+    return extract_blocks_from_tree(adapter.parse(html), backend)
+
+def extract_text(html: str, backend: Optional[str] = None) -> str:
+    """Main content of a doc page as blank-line separated blocks."""
+    return "\n\n".join(extract_blocks(html, backend))
+
+def extract_page(html: str, backend: Optional[str] = None) -> Tuple[List[str], List[str]]:
+    """Parse once and return (content blocks, raw href values of every <a>)."""
+    if not html or not html.strip():
+        return [], []
+    adapter = get_adapter(backend)
+    tree = adapter.parse(html)
+    return extract_blocks_from_tree(tree, backend), adapter.hrefs(tree)
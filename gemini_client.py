@@ -0,0 +1,278 @@
+# gemini_client.py — pooled async Gemini client: keep-alive, rate limit, timeouts, request coalescing
+import os
+import json
+import time
+import queue
+import random
+import asyncio
+import hashlib
+import threading
+from concurrent.futures import Future
+from typing import AsyncIterator, Dict, Iterator, Optional
+import httpx
+from metrics import count, current_trace
+
+GEMINI_BASE_URL = os.getenv("GEMINI_BASE_URL", "https://generativelanguage.googleapis.com/v1beta")
+GEMINI_MODEL = os.getenv("GEMINI_MODEL", "gemini-2.5-flash-preview-05-20")
+MAX_CONCURRENCY = int(os.getenv("GEMINI_MAX_CONCURRENCY", "8"))  # Requests in flight at once
+RATE_LIMIT_RPM = float(os.getenv("GEMINI_RPM", "60"))           # Free-tier quota
+CONNECT_TIMEOUT = 5.0
+READ_TIMEOUT = 30.0
+REQUEST_TIMEOUT = 45.0  # Whole call, including retries and time spent waiting for a slot
+MAX_RETRIES = 3
+MAX_BACKOFF = 10.0      # Seconds; also caps a server's Retry-After
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+class GeminiError(Exception):
+    """Gemini returned an error status or an unusable response."""
+
+    def __init__(self, message: str, status: Optional[int] = None):
+        super().__init__(message)
+        self.status = status
+
+class AsyncRateLimiter:
+    """Spaces request starts evenly so at most `rpm` begin in any minute."""
+
+    def __init__(self, rpm: float):
+        self.interval = 60.0 / rpm if rpm > 0 else 0.0
+        self.next_slot = 0.0
+        self.lock = asyncio.Lock()
+
+    async def acquire(self):
+        if not self.interval:
+            return
+        async with self.lock:
+            now = time.monotonic()
+            wait = self.next_slot - now
+            self.next_slot = max(now, self.next_slot) + self.interval
+        if wait > 0:
+            await asyncio.sleep(wait)
+
+def retry_delay(attempt: int, retry_after: Optional[str] = None) -> float:
+    """Exponential backoff with jitter; honours a numeric Retry-After, both capped at MAX_BACKOFF."""
+    delay = float(retry_after) if retry_after and retry_after.isdigit() else 2 ** attempt
+    return min(delay, MAX_BACKOFF) + random.uniform(0, 0.25)
+
+def build_payload(prompt: str, system: Optional[str] = None, temperature: float = 0.1,
+                  max_tokens: int = 1024) -> Dict:
+    payload = {
+        "contents": [{"parts": [{"text": prompt}]}],
+        "generationConfig": {"temperature": temperature, "maxOutputTokens": max_tokens},
+    }
+    if system:
+        payload["systemInstruction"] = {"parts": [{"text": system}]}
+    return payload
+
+def response_text(result: Dict) -> str:
+    """Concatenated text parts of the first candidate."""
+    candidates = result.get("candidates") or [{}]
+    parts = candidates[0].get("content", {}).get("parts") or []
+    text = "".join(part.get("text", "") for part in parts)
+    if not text:
+        reason = candidates[0].get("finishReason") or result.get("promptFeedback", {}).get("blockReason")
+        raise GeminiError(f"Model did not return text (reason: {reason or 'unknown'}).")
+    return text
+
+def record_usage(result: Dict, trace=None):
+    """Token counts Gemini reports for a response (usageMetadata), as rag_llm_tokens_{in,out}_total."""
+    usage = result.get("usageMetadata")
+    if usage:
+        count("llm_tokens_in", usage.get("promptTokenCount", 0), trace=trace)
+        count("llm_tokens_out", usage.get("candidatesTokenCount", 0), trace=trace)
+
+class GeminiClient:
+    """One keep-alive HTTP client per process, driven by its own event-loop thread.
+
+    Any thread (a sync Flask view, a CLI) or any other event loop (an async
+    Flask view) can submit work; all calls share the connection pool, the
+    concurrency semaphore and the RPM limiter. Identical requests that are
+    in flight at the same time are sent once and share the response.
+    """
+
+    def __init__(self, api_key: Optional[str] = None, model: str = GEMINI_MODEL,
+                 base_url: str = GEMINI_BASE_URL, max_concurrency: int = MAX_CONCURRENCY,
+                 rpm: float = RATE_LIMIT_RPM, timeout: float = REQUEST_TIMEOUT):
+        self.api_key = api_key if api_key is not None else os.getenv("GEMINI_API_KEY")
+        self.model = model
+        self.base_url = base_url.rstrip("/")
+        self.max_concurrency = max_concurrency
+        self.rpm = rpm
+        self.timeout = timeout
+        self.in_flight: Dict[str, asyncio.Task] = {}
+        self.stats = {"requests": 0, "coalesced": 0, "retries": 0}
+        self.loop = asyncio.new_event_loop()
+        self.thread = threading.Thread(target=self.loop.run_forever, name="gemini-client", daemon=True)
+        self.thread.start()
+        # Loop-bound objects are created on the loop itself
+        self.submit_coroutine(self._init()).result()
+
+    async def _init(self):
+        self.http = httpx.AsyncClient(
+            timeout=httpx.Timeout(READ_TIMEOUT, connect=CONNECT_TIMEOUT),
+            limits=httpx.Limits(max_connections=self.max_concurrency,
+                                max_keepalive_connections=self.max_concurrency),
+            headers={"Content-Type": "application/json"},
+        )
+        self.semaphore = asyncio.Semaphore(self.max_concurrency)
+        self.limiter = AsyncRateLimiter(self.rpm)
+
+    def url(self, method: str = "generateContent") -> str:
+        return f"{self.base_url}/models/{self.model}:{method}"
+
+    def submit_coroutine(self, coroutine) -> Future:
+        return asyncio.run_coroutine_threadsafe(coroutine, self.loop)
+
+    # --- Runs on the client loop ---
+    async def _post(self, payload: Dict, trace=None) -> Dict:
+        # Callers stop waiting after self.timeout; sleeping past it would only hold the in-flight slot
+        deadline = asyncio.get_running_loop().time() + self.timeout
+        for attempt in range(MAX_RETRIES + 1):
+            async with self.semaphore:
+                await self.limiter.acquire()
+                self.stats["requests"] += 1
+                count("llm_requests", trace=trace)
+                try:
+                    response = await self.http.post(self.url(), params={"key": self.api_key}, json=payload)
+                except httpx.TransportError as e:
+                    response, error = None, e
+            if response is not None and response.status_code < 400:
+                result = response.json()
+                record_usage(result, trace)
+                return result
+            status = response.status_code if response is not None else None
+            retry_after = response.headers.get("Retry-After") if response is not None else None
+            delay = retry_delay(attempt, retry_after)
+            if (attempt == MAX_RETRIES or (status is not None and status not in RETRY_STATUSES)
+                    or asyncio.get_running_loop().time() + delay > deadline):
+                detail = response.text[:300] if response is not None else str(error)
+                count("llm_errors", status=str(status or "network"))
+                raise GeminiError(f"Gemini request failed ({status or 'network'}): {detail}", status)
+            self.stats["retries"] += 1
+            count("llm_retries", trace=trace)
+            await asyncio.sleep(delay)
+
+    async def _stream(self, payload: Dict, trace=None) -> AsyncIterator[str]:
+        """Text deltas from streamGenerateContent (SSE); retried only until the first delta is yielded."""
+        yielded = False
+        deadline = asyncio.get_running_loop().time() + self.timeout
+        for attempt in range(MAX_RETRIES + 1):
+            async with self.semaphore:
+                await self.limiter.acquire()
+                self.stats["requests"] += 1
+                count("llm_requests", trace=trace)
+                try:
+                    async with self.http.stream("POST", self.url("streamGenerateContent"),
+                                                params={"key": self.api_key, "alt": "sse"},
+                                                json=payload) as response:
+                        if response.status_code < 400:
+                            last_event = {}
+                            async for line in response.aiter_lines():
+                                if not line.startswith("data:"):
+                                    continue
+                                event = last_event = json.loads(line[5:])
+                                for candidate in event.get("candidates", [])[:1]:
+                                    for part in candidate.get("content", {}).get("parts", []):
+                                        if part.get("text"):
+                                            yielded = True
+                                            yield part["text"]
+                            record_usage(last_event, trace)  # The final event carries the totals
+                            return
+                        status, detail = response.status_code, (await response.aread())[:300].decode("utf-8", "replace")
+                        retry_after = response.headers.get("Retry-After")
+                except httpx.TransportError as e:
+                    status, detail, retry_after = None, str(e), None
+            delay = retry_delay(attempt, retry_after)
+            # Once text went out a retry would repeat it from the start: fail instead
+            if (yielded or attempt == MAX_RETRIES or (status is not None and status not in RETRY_STATUSES)
+                    or asyncio.get_running_loop().time() + delay > deadline):
+                count("llm_errors", status=str(status or "network"))
+                what = "interrupted" if yielded else "failed"
+                raise GeminiError(f"Gemini stream {what} ({status or 'network'}): {detail}", status)
+            self.stats["retries"] += 1
+            count("llm_retries", trace=trace)
+            await asyncio.sleep(delay)
+
+    async def _generate(self, payload: Dict, trace=None) -> str:
+        key = hashlib.sha256(json.dumps(payload, sort_keys=True).encode("utf-8")).hexdigest()
+        task = self.in_flight.get(key)
+        if task is None:
+            task = asyncio.ensure_future(self._post(payload, trace))
+            self.in_flight[key] = task
+            task.add_done_callback(lambda _: self.in_flight.pop(key, None))
+        else:
+            self.stats["coalesced"] += 1
+            count("llm_coalesced", trace=trace)
+        result = await asyncio.wait_for(asyncio.shield(task), self.timeout)
+        return response_text(result)
+
+    # --- Callable from any thread or event loop ---
+    def submit(self, prompt: str, system: Optional[str] = None, temperature: float = 0.1,
+               max_tokens: int = 1024) -> Future:
+        # The caller's query trace is captured here: the call itself runs on the client loop
+        return self.submit_coroutine(self._generate(build_payload(prompt, system, temperature, max_tokens),
+                                                    current_trace()))
+
+    def generate(self, prompt: str, **kwargs) -> str:
+        """Blocking call (sync views, CLI)."""
+        return self.submit(prompt, **kwargs).result()
+
+    async def agenerate(self, prompt: str, **kwargs) -> str:
+        """Awaitable from any event loop (async views)."""
+        return await asyncio.wrap_future(self.submit(prompt, **kwargs))
+
+    def stream(self, prompt: str, system: Optional[str] = None, temperature: float = 0.1,
+               max_tokens: int = 1024) -> Iterator[str]:
+        """Blocking iterator of text deltas, e.g. for a streamed Flask response.
+
+        Deltas are produced on the client loop and handed over through a
+        queue; closing the iterator early (client went away) cancels the call.
+        """
+        chunks: "queue.Queue" = queue.Queue()
+        done = object()
+        trace = current_trace()
+
+        async def pump():
+            try:
+                async for text in self._stream(build_payload(prompt, system, temperature, max_tokens), trace):
+                    chunks.put(text)
+            except asyncio.CancelledError:  # Deadline hit (or the consumer went away)
+                chunks.put(asyncio.TimeoutError())
+                raise
+            except Exception as e:  # Re-raised in the consumer
+                chunks.put(e)
+            else:
+                chunks.put(done)
+
+        future = self.submit_coroutine(asyncio.wait_for(pump(), self.timeout))
+        try:
+            while True:
+                try:
+                    item = chunks.get(timeout=self.timeout)
+                except queue.Empty:
+                    raise asyncio.TimeoutError()
+                if item is done:
+                    return
+                if isinstance(item, BaseException):
+                    raise item
+                yield item
+        finally:
+            future.cancel()
+
+    def close(self):
+        if self.loop.is_running():
+            self.submit_coroutine(self.http.aclose()).result()
+            self.loop.call_soon_threadsafe(self.loop.stop)
+            self.thread.join(timeout=5)
+
+_client: Optional[GeminiClient] = None
+_client_pid: Optional[int] = None
+_client_lock = threading.Lock()
+
+def get_client() -> GeminiClient:
+    """Process-wide client; a forked worker gets its own (threads and sockets do not survive fork)."""
+    global _client, _client_pid
+    with _client_lock:
+        if _client is None or _client_pid != os.getpid():
+            _client = GeminiClient()
+            _client_pid = os.getpid()
+        return _client
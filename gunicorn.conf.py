@@ -0,0 +1,18 @@
+# gunicorn.conf.py — preload the RAG service in the master, then fork workers that share it
+# Run: gunicorn -c gunicorn.conf.py withinterface:app
+import os
+
+# The master imports withinterface once and warms the service (index, embeddings, BM25)
+# before forking, so workers start instantly and share those pages copy-on-write
+os.environ.setdefault("RAG_PRELOAD", "1")
+preload_app = True
+
+bind = os.getenv("BIND", "0.0.0.0:5000")
+workers = int(os.getenv("WEB_CONCURRENCY", "2"))
+worker_class = "gthread"  # Threads wait on Gemini while the shared client multiplexes the calls
+threads = int(os.getenv("THREADS", "16"))
+timeout = 120
+
+def post_fork(server, worker):
+    from rag_service import get_service
+    get_service().after_fork()
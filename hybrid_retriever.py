@@ -0,0 +1,168 @@
+# hybrid_retriever.py — BM25 keyword search fused with FAISS similarity (reciprocal-rank fusion)
+import re
+import math
+import time
+from collections import defaultdict
+from typing import Any, Dict, Iterator, List, Optional, Sequence, Tuple
+import numpy as np
+from langchain.docstore.document import Document
+from langchain_core.callbacks import CallbackManagerForRetrieverRun
+from langchain_core.retrievers import BaseRetriever
+from embedding_cache import embed_queries
+from metrics import span
+
+BM25_K1 = 1.5
+BM25_B = 0.75
+RRF_K = 60       # Standard reciprocal-rank-fusion constant: 1 / (RRF_K + rank)
+FETCH_K = 20     # Candidates taken from each ranker before fusion
+
+# Words, plus identifiers kept whole: mobile_number, /v2/customers/get, points.redeem
+TOKEN_RE = re.compile(r"[a-z0-9_]+(?:[./\-][a-z0-9_]+)*")
+
+def tokenize(text: str) -> List[str]:
+    """Lower-cased terms; compound identifiers are indexed whole and by their parts."""
+    tokens = []
+    for token in TOKEN_RE.findall(text.lower()):
+        tokens.append(token)
+        if not token.isalnum():
+            tokens.extend(part for part in re.split(r"[./\-_]+", token) if part)
+    return tokens
+
+def iter_chunk_texts(vectorstore) -> Iterator[Tuple[int, str]]:
+    """(FAISS row, chunk text) for every chunk in a LangChain FAISS store."""
+    if hasattr(vectorstore.docstore, "iter_texts"):  # SqliteDocstore: one scan instead of a lookup per row
+        yield from vectorstore.docstore.iter_texts()
+        return
+    for pos, doc_id in vectorstore.index_to_docstore_id.items():
+        yield pos, vectorstore.docstore.search(doc_id).page_content
+
+class BM25Index:
+    """In-memory inverted index (Okapi BM25) over the chunks of a vector store.
+
+    Documents are identified by their FAISS row, so keyword and vector hits
+    can be fused without comparing texts. Postings are numpy arrays and a
+    query only touches the postings of its own terms.
+    """
+
+    def __init__(self, chunks: Iterator[Tuple[int, str]], k1: float = BM25_K1, b: float = BM25_B):
+        self.k1 = k1
+        self.b = b
+        postings: Dict[str, List[Tuple[int, int]]] = defaultdict(list)
+        lengths: Dict[int, int] = {}
+        for pos, text in chunks:
+            counts: Dict[str, int] = defaultdict(int)
+            tokens = tokenize(text)
+            for token in tokens:
+                counts[token] += 1
+            for token, count in counts.items():
+                postings[token].append((pos, count))
+            lengths[pos] = len(tokens)
+
+        size = max(lengths, default=-1) + 1
+        self.doc_len = np.zeros(size, dtype=np.float32)
+        for pos, length in lengths.items():
+            self.doc_len[pos] = length
+        self.num_docs = len(lengths)
+        self.avg_len = float(self.doc_len.sum() / max(self.num_docs, 1))
+        self.postings: Dict[str, Tuple[np.ndarray, np.ndarray]] = {}
+        self.idf: Dict[str, float] = {}
+        for token, entries in postings.items():
+            rows = np.fromiter((pos for pos, _ in entries), dtype=np.int64, count=len(entries))
+            tfs = np.fromiter((count for _, count in entries), dtype=np.float32, count=len(entries))
+            self.postings[token] = (rows, tfs)
+            df = len(entries)
+            self.idf[token] = math.log(1 + (self.num_docs - df + 0.5) / (df + 0.5))
+
+    @classmethod
+    def from_vectorstore(cls, vectorstore, **kwargs) -> "BM25Index":
+        start_time = time.time()
+        index = cls(iter_chunk_texts(vectorstore), **kwargs)
+        print(f"✅ BM25 index over {index.num_docs} chunks ({len(index.postings)} terms) "
+              f"built in {time.time() - start_time:.2f}s.")
+        return index
+
+    def search(self, query: str, k: int = FETCH_K) -> List[Tuple[int, float]]:
+        """Top-k (FAISS row, BM25 score), best first; empty if no query term is indexed."""
+        scores = np.zeros_like(self.doc_len)
+        matched = False
+        for token in set(tokenize(query)):
+            if token not in self.postings:
+                continue
+            matched = True
+            rows, tfs = self.postings[token]
+            norm = self.k1 * (1 - self.b + self.b * self.doc_len[rows] / self.avg_len)
+            scores[rows] += self.idf[token] * tfs * (self.k1 + 1) / (tfs + norm)
+        if not matched:
+            return []
+        k = min(k, int(np.count_nonzero(scores)))
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top])]
+        return [(int(pos), float(scores[pos])) for pos in top]
+
+def reciprocal_rank_fusion(rankings: List[List[int]], rrf_k: int = RRF_K) -> List[Tuple[int, float]]:
+    """Fuse ranked lists of ids: score(d) = sum over lists of 1 / (rrf_k + rank)."""
+    fused: Dict[int, float] = defaultdict(float)
+    for ranking in rankings:
+        for rank, item in enumerate(ranking, start=1):
+            fused[item] += 1.0 / (rrf_k + rank)
+    return sorted(fused.items(), key=lambda pair: pair[1], reverse=True)
+
+class HybridRetriever(BaseRetriever):
+    """Drop-in replacement for `vectorstore.as_retriever(...)`: BM25 + FAISS, fused by RRF.
+
+    Exact identifiers (endpoint paths, field names) that MiniLM ranks poorly
+    are still found by BM25, so the chain no longer gets an empty context.
+    """
+
+    vectorstore: Any
+    bm25: Any
+    k: int = 3
+    fetch_k: int = FETCH_K
+    rrf_k: int = RRF_K
+
+    def vector_search(self, query: str) -> List[int]:
+        with span("embed"):
+            vector = np.asarray([self.vectorstore.embeddings.embed_query(query)], dtype=np.float32)
+        return self.vector_search_many(vector)[0]
+
+    def vector_search_many(self, vectors) -> List[List[int]]:
+        """FAISS rows for a whole matrix of query vectors in one search call."""
+        with span("faiss"):
+            _, rows = self.vectorstore.index.search(np.asarray(vectors, dtype=np.float32), self.fetch_k)
+        return [[int(pos) for pos in row if pos != -1] for row in rows]
+
+    def fused_rows(self, query: str, vector_rows: Optional[List[int]] = None) -> List[Tuple[int, float]]:
+        if vector_rows is None:
+            vector_rows = self.vector_search(query)
+        with span("bm25"):
+            keyword = [pos for pos, _ in self.bm25.search(query, self.fetch_k)]
+        with span("fuse"):
+            return reciprocal_rank_fusion([vector_rows, keyword], self.rrf_k)[:self.k]
+
+    def batch_documents(self, queries: Sequence[str], vectors=None) -> List[List[Document]]:
+        """Retrieval for many queries: one embedding call for the batch and one FAISS search."""
+        if vectors is None:
+            with span("embed"):
+                vectors = embed_queries(self.vectorstore.embeddings, list(queries))
+        return [self.to_documents(self.fused_rows(query, rows))
+                for query, rows in zip(queries, self.vector_search_many(vectors))]
+
+    def _get_relevant_documents(self, query: str, *, run_manager: CallbackManagerForRetrieverRun) -> List[Document]:
+        return self.to_documents(self.fused_rows(query))
+
+    def to_documents(self, rows: List[Tuple[int, float]]) -> List[Document]:
+        """Stored chunks for fused (row, score) pairs, tagged with their chunk id and score."""
+        documents = []
+        with span("docstore"):
+            for pos, score in rows:
+                doc_id = self.vectorstore.index_to_docstore_id[pos]
+                doc = self.vectorstore.docstore.search(doc_id)
+                if isinstance(doc, Document):
+                    metadata = {**doc.metadata, "chunk_id": doc_id, "rrf_score": round(score, 5)}
+                    documents.append(Document(page_content=doc.page_content, metadata=metadata))
+        return documents
+
+def as_hybrid_retriever(vectorstore, k: int = 3, fetch_k: int = FETCH_K, rrf_k: int = RRF_K) -> HybridRetriever:
+    """Build the BM25 side from the store's own chunks and return the fused retriever."""
+    return HybridRetriever(vectorstore=vectorstore, bm25=BM25Index.from_vectorstore(vectorstore),
+                           k=k, fetch_k=fetch_k, rrf_k=rrf_k)
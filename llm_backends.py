@@ -0,0 +1,328 @@
+# llm_backends.py — pluggable answer generation: Gemini over HTTP, or a local transformers model on CPU
+import os
+import copy
+import time
+import queue
+import asyncio
+import threading
+from collections import deque
+from concurrent.futures import Future
+from typing import Dict, Iterator, List, Optional, Tuple
+from metrics import count, current_trace
+
+LLM_BACKEND = os.getenv("LLM_BACKEND", "gemini")  # "gemini" | "local"
+LOCAL_MODEL = os.getenv("LOCAL_LLM_MODEL", "Qwen/Qwen2.5-0.5B-Instruct")  # Any causal LM with a chat template
+LOCAL_MAX_BATCH = int(os.getenv("LOCAL_LLM_MAX_BATCH", "8"))            # Requests generated together
+LOCAL_BATCH_WAIT_MS = float(os.getenv("LOCAL_LLM_BATCH_WAIT_MS", "15"))  # How long the first request waits for company
+LOCAL_MAX_NEW_TOKENS = int(os.getenv("LOCAL_LLM_MAX_NEW_TOKENS", "256"))  # CPU decoding is slow: keep answers short
+LOCAL_THREADS = int(os.getenv("LOCAL_LLM_THREADS", "0"))                 # 0 = torch default
+LOCAL_QUANTIZE = os.getenv("LOCAL_LLM_QUANTIZE", "0") == "1"             # Dynamic int8 Linear layers
+GREEDY_BELOW = 0.2  # Temperatures under this decode greedily (the RAG prompt uses 0.1)
+
+class GenerationBackend:
+    """What the RAG service needs from a model.
+
+    `submit()` returns a Future with the answer text and may be called from any
+    thread; the blocking, async and streaming forms are built on it. Subclasses
+    only have to implement `submit()`.
+    """
+
+    name = "base"
+    max_concurrency = 1  # Calls worth having in flight at once (batch mode fills this many)
+
+    def load(self) -> "GenerationBackend":
+        """Load weights ahead of the first request (a preloading server calls this before forking)."""
+        return self
+
+    def describe(self) -> str:
+        return self.name
+
+    def configuration_error(self) -> Optional[str]:
+        """Why this backend cannot serve requests (missing key, ...), or None."""
+        return None
+
+    def submit(self, prompt: str, system: Optional[str] = None, temperature: float = 0.1,
+               max_tokens: int = 1024) -> Future:
+        raise NotImplementedError
+
+    def generate(self, prompt: str, **kwargs) -> str:
+        return self.submit(prompt, **kwargs).result()
+
+    async def agenerate(self, prompt: str, **kwargs) -> str:
+        return await asyncio.wrap_future(self.submit(prompt, **kwargs))
+
+    def stream(self, prompt: str, **kwargs) -> Iterator[str]:
+        """Text deltas; backends without incremental output yield the whole answer once."""
+        yield self.generate(prompt, **kwargs)
+
+    def report(self) -> Dict:
+        return {}
+
+class GeminiBackend(GenerationBackend):
+    """The shared keep-alive Gemini client (gemini_client.py): RPM limiter, retries, coalescing, SSE streaming."""
+
+    name = "gemini"
+
+    @property
+    def client(self):
+        from gemini_client import get_client
+        return get_client()  # Per process: a forked worker gets its own loop thread and sockets
+
+    @property
+    def max_concurrency(self) -> int:
+        from gemini_client import MAX_CONCURRENCY
+        return MAX_CONCURRENCY
+
+    def describe(self) -> str:
+        from gemini_client import GEMINI_MODEL
+        return f"Gemini ({GEMINI_MODEL})"
+
+    def configuration_error(self) -> Optional[str]:
+        return None if os.getenv("GEMINI_API_KEY") else "GEMINI_API_KEY not configured on the server."
+
+    def submit(self, prompt: str, **kwargs) -> Future:
+        return self.client.submit(prompt, **kwargs)
+
+    def stream(self, prompt: str, **kwargs) -> Iterator[str]:
+        return self.client.stream(prompt, **kwargs)
+
+    def report(self) -> Dict:
+        return dict(self.client.stats)
+
+class LocalBackend(GenerationBackend):
+    """A causal LM kept loaded on CPU; every thread's requests go through one batching worker.
+
+    - Dynamic batching: requests that arrive within `batch_wait_ms` of the
+      first one (up to `max_batch`) share each forward pass.
+    - Prompt caching: the key/value cache of the system prompt is computed
+      once and copied into every batch, so only context + question are
+      run through the model.
+    - `quantize` applies dynamic int8 quantization to the Linear layers.
+    The weights load once per process (before the fork under gunicorn
+    preload); the worker thread is restarted in each forked process.
+    """
+
+    name = "local"
+
+    def __init__(self, model_name: str = LOCAL_MODEL, max_batch: int = LOCAL_MAX_BATCH,
+                 batch_wait_ms: float = LOCAL_BATCH_WAIT_MS, max_new_tokens: int = LOCAL_MAX_NEW_TOKENS,
+                 threads: int = LOCAL_THREADS, quantize: bool = LOCAL_QUANTIZE, prefix_cache: bool = True):
+        self.model_name = model_name
+        self.max_batch = max(1, max_batch)
+        self.batch_wait_ms = batch_wait_ms
+        self.max_new_tokens = max_new_tokens
+        self.threads = threads
+        self.quantize = quantize
+        self.prefix_cache = prefix_cache
+        self.model = None
+        self.tokenizer = None
+        self.stop_ids: set = set()
+        self.prefix_caches: Dict[str, Tuple[List[int], object]] = {}  # Prefix text -> (token ids, KV cache)
+        self.load_lock = threading.Lock()
+        self.worker_lock = threading.Lock()
+        self.worker_pid: Optional[int] = None
+        self.requests: Optional[queue.Queue] = None
+        self.stats = {"requests": 0, "batches": 0, "prefix_tokens_reused": 0, "tokens_in": 0, "tokens_out": 0,
+                      "generate_seconds": 0.0}
+
+    @property
+    def max_concurrency(self) -> int:
+        return self.max_batch
+
+    def describe(self) -> str:
+        return f"local {self.model_name} (CPU{', int8' if self.quantize else ''})"
+
+    def load(self) -> "LocalBackend":
+        with self.load_lock:
+            if self.model is not None:
+                return self
+            import torch
+            from transformers import AutoModelForCausalLM, AutoTokenizer
+            print(f"⏳ Loading local LLM '{self.model_name}' on CPU...")
+            start_time = time.time()
+            if self.threads:
+                torch.set_num_threads(self.threads)
+            tokenizer = AutoTokenizer.from_pretrained(self.model_name)
+            model = AutoModelForCausalLM.from_pretrained(self.model_name, torch_dtype=torch.float32)
+            model.eval()
+            if self.quantize:
+                model = torch.ao.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
+            if tokenizer.pad_token_id is None:
+                tokenizer.pad_token = tokenizer.eos_token
+            stop = model.generation_config.eos_token_id
+            self.stop_ids = set(stop if isinstance(stop, list) else [stop]) | {tokenizer.eos_token_id}
+            self.stop_ids.discard(None)
+            self.tokenizer, self.model = tokenizer, model
+            print(f"✅ Local LLM loaded in {time.time() - start_time:.1f}s.")
+        return self
+
+    # --- Callable from any thread ---
+    def submit(self, prompt: str, system: Optional[str] = None, temperature: float = 0.1,
+               max_tokens: int = 1024) -> Future:
+        future = Future()
+        request = {"prompt": prompt, "system": system or "", "max_tokens": min(max_tokens, self.max_new_tokens),
+                   "sampling": round(temperature, 2) if temperature >= GREEDY_BELOW else 0.0,
+                   "future": future, "trace": current_trace()}
+        self._ensure_worker().put(request)
+        return future
+
+    def _ensure_worker(self) -> queue.Queue:
+        with self.worker_lock:
+            if self.worker_pid != os.getpid():  # First use, or a forked process (threads do not survive fork)
+                self.requests = queue.Queue()
+                threading.Thread(target=self._run, args=(self.requests,), name="local-llm", daemon=True).start()
+                self.worker_pid = os.getpid()
+            return self.requests
+
+    # --- Batching worker ---
+    def _run(self, requests: queue.Queue):
+        try:
+            self.load()
+        except Exception as e:
+            print(f"❌ Local LLM failed to load: {e}")
+            while True:  # Fail every request instead of hanging its caller
+                request = requests.get()
+                request["future"].set_exception(e)
+        deferred = deque()  # Requests that could not join the last batch (other system prompt / sampling)
+        while True:
+            batch = [deferred.popleft() if deferred else requests.get()]
+            key = (batch[0]["system"], batch[0]["sampling"])
+            for request in list(deferred):
+                if len(batch) < self.max_batch and (request["system"], request["sampling"]) == key:
+                    deferred.remove(request)
+                    batch.append(request)
+            deadline = time.monotonic() + self.batch_wait_ms / 1000
+            while len(batch) < self.max_batch:
+                try:
+                    request = requests.get(timeout=max(0.0, deadline - time.monotonic()))
+                except queue.Empty:
+                    break
+                if (request["system"], request["sampling"]) == key:
+                    batch.append(request)
+                else:
+                    deferred.append(request)
+            batch = [request for request in batch if request["future"].set_running_or_notify_cancel()]
+            if not batch:
+                continue
+            try:
+                answers = self._generate_batch(batch)
+            except Exception as e:
+                for request in batch:
+                    request["future"].set_exception(e)
+                continue
+            for request, answer in zip(batch, answers):
+                request["future"].set_result(answer)
+
+    def _split_prompt(self, system: str, prompt: str) -> Tuple[str, str]:
+        """(shared prefix, per-request suffix) of the chat-formatted prompt."""
+        tokenizer = self.tokenizer
+        messages = ([{"role": "system", "content": system}] if system else []) + [{"role": "user", "content": prompt}]
+        if not tokenizer.chat_template:
+            return (f"{system}\n\n" if system else ""), f"{prompt}\n"
+        full = tokenizer.apply_chat_template(messages, tokenize=False, add_generation_prompt=True)
+        prefix = tokenizer.apply_chat_template(messages[:1], tokenize=False) if system else ""
+        if not full.startswith(prefix):  # Template renders the system turn differently alone
+            return "", full
+        return prefix, full[len(prefix):]
+
+    def _prefix(self, prefix: str) -> Tuple[List[int], object]:
+        """Token ids of the shared prefix and, when prompt caching is on, its KV cache (computed once)."""
+        import torch
+        entry = self.prefix_caches.get(prefix)
+        if entry is None:
+            ids = self.tokenizer(prefix, add_special_tokens=False).input_ids if prefix else []
+            cache = None
+            if self.prefix_cache and ids:
+                with torch.inference_mode():
+                    cache = self.model(torch.tensor([ids]), use_cache=True).past_key_values
+                if isinstance(cache, tuple):  # Older transformers return the legacy tuple format
+                    from transformers import DynamicCache
+                    cache = DynamicCache.from_legacy_cache(cache)
+            entry = self.prefix_caches[prefix] = (ids, cache)
+        return entry
+
+    def _generate_batch(self, batch: List[Dict]) -> List[str]:
+        start = time.perf_counter()
+        prefix, _ = self._split_prompt(batch[0]["system"], batch[0]["prompt"])
+        suffixes = [self.tokenizer(self._split_prompt(request["system"], request["prompt"])[1],
+                                   add_special_tokens=False).input_ids for request in batch]
+        try:
+            rows = self._decode(batch, prefix, suffixes, use_cache=self.prefix_cache)
+        except Exception as e:
+            if not self.prefix_cache:
+                raise
+            # Some architectures / versions cannot resume from a copied cache: fall back to full prompts
+            print(f"⚠️ Prompt KV cache unavailable ({type(e).__name__}: {e}); generating without it.")
+            self.prefix_cache = False
+            self.prefix_caches.clear()
+            rows = self._decode(batch, prefix, suffixes, use_cache=False)
+        answers = []
+        prefix_length = len(self._prefix(prefix)[0])
+        for request, suffix, row in zip(batch, suffixes, rows):
+            tokens = row[:request["max_tokens"]]
+            stop = next((i for i, token in enumerate(tokens) if token in self.stop_ids), len(tokens))
+            answers.append(self.tokenizer.decode(tokens[:stop], skip_special_tokens=True).strip())
+            trace = request["trace"]
+            count("llm_requests", trace=trace)
+            count("llm_tokens_in", prefix_length + len(suffix), trace=trace)
+            count("llm_tokens_out", stop, trace=trace)
+            self.stats["tokens_in"] += prefix_length + len(suffix)
+            self.stats["tokens_out"] += stop
+            if self.prefix_cache:
+                self.stats["prefix_tokens_reused"] += prefix_length
+        count("llm_batches")
+        self.stats["requests"] += len(batch)
+        self.stats["batches"] += 1
+        self.stats["generate_seconds"] += time.perf_counter() - start
+        return answers
+
+    def _decode(self, batch: List[Dict], prefix: str, suffixes: List[List[int]], use_cache: bool) -> List[List[int]]:
+        """Generated token ids per request. The prompt is prefix + suffix, padded to a common width."""
+        import torch
+        prefix_ids, cache = self._prefix(prefix)
+        pad = self.tokenizer.pad_token_id
+        width = max(len(suffix) for suffix in suffixes)
+        if use_cache and cache is not None:
+            # Padding goes between the cached prefix and each suffix; the attention mask hides it and
+            # positions come from the mask, so every suffix continues right after the prefix
+            input_ids = [prefix_ids + [pad] * (width - len(s)) + s for s in suffixes]
+            attention = [[1] * len(prefix_ids) + [0] * (width - len(s)) + [1] * len(s) for s in suffixes]
+            past = copy.deepcopy(cache)
+            past.batch_repeat_interleave(len(batch))
+        else:
+            input_ids = [[pad] * (width - len(s)) + prefix_ids + s for s in suffixes]  # Plain left padding
+            attention = [[0] * (width - len(s)) + [1] * (len(prefix_ids) + len(s)) for s in suffixes]
+            past = None
+        sampling = batch[0]["sampling"]
+        kwargs = {"do_sample": True, "temperature": sampling} if sampling else {"do_sample": False}
+        with torch.inference_mode():
+            output = self.model.generate(
+                input_ids=torch.tensor(input_ids), attention_mask=torch.tensor(attention), past_key_values=past,
+                max_new_tokens=max(request["max_tokens"] for request in batch), pad_token_id=pad, **kwargs)
+        return output[:, len(prefix_ids) + width:].tolist()
+
+    def report(self) -> Dict:
+        report = dict(self.stats)
+        if self.stats["batches"]:
+            report["mean_batch"] = round(self.stats["requests"] / self.stats["batches"], 2)
+        if self.stats["generate_seconds"]:
+            report["tokens_out_per_s"] = round(self.stats["tokens_out"] / self.stats["generate_seconds"], 1)
+        return report
+
+BACKENDS = {"gemini": GeminiBackend, "local": LocalBackend}
+
+def create_backend(name: str = LLM_BACKEND, **kwargs) -> GenerationBackend:
+    if name not in BACKENDS:
+        raise ValueError(f"Unknown LLM backend '{name}' (expected one of: {', '.join(BACKENDS)}).")
+    return BACKENDS[name](**kwargs)
+
+_backend: Optional[GenerationBackend] = None
+_backend_lock = threading.Lock()
+
+def get_backend() -> GenerationBackend:
+    """The process-wide backend chosen by LLM_BACKEND."""
+    global _backend
+    with _backend_lock:
+        if _backend is None:
+            _backend = create_backend(LLM_BACKEND)
+        return _backend
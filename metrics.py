@@ -0,0 +1,250 @@
+# metrics.py — per-stage timing spans, counters and a structured per-query log (Prometheus text on /metrics)
+import os
+import json
+import time
+import argparse
+import threading
+import contextvars
+from contextlib import contextmanager
+from typing import Callable, Dict, Iterator, List, Optional, Tuple
+import numpy as np
+
+QUERY_LOG = os.getenv("QUERY_LOG", "logs/queries.jsonl")  # One JSON line per query; "" turns it off
+LOGGED_QUERY_CHARS = 300
+# Seconds; the low end resolves FAISS / BM25, the high end a slow Gemini answer
+BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+def _number(value: float) -> str:
+    return str(int(value)) if float(value).is_integer() else repr(float(value))
+
+def _labels(labels: Tuple) -> str:
+    if not labels:
+        return ""
+    escaped = (str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") for _, value in labels)
+    return "{" + ",".join(f'{name}="{value}"' for (name, _), value in zip(labels, escaped)) + "}"
+
+class Registry:
+    """Counters, latency histograms and read-on-scrape gauges of this process.
+
+    Under gunicorn every worker has its own registry, so /metrics shows the
+    worker that served the scrape (add a `pid` label in the scraper's relabelling).
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.counters: Dict[Tuple[str, Tuple], float] = {}
+        self.histograms: Dict[Tuple[str, Tuple], List[float]] = {}  # Cumulative bucket counts, then sum, count
+        self.gauges: Dict[str, Callable[[], Optional[float]]] = {}
+
+    def inc(self, name: str, amount: float = 1.0, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0.0) + amount
+
+    def observe(self, name: str, value: float, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                histogram = self.histograms[key] = [0] * len(BUCKETS) + [0.0, 0]
+            for i, bound in enumerate(BUCKETS):
+                if value <= bound:
+                    histogram[i] += 1
+            histogram[-2] += value
+            histogram[-1] += 1
+
+    def gauge(self, name: str, read: Callable[[], Optional[float]]):
+        """`read()` is called on every scrape; None (or an exception) skips the sample."""
+        self.gauges[name] = read
+
+    def render(self) -> str:
+        with self.lock:
+            counters = sorted(self.counters.items())
+            histograms = sorted((key, list(values)) for key, values in self.histograms.items())
+        lines, typed = [], set()
+        for (name, labels), value in counters:
+            if name not in typed:
+                lines.append(f"# TYPE {name} counter")
+                typed.add(name)
+            lines.append(f"{name}{_labels(labels)} {_number(value)}")
+        for (name, labels), histogram in histograms:
+            if name not in typed:
+                lines.append(f"# TYPE {name} histogram")
+                typed.add(name)
+            for bound, count in zip(BUCKETS, histogram):
+                lines.append(f"{name}_bucket{_labels(labels + (('le', _number(bound)),))} {count}")
+            lines.append(f"{name}_bucket{_labels(labels + (('le', '+Inf'),))} {histogram[-1]}")
+            lines.append(f"{name}_sum{_labels(labels)} {_number(round(histogram[-2], 6))}")
+            lines.append(f"{name}_count{_labels(labels)} {histogram[-1]}")
+        for name, read in sorted(self.gauges.items()):
+            try:
+                value = read()
+            except Exception:
+                continue
+            if value is not None:
+                lines.extend([f"# TYPE {name} gauge", f"{name} {_number(value)}"])
+        return "\n".join(lines) + "\n"
+
+METRICS = Registry()
+
+class Trace:
+    """One query: time per stage, counters and attributes, written to QUERY_LOG when it ends."""
+
+    def __init__(self, kind: str, query: str):
+        self.kind = kind
+        self.query = query
+        self.started = time.time()
+        self.start = time.perf_counter()
+        self.stages: Dict[str, float] = {}   # Milliseconds, summed when a stage repeats
+        self.counts: Dict[str, float] = {}
+        self.attributes: Dict = {}
+        self.status, self.error = "ok", None
+        self.lock = threading.Lock()  # Stages may be recorded from worker threads (asyncio.to_thread)
+
+    def elapsed_ms(self) -> float:
+        return (time.perf_counter() - self.start) * 1000
+
+    def add_stage(self, stage: str, seconds: float):
+        with self.lock:
+            self.stages[stage] = self.stages.get(stage, 0.0) + seconds * 1000
+
+    def count(self, name: str, amount: float = 1):
+        with self.lock:
+            self.counts[name] = self.counts.get(name, 0) + amount
+
+    def set(self, **attributes):
+        with self.lock:
+            self.attributes.update(attributes)
+
+    def fail(self, error: BaseException):
+        """Mark the query failed when the caller handles the exception itself (e.g. an SSE error event)."""
+        self.status, self.error = "error", f"{type(error).__name__}: {error}"
+
+    def record(self) -> Dict:
+        with self.lock:
+            return {"ts": round(self.started, 3), "pid": os.getpid(), "kind": self.kind,
+                    "query": self.query[:LOGGED_QUERY_CHARS], "status": self.status, "error": self.error,
+                    "total_ms": round(self.elapsed_ms(), 2),
+                    "stages": {stage: round(ms, 2) for stage, ms in self.stages.items()},
+                    "counts": dict(self.counts), **self.attributes}
+
+    def summary(self) -> str:
+        """'embed 11ms · faiss 0.4ms · generate 1432ms', slowest stage first."""
+        stages = sorted(self.stages.items(), key=lambda item: item[1], reverse=True)
+        return " · ".join(f"{stage} {ms:.3g}ms" for stage, ms in stages)
+
+_current: contextvars.ContextVar = contextvars.ContextVar("rag_trace", default=None)
+_log_lock = threading.Lock()
+
+def current_trace() -> Optional[Trace]:
+    return _current.get()
+
+def log_query(record: Dict):
+    if not QUERY_LOG:
+        return
+    line = json.dumps(record, ensure_ascii=False)
+    with _log_lock:
+        folder = os.path.dirname(QUERY_LOG)
+        if folder:
+            os.makedirs(folder, exist_ok=True)
+        with open(QUERY_LOG, "a", encoding="utf-8") as f:  # One short append per query (safe across workers)
+            f.write(line + "\n")
+
+@contextmanager
+def trace(kind: str, query: str) -> Iterator[Trace]:
+    """Scope of one query: spans and counters inside it (in any thread it hands work to) land on it."""
+    current = Trace(kind, query)
+    token = _current.set(current)
+    try:
+        yield current
+    except GeneratorExit:  # A streaming client went away
+        current.status = "cancelled"
+        raise
+    except BaseException as e:
+        current.fail(e)
+        raise
+    finally:
+        try:
+            _current.reset(token)
+        except ValueError:  # Closed from another context (generator finalized elsewhere)
+            pass
+        METRICS.inc("rag_queries_total", kind=kind, status=current.status)
+        METRICS.observe("rag_query_seconds", current.elapsed_ms() / 1000, kind=kind)
+        log_query(current.record())
+
+@contextmanager
+def span(stage: str) -> Iterator[None]:
+    """Time a pipeline stage: rag_stage_seconds{stage=...} and the current query's trace."""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        record_stage(stage, time.perf_counter() - start)
+
+def record_stage(stage: str, seconds: float):
+    """A stage timed by the caller (e.g. summed over the deltas of a stream)."""
+    METRICS.observe("rag_stage_seconds", seconds, stage=stage)
+    current = _current.get()
+    if current is not None:
+        current.add_stage(stage, seconds)
+
+def count(name: str, amount: float = 1, trace: Optional[Trace] = None, **labels):
+    """Bump rag_<name>_total; without labels also the query's own count.
+
+    Work that runs on another event loop (the Gemini client) passes the
+    caller's trace explicitly, since context variables do not follow it there.
+    """
+    METRICS.inc(f"rag_{name}_total", amount, **labels)
+    trace = trace or _current.get()
+    if trace is not None and not labels:
+        trace.count(name, amount)
+
+def annotate(**attributes):
+    current = _current.get()
+    if current is not None:
+        current.set(**attributes)
+
+# --- Offline: where does the time go? ---
+def summarize(path: str) -> Dict:
+    """Per-stage latency percentiles and share of total time from a QUERY_LOG file."""
+    records = []
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            if line.strip():
+                records.append(json.loads(line))
+    total_ms = sum(record["total_ms"] for record in records) or 1.0
+    per_stage: Dict[str, List[float]] = {}
+    for record in records:
+        for stage, ms in record["stages"].items():
+            per_stage.setdefault(stage, []).append(ms)
+    stages = {}
+    for stage, values in sorted(per_stage.items(), key=lambda item: sum(item[1]), reverse=True):
+        values = np.asarray(values)
+        stages[stage] = {"calls": len(values), "p50_ms": round(float(np.percentile(values, 50)), 2),
+                         "p95_ms": round(float(np.percentile(values, 95)), 2),
+                         "share": round(float(values.sum()) / total_ms, 4)}
+    totals = np.asarray([record["total_ms"] for record in records] or [0.0])
+    return {"queries": len(records),
+            "errors": sum(1 for record in records if record["status"] == "error"),
+            "total_p50_ms": round(float(np.percentile(totals, 50)), 2),
+            "total_p95_ms": round(float(np.percentile(totals, 95)), 2),
+            "stages": stages}
+
+def main():
+    parser = argparse.ArgumentParser(description="Summarize the per-query log: which stage is hot?")
+    parser.add_argument("log", nargs="?", default=QUERY_LOG or "logs/queries.jsonl")
+    parser.add_argument("--json", action="store_true", help="Print the summary as JSON")
+    args = parser.parse_args()
+
+    report = summarize(args.log)
+    if args.json:
+        print(json.dumps(report, indent=2))
+        return
+    print(f"📈 {report['queries']} queries ({report['errors']} errors), "
+          f"p50 {report['total_p50_ms']}ms, p95 {report['total_p95_ms']}ms\n")
+    print(f"{'stage':<14}{'calls':>7}{'p50 ms':>10}{'p95 ms':>10}{'share':>8}")
+    for stage, row in report["stages"].items():
+        print(f"{stage:<14}{row['calls']:>7}{row['p50_ms']:>10.2f}{row['p95_ms']:>10.2f}{row['share']:>8.1%}")
+
+if __name__ == "__main__":
+    main()
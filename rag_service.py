@@ -0,0 +1,331 @@
+# rag_service.py — one retrieval + generation service per process, shared by Flask, the CLIs and benchmarks
+import os
+import sys
+import time
+import asyncio
+import threading
+from concurrent.futures import FIRST_COMPLETED, wait
+from typing import Dict, Iterator, List, Optional, Tuple
+from metrics import METRICS, annotate, count, current_trace, record_stage, span
+
+# Heavy modules (torch, sentence-transformers, faiss, LangChain) are imported in warm(),
+# so importing this module — or an app that uses it — costs nothing until the service is needed.
+
+SYSTEM_PROMPT = """
+You are an expert technical support chatbot for Capillary Technologies, specializing in APIs, customer management, and loyalty campaigns.
+Your goal is to answer questions concisely and accurately using ONLY the provided CONTEXT.
+If the answer is not found in the context, state clearly, "I cannot find the answer in the provided documentation."
+Always provide a brief, direct answer.
+"""
+NO_ANSWER = "I cannot find the answer in the provided documentation."
+TEMPERATURE = 0.1
+MAX_OUTPUT_TOKENS = 1024
+
+class ServiceNotReady(Exception):
+    """The index / models are still loading (or failed to load)."""
+
+def build_prompt(query: str, documents) -> str:
+    """Retrieved chunks, numbered with their source URL, followed by the question."""
+    context = "\n\n".join(f"[{i}] Source: {doc.metadata.get('source', 'unknown')}\n{doc.page_content}"
+                          for i, doc in enumerate(documents, start=1))
+    return f"""
+        --- CONTEXT RETRIEVED FROM THE DOCUMENTATION ---
+        {context}
+        --- END CONTEXT ---
+
+        USER QUERY: {query}
+    """
+
+def unique_sources(documents) -> List[str]:
+    """Source URLs in retrieval order, without repeats."""
+    return list(dict.fromkeys(doc.metadata["source"] for doc in documents))
+
+class RagService:
+    """Persisted index + embedding model + LLM client, loaded once and shared.
+
+    - `warm()` loads everything (blocking); `warm_in_background()` lets a
+      server accept connections and report readiness while it loads.
+    - Under gunicorn with preload (gunicorn.conf.py) the master warms the
+      service before forking, so workers share the model weights and the
+      memory-mapped index pages copy-on-write.
+    - `invoke({"query": ...})` mirrors RetrievalQA, so the existing CLI
+      `ask_question` helpers work unchanged.
+    """
+
+    def __init__(self, index_folder: Optional[str] = None, k: Optional[int] = None):
+        self.index_folder = index_folder
+        self.k = k
+        self.state = "cold"
+        self.error: Optional[str] = None
+        self.load_seconds: Optional[float] = None
+        self.lock = threading.Lock()
+        self.vectorstore = None
+        self.retriever = None
+        self.answer_cache = None
+        METRICS.gauge("rag_service_ready", lambda: float(self.ready))
+        METRICS.gauge("rag_answer_cache_entries", lambda: len(self.answer_cache.entries) if self.answer_cache else None)
+        METRICS.gauge("rag_index_chunks", lambda: self.vectorstore.index.ntotal if self.ready else None)
+
+    # --- Lifecycle ---
+    def warm(self, vectorstore=None) -> "RagService":
+        """Load everything (blocking). A caller that already holds the vector store can pass it in."""
+        with self.lock:
+            if self.state == "ready":
+                return self
+            self.state = "loading"
+            start_time = time.time()
+            try:
+                self._load(vectorstore)
+            except Exception as e:
+                self.state, self.error = "failed", f"{type(e).__name__}: {e}"
+                raise
+            self.load_seconds = round(time.time() - start_time, 2)
+            self.state = "ready"
+            print(f"✅ RAG service ready in {self.load_seconds}s (pid {os.getpid()}).")
+            return self
+
+    def _load(self, vectorstore=None):
+        import test1  # Index/model configuration lives with the CLI
+        from answer_cache import AnswerCache
+        from context_packer import PackedRetriever
+        from hybrid_retriever import as_hybrid_retriever
+        from llm_backends import get_backend
+        from vector_index import INDEX_FILE, INDEX_MANIFEST, open_vector_store
+
+        self.index_folder = self.index_folder or test1.VECTOR_STORE_PATH
+        self.k = self.k or test1.K_RETRIEVAL
+        built = all(os.path.exists(os.path.join(self.index_folder, name)) for name in (INDEX_FILE, INDEX_MANIFEST))
+        if vectorstore is not None:
+            self.vectorstore = vectorstore
+        elif built:
+            # Serving path: memory-mapped index, no corpus scan (rebuilds belong to build_index.py / test1)
+            print(f"⏳ Opening index '{self.index_folder}'...")
+            embeddings = test1.get_embeddings(cached=False)
+            self.vectorstore = open_vector_store(self.index_folder, embeddings, test1.INDEX_CONFIG)
+        else:
+            print(f"⚠️ No index in '{self.index_folder}', building it from the corpus (one time)...")
+            self.vectorstore = test1.setup_vector_store()
+        # Hybrid retrieval, then the packed (merged, de-duplicated, token-budgeted) context
+        self.retriever = PackedRetriever(base=as_hybrid_retriever(self.vectorstore, k=self.k))
+        self.answer_cache = AnswerCache(embed=self.vectorstore.embeddings.embed_query,
+                                        index_folder=self.index_folder)
+        self.vectorstore.embeddings.embed_query("warm up")  # First forward pass allocates the model's buffers
+        get_backend().load()  # A local LLM loads here too, so a preloading master shares its weights
+
+    def warm_in_background(self) -> threading.Thread:
+        def run():
+            try:
+                self.warm()
+            except Exception as e:
+                print(f"❌ RAG service failed to load: {e}")
+        thread = threading.Thread(target=run, name="rag-warmup", daemon=True)
+        thread.start()
+        return thread
+
+    def after_fork(self):
+        """Per-worker fix-ups after a preloading master forked us (see gunicorn.conf.py)."""
+        if "torch" in sys.modules:
+            # Workers split the cores instead of each spawning cpu_count() threads
+            sys.modules["torch"].set_num_threads(int(os.getenv("TORCH_THREADS", "1")))
+
+    @property
+    def ready(self) -> bool:
+        return self.state == "ready"
+
+    def status(self) -> Dict:
+        status = {"status": self.state, "pid": os.getpid(), "index": self.index_folder}
+        if self.ready:
+            from llm_backends import get_backend
+            status.update(chunks=self.vectorstore.index.ntotal, index_type=type(self.vectorstore.index).__name__,
+                          llm=get_backend().describe(), load_seconds=self.load_seconds)
+        if self.error:
+            status["error"] = self.error
+        return status
+
+    def _require_ready(self):
+        if not self.ready:
+            raise ServiceNotReady(self.error or f"RAG service is {self.state}.")
+
+    # --- Retrieval / generation ---
+    def retrieve(self, query: str):
+        self._require_ready()
+        documents = self.retriever.invoke(query)
+        if not documents:
+            count("empty_retrievals")
+        return documents
+
+    def cached(self, query: str) -> Optional[Dict]:
+        with span("cache_lookup"):
+            return self.answer_cache.get(query)
+
+    def prompt(self, query: str, documents) -> str:
+        with span("prompt"):
+            return build_prompt(query, documents)
+
+    def invoke(self, inputs: Dict) -> Dict:
+        """RetrievalQA-compatible: {"query"} -> {"result", "source_documents"} (no answer cache)."""
+        from llm_backends import get_backend
+        query = inputs["query"]
+        documents = self.retrieve(query)
+        if not documents:  # Nothing relevant: do not spend an LLM call on an empty context
+            return {"query": query, "result": NO_ANSWER, "source_documents": []}
+        prompt = self.prompt(query, documents)
+        with span("generate"):
+            answer = get_backend().generate(prompt, system=SYSTEM_PROMPT,
+                                            temperature=TEMPERATURE, max_tokens=MAX_OUTPUT_TOKENS)
+        return {"query": query, "result": answer, "source_documents": documents}
+
+    def answer(self, query: str) -> Dict:
+        """{"answer", "sources"[, "cache"]}, served from the answer cache when possible."""
+        self._require_ready()
+        cached = self.cached(query)
+        if cached is not None:
+            return cached
+        result = self.invoke({"query": query})
+        sources = unique_sources(result["source_documents"])
+        if sources:
+            self.answer_cache.put(query, result["result"], sources)
+        return {"answer": result["result"], "sources": sources}
+
+    async def aanswer(self, query: str) -> Dict:
+        """answer() for async views: retrieval runs in a worker thread, generation on the shared client."""
+        from llm_backends import get_backend
+        self._require_ready()
+        cached = await asyncio.to_thread(self.cached, query)  # A semantic lookup embeds the query
+        if cached is not None:
+            return cached
+        documents = await asyncio.to_thread(self.retrieve, query)
+        if not documents:
+            return {"answer": NO_ANSWER, "sources": []}
+        prompt = self.prompt(query, documents)
+        with span("generate"):
+            answer = await get_backend().agenerate(prompt, system=SYSTEM_PROMPT,
+                                                   temperature=TEMPERATURE, max_tokens=MAX_OUTPUT_TOKENS)
+        sources = unique_sources(documents)
+        self.answer_cache.put(query, answer, sources)
+        return {"answer": answer, "sources": sources}
+
+    def stream_answer(self, query: str) -> Iterator[Dict]:
+        """Events for a streamed answer: {"event": "token", "text"}..., then {"event": "sources", ...}."""
+        from llm_backends import get_backend
+        self._require_ready()
+        cached = self.cached(query)
+        if cached is not None:
+            yield {"event": "token", "text": cached["answer"]}
+            yield {"event": "sources", "sources": cached["sources"], "cache": cached["cache"]}
+            return
+        documents = self.retrieve(query)
+        sources = unique_sources(documents)
+        if not documents:
+            yield {"event": "token", "text": NO_ANSWER}
+            yield {"event": "sources", "sources": []}
+            return
+        parts = []
+        prompt = self.prompt(query, documents)
+        trace = current_trace()
+        deltas = get_backend().stream(prompt, system=SYSTEM_PROMPT, temperature=TEMPERATURE, max_tokens=MAX_OUTPUT_TOKENS)
+        generate_seconds = 0.0  # Time waiting on the model only, not on the client reading the tokens
+        try:
+            while True:
+                start = time.perf_counter()
+                text = next(deltas, None)
+                generate_seconds += time.perf_counter() - start
+                if text is None:
+                    break
+                if not parts and trace is not None:
+                    annotate(ttft_ms=round(trace.elapsed_ms(), 2))
+                parts.append(text)
+                yield {"event": "token", "text": text}
+        finally:
+            record_stage("generate", generate_seconds)
+        self.answer_cache.put(query, "".join(parts), sources)
+        yield {"event": "sources", "sources": sources}
+
+    def answer_batch(self, questions: List[str], concurrency: Optional[int] = None) -> Iterator[Tuple[int, Dict]]:
+        """(position, {"answer", "sources"[, "cache" | "error"]}) per question, in completion order.
+
+        1. All questions are embedded in one matrix call; answer-cache hits return first.
+        2. The misses are retrieved with one FAISS search (BM25 still runs per question).
+        3. Questions with the same normalized text and packed context share one LLM call.
+        4. At most `concurrency` LLM calls are in flight (Gemini's RPM limiter still applies;
+           a local model batches them).
+        """
+        import numpy as np
+        from answer_cache import normalize_query
+        from embedding_cache import embed_queries
+        from llm_backends import get_backend
+        self._require_ready()
+        if not questions:
+            return
+        backend = get_backend()
+        concurrency = concurrency or backend.max_concurrency
+        with span("embed"):
+            vectors = np.asarray(embed_queries(self.vectorstore.embeddings, list(questions)), dtype=np.float32)
+
+        misses = []
+        for position, (query, vector) in enumerate(zip(questions, vectors)):
+            with span("cache_lookup"):
+                cached = self.answer_cache.get(query, vector)
+            if cached is not None:
+                yield position, cached
+            else:
+                misses.append(position)
+        contexts = self.retriever.batch_documents([questions[i] for i in misses], vectors[misses]) if misses else []
+
+        groups: Dict[Tuple, List[int]] = {}
+        group_documents: Dict[Tuple, List] = {}
+        for position, documents in zip(misses, contexts):
+            if not documents:
+                count("empty_retrievals")
+                yield position, {"answer": NO_ANSWER, "sources": []}
+                continue
+            key = (normalize_query(questions[position]),
+                   tuple(doc.metadata.get("chunk_id") or doc.page_content for doc in documents))
+            groups.setdefault(key, []).append(position)
+            group_documents[key] = documents
+        count("batch_shared_answers", sum(len(members) - 1 for members in groups.values()))
+
+        # Bounded window: a call's timeout starts when it is submitted, not when the whole batch was queued
+        pending, todo = {}, iter(groups.items())
+        start = time.perf_counter()
+        try:
+            while True:
+                while len(pending) < concurrency:
+                    item = next(todo, None)
+                    if item is None:
+                        break
+                    key, members = item
+                    prompt = self.prompt(questions[members[0]], group_documents[key])
+                    future = backend.submit(prompt, system=SYSTEM_PROMPT, temperature=TEMPERATURE,
+                                            max_tokens=MAX_OUTPUT_TOKENS)
+                    pending[future] = (key, members)
+                if not pending:
+                    break
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    key, members = pending.pop(future)
+                    sources = unique_sources(group_documents[key])
+                    try:
+                        answer = future.result()
+                    except Exception as e:
+                        for position in members:
+                            yield position, {"answer": None, "sources": sources, "error": f"{type(e).__name__}: {e}"}
+                        continue
+                    self.answer_cache.put(questions[members[0]], answer, sources, vectors[members[0]])
+                    for position in members:
+                        yield position, {"answer": answer, "sources": sources}
+        finally:
+            for future in pending:  # Consumer stopped early (e.g. the HTTP client went away)
+                future.cancel()
+            record_stage("generate", time.perf_counter() - start)
+
+_service: Optional[RagService] = None
+_service_lock = threading.Lock()
+
+def get_service() -> RagService:
+    """The process-wide service (created cold; call warm() or warm_in_background())."""
+    global _service
+    with _service_lock:
+        if _service is None:
+            _service = RagService()
+        return _service
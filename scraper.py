@@ -2,122 +2,526 @@
 import os
 import json
 import time
+import hashlib
+import random
+import argparse
+import heapq
+import itertools
+import threading
 import requests
-from urllib.parse import urljoin, urlparse
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, FIRST_COMPLETED, wait
+from requests.adapters import HTTPAdapter
+from urllib.parse import urljoin, urlparse, urlunparse
 from bs4 import BeautifulSoup
-from typing import List, Dict
+from typing import Callable, List, Dict, Optional, Tuple
+from corpus import CORPUS_FILE, CorpusWriter, compact
+from extract import default_backend, extract_blocks_from_tree, extract_page, fastest_bs4_parser
 
 # Base URL
 BASE_URL = "https://docs.capillarytech.com/"
-OUTPUT_FILE = "data/docs.json"
+OUTPUT_FILE = CORPUS_FILE  # JSONL, appended page by page
+MANIFEST_FILE = "data/manifest.json"  # Per-URL ETag / Last-Modified / content hash
+DELTA_FILE = "data/delta.json"        # Added / changed / removed URLs from the last crawl
+
+# --- Crawl configuration ---
+MAX_PAGES = 7000          # Upper bound on pages per crawl
+MAX_DEPTH = 3             # Link hops from BASE_URL; pages deeper than this are not queued
+CHECKPOINT_EVERY = 50     # Save the manifest every N pages so --resume can continue
+CONCURRENCY = 8           # Worker threads fetching in parallel
+PARSE_WORKERS = os.cpu_count() or 1  # Processes running HTML parse/extract
+PARSE_BACKLOG = 4         # Fetched pages allowed to wait per parse worker (backpressure)
+RATE_LIMIT = 4.0          # Requests per second allowed per host (politeness budget)
+BURST = 4                 # Token-bucket capacity (short bursts above the steady rate)
+MAX_RETRIES = 3           # Retries per page on timeouts, 429 and 5xx
+BACKOFF_BASE = 1.0        # Seconds; doubled on every retry (plus jitter)
+MAX_BACKOFF = 60.0        # Seconds; also caps a server's Retry-After
+REQUEST_TIMEOUT = 10
+HEADERS = {
+    'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36'
+}
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+HTML_PARSER = fastest_bs4_parser()  # lxml when installed, else html.parser
 
 # Create data dir
 os.makedirs("data", exist_ok=True)
 
-def get_soup(url: str):
+# --- Rate limiting ---
+class TokenBucket:
+    """Thread-safe token bucket: `rate` tokens/sec, holding at most `capacity`."""
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        """Block until a token is available, then take it."""
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait_for = (1 - self.tokens) / self.rate
+            time.sleep(wait_for)
+
+class HostRateLimiter:
+    """Keeps one token bucket per host so every site gets its own politeness budget."""
+
+    def __init__(self, rate: float = RATE_LIMIT, burst: float = BURST):
+        self.rate = rate
+        self.burst = burst
+        self.buckets: Dict[str, TokenBucket] = {}
+        self.lock = threading.Lock()
+
+    def acquire(self, url: str):
+        host = urlparse(url).netloc
+        with self.lock:
+            bucket = self.buckets.get(host)
+            if bucket is None:
+                bucket = self.buckets[host] = TokenBucket(self.rate, self.burst)
+        bucket.acquire()
+
+# --- HTTP ---
+_session = None
+_limiter = None
+
+def get_session(pool_size: int = CONCURRENCY) -> requests.Session:
+    """Return the shared keep-alive session (connection pool sized for the worker count)."""
+    global _session
+    if _session is None:
+        session = requests.Session()
+        session.headers.update(HEADERS)
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+        session.mount("http://", adapter)
+        session.mount("https://", adapter)
+        _session = session
+    return _session
+
+def get_limiter() -> HostRateLimiter:
+    """Return the process-wide per-host rate limiter."""
+    global _limiter
+    if _limiter is None:
+        _limiter = HostRateLimiter()
+    return _limiter
+
+def _retry_delay(attempt: int, response: Optional[requests.Response] = None) -> float:
+    """Exponential backoff with jitter; honours a numeric Retry-After header, both capped at MAX_BACKOFF."""
+    if response is not None:
+        retry_after = response.headers.get("Retry-After")
+        if retry_after and retry_after.isdigit():
+            return min(float(retry_after), MAX_BACKOFF)
+    return min(BACKOFF_BASE * (2 ** attempt), MAX_BACKOFF) + random.uniform(0, BACKOFF_BASE)
+
+def fetch(url: str, session: Optional[requests.Session] = None,
+          limiter: Optional[HostRateLimiter] = None,
+          max_retries: int = MAX_RETRIES,
+          headers: Optional[Dict[str, str]] = None) -> requests.Response:
+    """GET a URL through the shared session, rate limiter and retry/backoff policy."""
+    session = session or get_session()
+    limiter = limiter or get_limiter()
+    for attempt in range(max_retries + 1):
+        limiter.acquire(url)
+        try:
+            response = session.get(url, timeout=REQUEST_TIMEOUT, headers=headers)
+        except (requests.ConnectionError, requests.Timeout):
+            if attempt == max_retries:
+                raise
+            time.sleep(_retry_delay(attempt))
+            continue
+        if response.status_code in RETRY_STATUSES and attempt < max_retries:
+            time.sleep(_retry_delay(attempt, response))
+            continue
+        response.raise_for_status()
+        return response
+
+def get_soup(url: str, session: Optional[requests.Session] = None,
+             limiter: Optional[HostRateLimiter] = None,
+             max_retries: int = MAX_RETRIES):
     """Fetch page and return BeautifulSoup object"""
     try:
-        headers = {
-            'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36'
-        }
-        response = requests.get(url, headers=headers, timeout=10)
-        response.raise_for_status()
-        return BeautifulSoup(response.text, 'html.parser')
+        response = fetch(url, session, limiter, max_retries)
+        return BeautifulSoup(response.text, HTML_PARSER)
     except Exception as e:
         print(f"❌ Failed to fetch {url}: {e}")
         return None
 
+def fetch_page(url: str, session: Optional[requests.Session] = None,
+               limiter: Optional[HostRateLimiter] = None,
+               max_retries: int = MAX_RETRIES,
+               headers: Optional[Dict[str, str]] = None):
+    """Fetch a page for the crawler (runs on the I/O threads, no parsing).
+
+    Returns (response, html). html is None when the server answered
+    304 Not Modified or the page is gone (4xx); response is None when the
+    fetch failed outright (network error, retries exhausted).
+    """
+    try:
+        response = fetch(url, session, limiter, max_retries, headers=headers)
+    except requests.HTTPError as e:
+        print(f"❌ Failed to fetch {url}: {e}")
+        status = e.response.status_code if e.response is not None else None
+        return (e.response, None) if status is not None and status < 500 and status != 429 else (None, None)
+    except Exception as e:
+        print(f"❌ Failed to fetch {url}: {e}")
+        return None, None
+    if response.status_code == 304:
+        return response, None
+    return response, response.text  # Decode here, off the coordinating thread
+
+def parse_page(html: str, backend: Optional[str] = None) -> Tuple[str, List[str]]:
+    """CPU-bound stage, run in the process pool: HTML -> (content, doc links)."""
+    blocks, hrefs = extract_page(html, backend)
+    return "\n\n".join(blocks), filter_doc_links(hrefs, BASE_URL)
+
 def extract_page_content(soup: BeautifulSoup, url: str) -> str:
-    """Extract main content from doc page"""
-    # Main content container (based on inspection of CapillaryTech docs structure)
-    content_div = soup.find('div', class_='main-content') or \
-                  soup.find('article') or \
-                  soup.find('div', role='main') or \
-                  soup.find('main')
-
-    if not content_div:
-        # Fallback: get all paragraphs and headings
-        content_div = soup
-
-    # Extract text from common content tags
-    elements = content_div.find_all(['p', 'h1', 'h2', 'h3', 'h4', 'li', 'pre', 'code', 'table'])
-    texts = []
-    for el in elements:
-        text = el.get_text().strip()
-        if text and len(text) > 15:  # Avoid tiny fragments
-            texts.append(text)
-
-    content = "\n\n".join(texts)
-    return content.strip()
+    """Extract main content from doc page.
+
+    Single pass over the content container (see extract.py): every node is
+    visited once, so text nested in <li><p> or <pre><code> is not repeated,
+    and code blocks / tables keep their layout.
+    """
+    return "\n\n".join(extract_blocks_from_tree(soup, "html.parser"))
+
+def normalize_url(url: str) -> str:
+    """Canonical form used for dedup: lowercase host, no query/fragment, no trailing slash."""
+    parts = urlparse(url)
+    scheme = parts.scheme.lower()
+    netloc = parts.netloc.lower()
+    if (scheme, netloc[-3:]) == ("http", ":80") or (scheme, netloc[-4:]) == ("https", ":443"):
+        netloc = netloc.rsplit(":", 1)[0]
+    path = parts.path or "/"
+    if len(path) > 1:
+        path = path.rstrip("/")
+    return urlunparse((scheme, netloc, path, "", "", ""))
 
 def find_doc_links(soup: BeautifulSoup, base_url: str) -> List[str]:
-    """Find internal documentation links"""
+    """Find internal documentation links (normalized)"""
+    return filter_doc_links([a_tag['href'] for a_tag in soup.find_all('a', href=True)], base_url)
+
+def filter_doc_links(hrefs: List[str], base_url: str) -> List[str]:
+    """Resolve hrefs and keep normalized links to doc pages on the same site"""
     links = set()
-    for a_tag in soup.find_all('a', href=True):
-        href = a_tag['href']
+    for href in hrefs:
         full_url = urljoin(base_url, href)
         # Only keep URLs under docs.capillarytech.com and avoid anchors / external
         if (urlparse(full_url).netloc == 'docs.capillarytech.com' and
             '#' not in href and
             not href.endswith(('.pdf', '.zip'))):
-            links.add(full_url)
+            links.add(normalize_url(full_url))
     return list(links)
 
-def scrape_capillary_docs():
-    """Main scraping function"""
-    print("🌐 Starting scrape of CapillaryTech Docs...")
+# --- Incremental crawl state ---
+def content_hash(content: str) -> str:
+    return hashlib.sha256(content.encode("utf-8")).hexdigest()
 
-    # Start with homepage
-    visited = set()
-    to_visit = [BASE_URL]
-    documents = []
+class CrawlManifest:
+    """Per-URL validators from the previous crawl, persisted in data/manifest.json.
 
-    # Limit to first 7000 pages for demo (avoid overload)
-    MAX_PAGES = 7000
-    count = 0
+    Each entry holds the ETag, Last-Modified, content hash and outgoing doc
+    links of a page, so the next crawl can send conditional GETs and still
+    follow the links of pages the server reports as 304 Not Modified.
+    """
 
-    while to_visit and count < MAX_PAGES:
-        url = to_visit.pop(0)
-        if url in visited:
-            continue
+    def __init__(self, path: str = MANIFEST_FILE):
+        self.path = path
+        self.entries: Dict[str, Dict] = {}
+        if os.path.exists(path):
+            with open(path, "r", encoding="utf-8") as f:
+                self.entries = json.load(f)
 
-        print(f"📄 Fetching ({count+1}/{MAX_PAGES}): {url}")
-        soup = get_soup(url)
-        if not soup:
-            continue
+    def get(self, url: str) -> Optional[Dict]:
+        return self.entries.get(url)
 
-        # Extract content
-        content = extract_page_content(soup, url)
-        if len(content) < 0:# Skip near-empty pages
-            print(f"⚠️ Skipping (too short): {url}")
-            visited.add(url)
-            continue
+    def conditional_headers(self, url: str) -> Dict[str, str]:
+        """If-None-Match / If-Modified-Since headers for a previously seen URL."""
+        entry = self.entries.get(url) or {}
+        headers = {}
+        if entry.get("etag"):
+            headers["If-None-Match"] = entry["etag"]
+        if entry.get("last_modified"):
+            headers["If-Modified-Since"] = entry["last_modified"]
+        return headers
+
+    def record(self, url: str, headers, content: str,
+               links: Optional[List[str]] = None) -> str:
+        """Store fresh validators (from response headers) for a page; returns 'added', 'changed' or 'unchanged'."""
+        digest = content_hash(content)
+        previous = self.entries.get(url)
+        self.entries[url] = {
+            "etag": headers.get("ETag"),
+            "last_modified": headers.get("Last-Modified"),
+            "hash": digest,
+            "links": links if links is not None else (previous or {}).get("links", []),
+        }
+        if previous is None:
+            return "added"
+        return "unchanged" if previous.get("hash") == digest else "changed"
+
+    def remove(self, urls: List[str]):
+        for url in urls:
+            self.entries.pop(url, None)
+
+    def save(self):
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(self.entries, f, ensure_ascii=False)
+        os.replace(tmp_path, self.path)
+
+def write_delta(added: List[str], changed: List[str], removed: List[str],
+                unchanged: int, path: str = DELTA_FILE) -> Dict:
+    """Write the crawl delta so downstream indexing only touches what changed."""
+    delta = {
+        "generated_at": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+        "added": sorted(added),
+        "changed": sorted(changed),
+        "removed": sorted(removed),
+        "unchanged": unchanged,
+    }
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(delta, f, indent=2, ensure_ascii=False)
+    print(f"🔁 Delta: +{len(added)} added, ~{len(changed)} changed, -{len(removed)} removed, "
+          f"{unchanged} unchanged → {path}")
+    return delta
+
+# --- Crawl frontier ---
+def docs_priority(url: str, depth: int) -> Tuple[int, int, int]:
+    """Example priority: shallow pages first, API reference before guides, short paths first."""
+    path = urlparse(url).path
+    return (depth, 0 if path.startswith("/reference") else 1, path.count("/"))
+
+class Frontier:
+    """URLs waiting to be crawled plus the set of every normalized URL ever queued.
+
+    Without a priority function this is a plain BFS queue (deque, O(1) push/pop).
+    With one, URLs come out in ascending `priority(url, depth)` order from a heap.
+    Membership checks go through the seen-set, so discovery stays O(1) per link.
+    """
+
+    def __init__(self, max_depth: int = MAX_DEPTH,
+                 priority: Optional[Callable[[str, int], object]] = None):
+        self.max_depth = max_depth
+        self.priority = priority
+        self.seen = set()
+        self.queue = deque()
+        self.heap = []
+        self.counter = itertools.count()  # Tie-breaker keeps heap order stable
+
+    def add(self, url: str, depth: int = 0) -> bool:
+        """Queue a URL unless it was seen before or is beyond max_depth."""
+        url = normalize_url(url)
+        if depth > self.max_depth or url in self.seen:
+            return False
+        self.seen.add(url)
+        if self.priority is None:
+            self.queue.append((url, depth))
+        else:
+            heapq.heappush(self.heap, (self.priority(url, depth), next(self.counter), url, depth))
+        return True
+
+    def pop(self) -> Tuple[str, int]:
+        """Return the next (url, depth) to fetch."""
+        if self.priority is None:
+            return self.queue.popleft()
+        _, _, url, depth = heapq.heappop(self.heap)
+        return url, depth
+
+    def __len__(self):
+        return len(self.heap) if self.priority is not None else len(self.queue)
+
+def scrape_capillary_docs(concurrency: int = CONCURRENCY, rate: float = RATE_LIMIT,
+                          max_retries: int = MAX_RETRIES, max_pages: int = MAX_PAGES,
+                          max_depth: int = MAX_DEPTH,
+                          priority: Optional[Callable[[str, int], object]] = None,
+                          incremental: bool = False, resume: bool = False,
+                          parse_workers: int = PARSE_WORKERS, backend: Optional[str] = None):
+    """Main scraping function.
+
+    The crawl is a two-stage pipeline. `concurrency` I/O threads share one
+    keep-alive session and fetch raw HTML; politeness comes from the per-host
+    token bucket (`rate` requests/sec) rather than a fixed sleep. Parsing and
+    extraction run in a pool of `parse_workers` processes so every core does
+    CPU work while the threads wait on the network. At most
+    `parse_workers * PARSE_BACKLOG` fetched pages may wait for a parser; when
+    that backlog is full no new fetches start, which keeps memory flat.
+    Links are followed up to `max_depth` hops from BASE_URL.
+
+    Each page is appended to the JSONL corpus as soon as it is extracted.
+    With `resume=True` pages already in the corpus are not fetched again
+    (their links come from the manifest), so an interrupted crawl continues.
 
-        documents.append({
-            "url": url,
-            "content": content
-        })
+    With `incremental=True`, pages already in the corpus are requested with
+    conditional GETs (ETag / Last-Modified from the manifest); 304 answers keep
+    the stored record, changed pages are appended and removed ones tombstoned.
+    Every run updates the manifest and writes a delta of added / changed /
+    removed URLs to DELTA_FILE.
+    """
+    backend = backend or default_backend()
+    print(f"🌐 Starting scrape of CapillaryTech Docs ({concurrency} fetchers, {parse_workers} parsers "
+          f"[{backend}], {rate} req/s)...")
 
-        # Find new links (optional: expand crawl)
-        if count < 5:  # Only explore links from first 5 pages
-            new_links = find_doc_links(soup, BASE_URL)
-            for link in new_links:
-                if link not in visited and link not in to_visit:
-                    to_visit.append(link)
+    session = get_session(concurrency)
+    limiter = HostRateLimiter(rate=rate, burst=max(BURST, concurrency / 2))
+    max_backlog = max(1, parse_workers) * PARSE_BACKLOG
 
-        visited.add(url)
+    # Start with homepage
+    frontier = Frontier(max_depth=max_depth, priority=priority)
+    frontier.add(BASE_URL, 0)
+    count = 0
+    sample_urls = []
+    start_time = time.time()
+
+    manifest = CrawlManifest()
+    writer = CorpusWriter(OUTPUT_FILE, resume=resume or incremental)
+    added, changed, unchanged = [], [], 0
+    crawled, failed = set(), set()
+
+    def follow(links: List[str], depth: int):
+        # Find new links (expand crawl until max_depth)
+        if depth < max_depth:
+            for link in links:
+                frontier.add(link, depth + 1)
+
+    def done_page(url: str, links: List[str], depth: int):
+        nonlocal count
+        crawled.add(url)
+        if len(sample_urls) < 3:
+            sample_urls.append(url)
+        follow(links, depth)
         count += 1
-        time.sleep(1.5)  # Be respectful
+        if count % CHECKPOINT_EVERY == 0:
+            manifest.save()  # Lets --resume recover links after a crash
+
+    with writer, ThreadPoolExecutor(max_workers=concurrency) as fetch_pool, \
+            ProcessPoolExecutor(max_workers=max(1, parse_workers)) as parse_pool:
+        fetching = {}  # future -> (url, depth)
+        parsing = {}   # future -> (url, depth, response headers)
+        while (frontier or fetching or parsing) and count < max_pages:
+            # Keep the fetchers busy unless the parse backlog is full or we have enough pages queued
+            while (frontier and len(fetching) < concurrency
+                   and len(fetching) + len(parsing) < max_backlog
+                   and count + len(fetching) + len(parsing) < max_pages):
+                url, depth = frontier.pop()
+                entry = manifest.get(url)
+                if resume and url in writer.urls and entry is not None:
+                    # Already scraped before the interruption
+                    unchanged += 1
+                    done_page(url, entry.get("links", []), depth)
+                    continue
+                headers = manifest.conditional_headers(url) if url in writer.urls else None
+                future = fetch_pool.submit(fetch_page, url, session, limiter, max_retries, headers)
+                fetching[future] = (url, depth)
+
+            if not fetching and not parsing:
+                continue
+
+            done, _ = wait(list(fetching) + list(parsing), return_when=FIRST_COMPLETED)
+            for future in done:
+                if future in fetching:
+                    # --- Stage 1 finished: hand the raw HTML to a parser process ---
+                    url, depth = fetching.pop(future)
+                    response, html = future.result()
+                    if response is None:
+                        failed.add(url)  # Transient failure: not evidence the page was removed
+                    elif response.status_code == 304 and count < max_pages:
+                        # Not modified: the corpus already holds it, follow the stored links
+                        print(f"♻️ Unchanged ({count+1}/{max_pages}): {url}")
+                        unchanged += 1
+                        done_page(url, manifest.get(url).get("links", []), depth)
+                    elif html is not None:
+                        parsed = parse_pool.submit(parse_page, html, backend)
+                        parsing[parsed] = (url, depth, dict(response.headers))
+                    # else 404/410 etc.: page is gone, reported as removed below
+                    continue
 
-    # Save to JSON
-    with open("data/docs.json", "w", encoding="utf-8") as f:
-        json.dump(documents, f, indent=2, ensure_ascii=False)
+                # --- Stage 2 finished: record and store the extracted page ---
+                url, depth, response_headers = parsing.pop(future)
+                try:
+                    content, links = future.result()
+                except Exception as e:
+                    print(f"❌ Failed to parse {url}: {e}")
+                    failed.add(url)
+                    continue
+                if count >= max_pages:
+                    continue
 
-    print(f"\n✅ Scraped {len(documents)} pages.")
+                print(f"📄 Fetched ({count+1}/{max_pages}): {url}")
+                if len(content) < 0:# Skip near-empty pages
+                    print(f"⚠️ Skipping (too short): {url}")
+                    continue
+
+                status = manifest.record(url, response_headers, content, links)
+                if status == "added":
+                    added.append(url)
+                elif status == "changed":
+                    changed.append(url)
+                else:
+                    unchanged += 1
+                if status != "unchanged" or url not in writer.urls:
+                    writer.write(url, content)
+                done_page(url, links, depth)
+
+        # Only a crawl that ran out of links can tell which pages disappeared
+        complete = not frontier and not fetching and not parsing
+
+        if complete:
+            removed = [url for url in manifest.entries if url not in crawled and url not in failed]
+        else:
+            removed = []
+            print("⚠️ Crawl stopped at max_pages; not reporting removed pages.")
+        for url in removed:
+            if url in writer.urls:
+                writer.delete(url)
+
+    elapsed = time.time() - start_time
+
+    manifest.remove(removed)
+    manifest.save()
+    write_delta(added, changed, removed, unchanged)
+    if incremental:
+        compact(OUTPUT_FILE)  # Drop superseded records and tombstones
+
+    print(f"\n✅ Scraped {count} pages in {elapsed:.1f}s ({count / max(elapsed, 1e-9):.2f} pages/s).")
     print(f"💾 Saved to {OUTPUT_FILE}")
     print("\nSample URLs scraped:")
-    for doc in documents[:3]:
-        print(f" - {doc['url']}")
+    for url in sample_urls:
+        print(f" - {url}")
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Crawl docs.capillarytech.com into data/docs.jsonl")
+    parser.add_argument("--concurrency", type=int, default=CONCURRENCY, help="Number of fetch workers")
+    parser.add_argument("--rate", type=float, default=RATE_LIMIT, help="Max requests per second per host")
+    parser.add_argument("--retries", type=int, default=MAX_RETRIES, help="Retries per page (exponential backoff)")
+    parser.add_argument("--max-pages", type=int, default=MAX_PAGES, help="Stop after this many pages")
+    parser.add_argument("--max-depth", type=int, default=MAX_DEPTH, help="Max link hops from the start page")
+    parser.add_argument("--priority", action="store_true",
+                        help="Crawl in docs_priority order (reference pages first) instead of plain BFS")
+    parser.add_argument("--incremental", action="store_true",
+                        help="Send conditional GETs and reuse unchanged pages from the previous crawl")
+    parser.add_argument("--resume", action="store_true",
+                        help="Continue an interrupted crawl, skipping pages already in the corpus")
+    parser.add_argument("--parse-workers", type=int, default=PARSE_WORKERS,
+                        help="Processes for HTML parsing/extraction")
+    parser.add_argument("--parser", default=None,
+                        help="Extraction backend: selectolax, lxml or html.parser (default: fastest installed)")
+    return parser.parse_args()
 
 if __name__ == "__main__":
-    scrape_capillary_docs()
\ No newline at end of file
+    args = parse_args()
+    scrape_capillary_docs(
+        concurrency=args.concurrency,
+        rate=args.rate,
+        max_retries=args.retries,
+        max_pages=args.max_pages,
+        max_depth=args.max_depth,
+        priority=docs_priority if args.priority else None,
+        incremental=args.incremental,
+        resume=args.resume,
+        parse_workers=args.parse_workers,
+        backend=args.parser,
+    )
@@ -1,10 +1,16 @@
 # scraper.py
-import json
+import sys
 import requests
 from bs4 import BeautifulSoup
 import time
+from corpus import CORPUS_FILE, CorpusWriter
+from scraper import CrawlManifest, normalize_url, write_delta
 
-def scrape_capillary_docs():
+# Own validators: scraper.py's data/manifest.json covers the full crawl, and this
+# scraper would otherwise treat every page outside its short list as removed
+SEED_MANIFEST_FILE = "data/manifest_seeds.json"
+
+def scrape_capillary_docs(incremental=False):
     base_url = "https://docs.capillarytech.com/"
     urls_to_scrape = [
         "https://docs.capillarytech.com/reference/authentication",
@@ -14,17 +20,34 @@ def scrape_capillary_docs():
         "https://docs.capillarytech.com/guides/getting-started"
     ]
 
-    scraped_data = []
+    scraped = 0
+
+    # Incremental mode: conditional GETs against this scraper's manifest,
+    # unchanged pages keep their existing record in the JSONL corpus
+    manifest = CrawlManifest(SEED_MANIFEST_FILE)
+    writer = CorpusWriter(CORPUS_FILE, resume=incremental)
+    # Manifest and new records use the normalized URL; older records may not
+    stored = {normalize_url(url): url for url in writer.urls}
+    added, changed, unchanged = [], [], 0
 
     for url in urls_to_scrape:
         print(f"Scraping: {url}")
+        key = normalize_url(url)
         try:
             headers = {
                 "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36"
             }
+            if key in stored:
+                headers.update(manifest.conditional_headers(key))
             response = requests.get(url, headers=headers, timeout=10)
             response.raise_for_status()
 
+            if response.status_code == 304:
+                print(f"♻️ Unchanged: {url}")
+                scraped += 1
+                unchanged += 1
+                continue
+
             soup = BeautifulSoup(response.text, 'html.parser')
 
             # Try to get main content — adjust selector if needed
@@ -34,25 +57,41 @@ def scrape_capillary_docs():
 
             text_content = content_div.get_text(separator="\n", strip=True)
 
-            scraped_data.append({
-                "url": url,
-                "content": text_content[:10000]  # Limit to avoid overload
-            })
+            text_content = text_content[:10000]  # Limit to avoid overload
+            status = manifest.record(key, response.headers, text_content)
+            if status != "unchanged" or stored.get(key) != key:
+                if stored.get(key, key) != key:
+                    writer.delete(stored[key])  # Replaced by the normalized record
+                writer.write(key, text_content)
+                stored[key] = key
+            scraped += 1
+            if status == "added":
+                added.append(key)
+            elif status == "changed":
+                changed.append(key)
+            else:
+                unchanged += 1
 
             time.sleep(1)  # Be respectful
 
         except Exception as e:
             print(f"⚠️ Failed to scrape {url}: {e}")
-            scraped_data.append({
-                "url": url,
-                "content": f"ERROR: Could not scrape this page. Reason: {str(e)}"
-            })
+            if key not in stored:  # Keep the last good copy in incremental mode
+                writer.write(key, f"ERROR: Could not scrape this page. Reason: {str(e)}")
+                scraped += 1
+                stored[key] = key
 
-    # Save with UTF-8 encoding
-    with open("data/docs.json", "w", encoding="utf-8") as f:
-        json.dump(scraped_data, f, indent=2, ensure_ascii=False)
+    wanted = {normalize_url(url) for url in urls_to_scrape}
+    removed = [key for key in manifest.entries if key not in wanted]
+    for key in removed:
+        if key in stored:
+            writer.delete(stored.pop(key))
+    writer.close()
+    manifest.remove(removed)
+    manifest.save()
+    write_delta(added, changed, removed, unchanged)
 
-    print(f"✅ Scraped {len(scraped_data)} pages. Saved to data/docs.json")
+    print(f"✅ Scraped {scraped} pages. Saved to {CORPUS_FILE}")
 
 if __name__ == "__main__":
-    scrape_capillary_docs()
\ No newline at end of file
+    scrape_capillary_docs(incremental="--incremental" in sys.argv)
@@ -1,138 +1,156 @@
 # optimized_chatbot.py — RAG for 1456 Pages with Gemini 2.5 Flash 🚀
 import os
-import json
 import time
 from langchain.docstore.document import Document
-from langchain.text_splitter import RecursiveCharacterTextSplitter
-from langchain_huggingface import HuggingFaceEmbeddings
-from langchain_community.vectorstores import FAISS
-from langchain.chains import RetrievalQA
-from langchain_google_genai import ChatGoogleGenerativeAI
 from dotenv import load_dotenv
+from chunker import StructureChunker, chunker_params
+from corpus import iter_corpus
+from embedding_cache import CachedEmbeddings
+from metrics import span, trace
+from vector_index import index_config, load_or_build
 
 # --- Configuration & Setup ---
 load_dotenv()
 # Define constants for better configuration management
-CHUNK_SIZE = 700 
-CHUNK_OVERLAP = 70
+CHUNK_TOKENS = 200 # Structure-aware chunks sized in MiniLM word pieces (the model reads at most 256)
 K_RETRIEVAL = 3 # Increased from 2 to 3 for better context coverage from a large docset
 EMBEDDING_MODEL = "sentence-transformers/all-MiniLM-L6-v2"
 VECTOR_STORE_PATH = "faiss_index_1456_pages" # New: Save/Load the index
+CHUNK_PARAMS = chunker_params(CHUNK_TOKENS, tokenizer=EMBEDDING_MODEL)
+# Search index: "flat" (exact), or "ivf" / "hnsw" / "ivfpq" for large corpora (see bench_ann.py).
+# The type only applies to a new index; a built one is served with its recorded build parameters,
+# and only the query-time knobs below change without a rebuild.
+INDEX_CONFIG = index_config(type=os.getenv("INDEX_TYPE", "flat"),
+                            nprobe=int(os.getenv("INDEX_NPROBE", "8")),         # IVF lists visited per query
+                            ef_search=int(os.getenv("INDEX_EF_SEARCH", "64")))  # HNSW candidates per query
 
 # --- Load & Pre-process Data ---
-def load_and_split_documents(file_path="data/docs.json"):
-    """Loads documents from JSON, converts to LangChain Document objects, and splits them."""
-    print("⏳ Loading and parsing documents...")
-    with open(file_path, "r", encoding="utf-8") as f:
-        raw_docs = json.load(f)
+def get_text_splitter():
+    """The chunking used for the index (its parameters are recorded in the index manifest).
+
+    Splits on headings, keeps code fences and tables whole where possible,
+    runs across documents in parallel and caches chunks per document hash.
+    """
+    return StructureChunker(chunk_tokens=CHUNK_TOKENS, tokenizer=EMBEDDING_MODEL)
 
-    # Convert to Document objects
-    documents = [
-        Document(page_content=doc["content"], metadata={"source": doc["url"]})
-        for doc in raw_docs
-    ]
+def iter_documents(file_path=None):
+    """Streams the JSONL corpus as LangChain Document objects (never fully in memory)."""
+    for doc in iter_corpus(file_path):
+        yield Document(page_content=doc["content"], metadata={"source": doc["url"]})
+
+def load_and_split_documents(file_path=None):
+    """Streams documents from the JSONL corpus, converts to LangChain Document objects, and splits them."""
+    print("⏳ Loading and parsing documents...")
 
     # Split text into chunks
-    text_splitter = RecursiveCharacterTextSplitter(
-        chunk_size=CHUNK_SIZE, 
-        chunk_overlap=CHUNK_OVERLAP, 
-        # Add common separators for better splitting logic
-        separators=["\n\n", "\n", " ", ""] 
-    )
-    splits = text_splitter.split_documents(documents)
-    print(f"✅ Loaded {len(documents)} source documents, resulting in {len(splits)} chunks.")
+    text_splitter = get_text_splitter()
+
+    splits = []
+    num_documents = 0
+    for _, chunks in text_splitter.map(iter_documents(file_path)):
+        splits.extend(chunks)
+        num_documents += 1
+    print(f"✅ Loaded {num_documents} source documents, resulting in {len(splits)} chunks.")
+    text_splitter.report()
     return splits
 
 # --- Vector Store (Optimized for Large Context) ---
-def setup_vector_store(splits):
-    """Sets up or loads the FAISS vector store."""
-    embeddings = HuggingFaceEmbeddings(model_name=EMBEDDING_MODEL)
-
-    if os.path.exists(VECTOR_STORE_PATH):
-        print(f"⏳ Loading existing FAISS index from '{VECTOR_STORE_PATH}'...")
-        vectorstore = FAISS.load_local(
-            folder_path=VECTOR_STORE_PATH, 
-            embeddings=embeddings, 
-            allow_dangerous_deserialization=True # Necessary for loading
-        )
-        print("✅ FAISS index loaded.")
-    else:
-        print("⏳ Creating new FAISS index (This may take a minute for 1456 pages)...")
-        start_time = time.time()
-        # Use from_documents for initial index creation
-        vectorstore = FAISS.from_documents(splits, embeddings)
-        # Save the index for future fast loads
-        vectorstore.save_local(VECTOR_STORE_PATH)
-        end_time = time.time()
-        print(f"✅ FAISS index created and saved in {end_time - start_time:.2f} seconds.")
-
+def get_embeddings(cached=True):
+    """MiniLM embeddings (torch is imported here, not at module import)."""
+    from langchain_huggingface import HuggingFaceEmbeddings
+    # Normalized like build_index.py, so vectors from both paths are interchangeable
+    embeddings = HuggingFaceEmbeddings(model_name=EMBEDDING_MODEL, encode_kwargs={"normalize_embeddings": True})
+    # Cached: chunks already embedded by a previous build are read back from disk
+    return CachedEmbeddings(embeddings, model_name=EMBEDDING_MODEL) if cached else embeddings
+
+def setup_vector_store(file_path=None):
+    """Loads the FAISS vector store, updating it in place if the corpus changed (or builds it)."""
+    embeddings = get_embeddings()
+    text_splitter = get_text_splitter()
+
+    # The index manifest detects a stale index; only changed documents are split and re-embedded
+    vectorstore = load_or_build(
+        VECTOR_STORE_PATH,
+        documents=lambda: iter_documents(file_path),
+        split=text_splitter,
+        embeddings=embeddings,
+        embedding_model=EMBEDDING_MODEL,
+        chunk_params=CHUNK_PARAMS,
+        config=INDEX_CONFIG,
+    )
+    text_splitter.report()
+    embeddings.report()
     return vectorstore
 
 # --- Main QA Chain Setup ---
 def setup_qa_chain(vectorstore):
-    """Initializes the Gemini LLM and the RetrievalQA chain."""
-    print("⏳ Setting up Gemini and QA chain...")
-    
-    # LLM: GEMINI 2.5 FLASH (Use environment variable for key)
-    llm = ChatGoogleGenerativeAI(
-        model="gemini-2.5-flash",
-        google_api_key=os.getenv("GEMINI_API_KEY"),
-        temperature=0.1,  # Keep low for factual Q/A
-        max_tokens=1024,  # Increased output token limit for detailed answers
-    )
-
-    # QA Chain
-    qa_chain = RetrievalQA.from_chain_type(
-        llm=llm,
-        retriever=vectorstore.as_retriever(
-            search_type="similarity_score_threshold", # Optimization for relevance
-            search_kwargs={"k": K_RETRIEVAL, "score_threshold": 0.75} # Use threshold
-        ),
-        return_source_documents=True,
-        # Set chain_type="stuff" which is the default, but good to know
-        chain_type="stuff"
-    )
+    """The RetrievalQA-compatible RAG service over this vector store, answering with LLM_BACKEND."""
+    from llm_backends import get_backend
+    from rag_service import get_service
+    print(f"⏳ Setting up {get_backend().describe()} and QA chain...")
+
+    # Same pipeline as the web app:
+    # Hybrid: BM25 catches exact identifiers (endpoints, field names) that the
+    # 0.75 similarity threshold used to drop, fused with FAISS by reciprocal rank.
+    # Packed: overlapping neighbour chunks merged, near-duplicates dropped, token-budgeted
+    # LLM: Gemini 2.5 Flash over the pooled client (LLM_BACKEND=gemini, the default),
+    # or a local CPU model that batches requests and reuses the system prompt's KV cache (LLM_BACKEND=local)
+    qa_chain = get_service().warm(vectorstore)
     print("✅ QA Chain ready.")
     return qa_chain
 
 # --- Chat Interface (Refined) ---
-def ask_question(qa_chain, query):
+def ask_question(qa_chain, query, cache=None):
     """Processes a single question and prints the answer and sources."""
     print(f"\n💬 You: {query}")
     try:
-        start_time = time.time()
-        # Use .invoke() — modern LangChain
-        result = qa_chain.invoke({"query": query})
-        end_time = time.time()
+        # Traced: per-stage timings print below and go to the query log (metrics.py)
+        with trace("cli", query) as query_trace:
+            start_time = time.time()
+            with span("cache_lookup"):
+                cached = cache.get(query) if cache is not None else None
+            if cached is not None:
+                # Repeat / near-duplicate question: no retrieval, no Gemini call
+                print(f"🤖 Bot (cached {cached['cache']}, in {time.time() - start_time:.3f}s): {cached['answer']}")
+                print(f"📚 Sources: {', '.join(cached['sources'])}")
+                print(f"⏱️ {query_trace.summary()}")
+                return
+
+            # Use .invoke() — modern LangChain
+            result = qa_chain.invoke({"query": query})
+            end_time = time.time()
         
-        answer = result["result"]
+            answer = result["result"]
         
-        # Clean verbose output (no longer needed if prompt templates are good, but kept as safeguard)
-        if answer.startswith("Answer:"):
-            answer = answer.replace("Answer:", "", 1).strip()
+            # Clean verbose output (no longer needed if prompt templates are good, but kept as safeguard)
+            if answer.startswith("Answer:"):
+                answer = answer.replace("Answer:", "", 1).strip()
 
-        print(f"🤖 Bot (in {end_time - start_time:.2f}s): {answer}")
+            print(f"🤖 Bot (in {end_time - start_time:.2f}s): {answer}")
         
-        # Display sources
-        sources = [doc.metadata["source"] for doc in result["source_documents"]]
-        unique_sources = list(set(sources)) # Only show unique URLs
-        print(f"📚 Sources: {', '.join(unique_sources)}")
+            # Display sources
+            sources = [doc.metadata["source"] for doc in result["source_documents"]]
+            unique_sources = list(set(sources)) # Only show unique URLs
+            print(f"📚 Sources: {', '.join(unique_sources)}")
+            print(f"⏱️ {query_trace.summary()}")
+            if cache is not None and unique_sources:  # Only cache answers grounded in retrieved docs
+                cache.put(query, answer, unique_sources)
 
     except Exception as e:
         print(f"❌ Error during query: {e}")
         print("💡 Tip: Check your GEMINI_API_KEY, internet connection, or document format.")
 
 if __name__ == "__main__":
-    # 1. Load and Split Documents
-    splits = load_and_split_documents()
+    from llm_backends import get_backend
 
-    # 2. Setup Vector Store (Create or Load)
-    vectorstore = setup_vector_store(splits)
+    # 1. Setup Vector Store (Load, update changed documents, or create)
+    vectorstore = setup_vector_store()
 
-    # 3. Setup QA Chain
+    # 2. Setup QA Chain: the shared service (same retriever, answer cache and LLM backend as the web app)
     qa_chain = setup_qa_chain(vectorstore)
+    answer_cache = qa_chain.answer_cache
 
-    print("\n\n🚀 RAG Chatbot (Powered by Gemini 2.5 Flash) Ready!")
+    print(f"\n\n🚀 RAG Chatbot (Powered by {get_backend().describe()}) Ready!")
     print("Ask me anything about your document set.")
     print("Type 'exit' or 'quit' to end.\n")
 
@@ -140,9 +158,10 @@ if __name__ == "__main__":
     while True:
         q = input("\n💬 You: ")
         if q.lower() in ["exit", "quit"]:
+            answer_cache.report()
             break
         
         if not q.strip():
              continue
              
-        ask_question(qa_chain, q)
\ No newline at end of file
+        ask_question(qa_chain, q, cache=answer_cache)
\ No newline at end of file
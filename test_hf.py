@@ -1,31 +1,36 @@
-# test_hf.py (UPDATED)
-from huggingface_hub import InferenceClient
+# test_hf.py (UPDATED) — check that the local LLM backend loads and answers, fully offline after the first download
 import os
+import time
 from dotenv import load_dotenv
 
 load_dotenv()
 
-token = os.getenv("HUGGINGFACEHUB_API_TOKEN")
-if not token:
-    print("❌ ERROR: HUGGINGFACEHUB_API_TOKEN not found in .env")
-    exit(1)
+from llm_backends import LocalBackend
+from rag_service import SYSTEM_PROMPT
 
-print(f"✅ Token loaded (starts with: {token[:6]}...)")
-print("🧪 Testing connection to Hugging Face with flan-t5-base...")
-
-client = InferenceClient(
-    model="google/flan-t5-base",  # ← CHANGED HERE
-    token=token
-)
+backend = LocalBackend()
+print(f"🧪 Testing the local backend: {backend.describe()}")
+print("   (set LOCAL_LLM_MODEL to try another model; LOCAL_LLM_QUANTIZE=1 for int8 weights)")
 
 try:
-    response = client.text_generation("What is API authentication?", max_new_tokens=20)
-    print("🎉 SUCCESS! Model responded:")
+    backend.load()
+    start_time = time.time()
+    response = backend.generate("What is API authentication?", system=SYSTEM_PROMPT, max_tokens=40)
+    print(f"🎉 SUCCESS! Model responded in {time.time() - start_time:.1f}s:")
     print(f"💬 '{response}'")
+
+    # Same system prompt again: its KV cache is reused, only the question is run through the model
+    start_time = time.time()
+    backend.generate("How do I create a customer?", system=SYSTEM_PROMPT, max_tokens=40)
+    print(f"⚡ Second answer (system prompt cached) in {time.time() - start_time:.1f}s")
+    print(f"📊 {backend.report()}")
+    print("\n➡️  Use it for every answer path with LLM_BACKEND=local; measure throughput with:")
+    print("   python bench_rag.py generate --requests 32 --concurrency 8")
 except Exception as e:
-    print("❌ FAILED to reach Hugging Face:")
+    print("❌ FAILED to run the local model:")
     print(f"❗ {type(e).__name__}: {str(e)}")
     print("\n🛠️  QUICK FIXES:")
-    print("- Go to https://huggingface.co/google/flan-t5-base and accept terms if prompted")
-    print("- Regenerate token at https://huggingface.co/settings/tokens")
-    print("- Still failing? Use LOCAL MODEL (instructions below)")
\ No newline at end of file
+    print("- pip install transformers torch (see requirements.txt)")
+    print(f"- The first run downloads '{backend.model_name}' from Hugging Face; later runs work offline")
+    if not os.getenv("HF_TOKEN"):
+        print("- Gated models: accept the terms on the model page, then set HF_TOKEN in .env")
\ No newline at end of file
@@ -0,0 +1,442 @@
+# vector_index.py — persisted FAISS index with a manifest for stale-index detection
+import os
+import json
+import time
+import sqlite3
+import hashlib
+import threading
+from collections.abc import Mapping
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Tuple, Union
+import faiss
+import numpy as np
+from langchain.docstore.document import Document
+from langchain_community.docstore.base import AddableMixin, Docstore
+from langchain_community.vectorstores import FAISS
+
+INDEX_MANIFEST = "index_manifest.json"
+INDEX_FILE = "index.faiss"         # Flat vectors (faiss.write_index format)
+DOCSTORE_FILE = "chunks.sqlite"    # Chunk text + metadata and the position -> id map
+LEGACY_DOCSTORE_FILE = "index.pkl" # LangChain save_local pickle, migrated on first load
+ANN_INDEX_FILE = "ann.faiss"  # Derived search index; index.faiss stays the flat source of truth
+# Serving processes map index files instead of reading them, so workers share the OS page cache.
+# Newer faiss maps any index type (IFC); combined with IO_FLAG_MMAP it refuses IVF indexes
+MMAP_FLAGS = (getattr(faiss, "IO_FLAG_MMAP_IFC", 0) or faiss.IO_FLAG_MMAP) | faiss.IO_FLAG_READ_ONLY
+
+# --- ANN index types ---
+INDEX_TYPES = ("flat", "ivf", "hnsw", "ivfpq")
+DEFAULT_INDEX_CONFIG = {
+    "type": "flat",
+    "nlist": 0,             # IVF lists; 0 = auto (about 4 * sqrt(n))
+    "train_size": 20000,    # Vectors sampled to train IVF / PQ quantizers
+    "hnsw_m": 32,           # HNSW graph degree
+    "ef_construction": 200,
+    "pq_m": 16,             # PQ sub-quantizers (must divide the embedding dimension)
+    "pq_bits": 8,
+    "fp16": False,          # Store vectors as float16 (flat / ivf / hnsw)
+    "nprobe": 8,            # Query time: IVF lists visited
+    "ef_search": 64,        # Query time: HNSW candidate list size
+}
+SEARCH_PARAMS = ("nprobe", "ef_search")  # Changing these never requires a rebuild
+
+def document_hash(content: str) -> str:
+    return hashlib.sha256(content.encode("utf-8")).hexdigest()
+
+def chunk_ids(source: str, count: int) -> List[str]:
+    """Stable docstore ids for the chunks of one source URL."""
+    prefix = hashlib.sha1(source.encode("utf-8")).hexdigest()[:16]
+    return [f"{prefix}:{i}" for i in range(count)]
+
+def corpus_fingerprint(doc_hashes: Dict[str, str]) -> str:
+    """One hash for the whole corpus: changes whenever any page is added, edited or removed."""
+    digest = hashlib.sha256()
+    for source in sorted(doc_hashes):
+        digest.update(f"{source}\t{doc_hashes[source]}\n".encode("utf-8"))
+    return digest.hexdigest()
+
+class IndexManifest:
+    """What an index on disk was built from.
+
+    Records the embedding model, the chunking parameters, the corpus
+    fingerprint and, per source URL, the content hash and the docstore ids of
+    its chunks, so single documents can be replaced or deleted in place.
+    """
+
+    def __init__(self, embedding_model: str, chunk_params: Dict,
+                 documents: Optional[Dict[str, Dict]] = None, corpus_fingerprint: str = "",
+                 ann: Optional[Dict] = None):
+        self.embedding_model = embedding_model
+        self.chunk_params = chunk_params
+        self.documents = documents or {}
+        self.corpus_fingerprint = corpus_fingerprint
+        self.ann = ann  # Build parameters of ann.faiss, if one was derived
+
+    @classmethod
+    def load(cls, folder: str) -> Optional["IndexManifest"]:
+        path = os.path.join(folder, INDEX_MANIFEST)
+        if not os.path.exists(path):
+            return None
+        with open(path, "r", encoding="utf-8") as f:
+            data = json.load(f)
+        return cls(data["embedding_model"], data["chunk_params"],
+                   data.get("documents", {}), data.get("corpus_fingerprint", ""), data.get("ann"))
+
+    def save(self, folder: str):
+        os.makedirs(folder, exist_ok=True)
+        self.corpus_fingerprint = corpus_fingerprint(
+            {source: entry["hash"] for source, entry in self.documents.items()})
+        tmp_path = os.path.join(folder, INDEX_MANIFEST + ".tmp")
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump({
+                "embedding_model": self.embedding_model,
+                "chunk_params": self.chunk_params,
+                "corpus_fingerprint": self.corpus_fingerprint,
+                "ann": self.ann,
+                "built_at": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+                "documents": self.documents,
+            }, f, ensure_ascii=False)
+        os.replace(tmp_path, os.path.join(folder, INDEX_MANIFEST))
+
+    def compatible(self, embedding_model: str, chunk_params: Dict) -> bool:
+        """Vectors can only be reused if the model and chunking are unchanged."""
+        return self.embedding_model == embedding_model and self.chunk_params == chunk_params
+
+# --- On-disk docstore (replaces the pickled index.pkl) ---
+class SqliteDocstore(Docstore, AddableMixin):
+    """LangChain docstore backed by SQLite: chunks are read on demand, never unpickled.
+
+    `chunks` holds id -> text/metadata, `positions` maps FAISS row -> id.
+    Connections are per thread and per process, so the store is safe to use
+    from a threaded server and after a fork.
+    """
+
+    def __init__(self, path: str, readonly: bool = True):
+        self.path = path
+        self.readonly = readonly
+        self._local = threading.local()
+        if not readonly:
+            conn = self.conn
+            conn.execute("CREATE TABLE IF NOT EXISTS chunks (id TEXT PRIMARY KEY, text TEXT NOT NULL, metadata TEXT NOT NULL)")
+            conn.execute("CREATE TABLE IF NOT EXISTS positions (pos INTEGER PRIMARY KEY, id TEXT NOT NULL)")
+
+    @property
+    def conn(self) -> sqlite3.Connection:
+        local = self._local
+        if getattr(local, "pid", None) != os.getpid():
+            if self.readonly:
+                local.conn = sqlite3.connect(f"file:{self.path}?mode=ro", uri=True, check_same_thread=False)
+            else:
+                local.conn = sqlite3.connect(self.path, check_same_thread=False)
+            local.pid = os.getpid()
+        return local.conn
+
+    def search(self, search: str) -> Union[str, Document]:
+        row = self.conn.execute("SELECT text, metadata FROM chunks WHERE id = ?", (search,)).fetchone()
+        if row is None:
+            return f"ID {search} not found."
+        return Document(page_content=row[0], metadata=json.loads(row[1]))
+
+    def add(self, texts: Dict[str, Document]) -> None:
+        self.conn.executemany(
+            "INSERT OR REPLACE INTO chunks (id, text, metadata) VALUES (?, ?, ?)",
+            [(id_, doc.page_content, json.dumps(doc.metadata, ensure_ascii=False)) for id_, doc in texts.items()])
+
+    def delete(self, ids: List) -> None:
+        self.conn.executemany("DELETE FROM chunks WHERE id = ?", [(id_,) for id_ in ids])
+
+    def write_positions(self, index_to_docstore_id: Mapping):
+        self.conn.execute("DELETE FROM positions")
+        self.conn.executemany("INSERT INTO positions (pos, id) VALUES (?, ?)",
+                              [(int(pos), id_) for pos, id_ in index_to_docstore_id.items()])
+        self.conn.commit()
+
+    def positions(self) -> Dict[int, str]:
+        return dict(self.conn.execute("SELECT pos, id FROM positions"))
+
+    def iter_texts(self) -> Iterator[Tuple[int, str]]:
+        """(FAISS row, chunk text) for every indexed chunk, in one scan."""
+        return iter(self.conn.execute(
+            "SELECT p.pos, c.text FROM positions p JOIN chunks c ON c.id = p.id ORDER BY p.pos"))
+
+class SqliteIdMap(Mapping):
+    """Read-only FAISS row -> docstore id lookup that queries SQLite instead of holding a dict."""
+
+    def __init__(self, docstore: SqliteDocstore):
+        self.docstore = docstore
+
+    def __getitem__(self, pos) -> str:
+        row = self.docstore.conn.execute("SELECT id FROM positions WHERE pos = ?", (int(pos),)).fetchone()
+        if row is None:
+            raise KeyError(pos)
+        return row[0]
+
+    def __iter__(self) -> Iterator[int]:
+        return (pos for (pos,) in self.docstore.conn.execute("SELECT pos FROM positions ORDER BY pos"))
+
+    def __len__(self) -> int:
+        return self.docstore.conn.execute("SELECT COUNT(*) FROM positions").fetchone()[0]
+
+def save_store(vectorstore: FAISS, folder: str):
+    """Persist a store as index.faiss + chunks.sqlite (the flat index must still be attached)."""
+    os.makedirs(folder, exist_ok=True)
+    faiss.write_index(vectorstore.index, os.path.join(folder, INDEX_FILE))
+    path = os.path.join(folder, DOCSTORE_FILE)
+    docstore = vectorstore.docstore
+    if isinstance(docstore, SqliteDocstore) and os.path.abspath(docstore.path) == os.path.abspath(path):
+        docstore.write_positions(vectorstore.index_to_docstore_id)  # Chunk rows were edited in place
+    else:
+        tmp_path = path + ".tmp"
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        target = SqliteDocstore(tmp_path, readonly=False)
+        target.add({id_: docstore.search(id_) for id_ in vectorstore.index_to_docstore_id.values()})
+        target.write_positions(vectorstore.index_to_docstore_id)
+        target.conn.close()
+        os.replace(tmp_path, path)
+    legacy = os.path.join(folder, LEGACY_DOCSTORE_FILE)
+    if os.path.exists(legacy):
+        os.remove(legacy)
+
+def load_store(folder: str, embeddings, mmap: bool = True, writable: bool = False) -> FAISS:
+    """Open a saved store without unpickling anything.
+
+    Serving (default): the index is memory-mapped read-only and chunk text is
+    fetched from SQLite per hit, so start-up cost does not grow with the
+    corpus. `writable=True` reads the index into RAM for in-place updates.
+    """
+    docstore_path = os.path.join(folder, DOCSTORE_FILE)
+    if not os.path.exists(docstore_path) and os.path.exists(os.path.join(folder, LEGACY_DOCSTORE_FILE)):
+        print(f"⏳ Migrating pickled docstore in '{folder}' to {DOCSTORE_FILE} (one time)...")
+        legacy = FAISS.load_local(folder_path=folder, embeddings=embeddings,
+                                  allow_dangerous_deserialization=True)
+        save_store(legacy, folder)
+    index = faiss.read_index(os.path.join(folder, INDEX_FILE), 0 if writable or not mmap else MMAP_FLAGS)
+    docstore = SqliteDocstore(docstore_path, readonly=not writable)
+    index_to_docstore_id = docstore.positions() if writable else SqliteIdMap(docstore)
+    return FAISS(embeddings, index, docstore, index_to_docstore_id)
+
+def index_config(**overrides) -> Dict:
+    """DEFAULT_INDEX_CONFIG with overrides applied (None values are ignored)."""
+    config = dict(DEFAULT_INDEX_CONFIG)
+    config.update({key: value for key, value in overrides.items() if value is not None})
+    if config["type"] not in INDEX_TYPES:
+        raise ValueError(f"Unknown index type {config['type']!r}; choose one of {', '.join(INDEX_TYPES)}")
+    return config
+
+def build_params(config: Dict) -> Dict:
+    """The part of an index config that is baked into the index at build time."""
+    return {key: value for key, value in config.items() if key not in SEARCH_PARAMS}
+
+def factory_string(config: Dict, ntotal: int, dimension: int) -> str:
+    """faiss.index_factory description for a config and corpus size."""
+    storage = "SQfp16" if config["fp16"] else "Flat"
+    if config["type"] == "flat":
+        return storage
+    if config["type"] == "hnsw":
+        return f"HNSW{config['hnsw_m']}" + (",SQfp16" if config["fp16"] else "")
+    # Quantizers train on the sample, so size them by it (faiss wants ~39 points per centroid)
+    sample = min(ntotal, config["train_size"])
+    nlist = config["nlist"] or max(1, min(int(4 * np.sqrt(ntotal)), sample // 39))
+    if sample < nlist:
+        raise ValueError(f"IVF{nlist} needs at least {nlist} training vectors, only {sample} available")
+    if config["type"] == "ivf":
+        return f"IVF{nlist},{storage}"
+    if dimension % config["pq_m"]:
+        raise ValueError(f"pq_m={config['pq_m']} must divide the embedding dimension {dimension}")
+    if sample < 2 ** config["pq_bits"]:
+        raise ValueError(f"PQ with {config['pq_bits']} bits needs at least {2 ** config['pq_bits']} "
+                         f"training vectors, only {sample} available")
+    return f"IVF{nlist},PQ{config['pq_m']}x{config['pq_bits']}"
+
+def wants_ann(config: Optional[Dict]) -> bool:
+    return config is not None and (config["type"] != "flat" or config["fp16"])
+
+def serving_config(manifest: Optional[IndexManifest], config: Optional[Dict] = None) -> Optional[Dict]:
+    """Build parameters of the ANN index recorded in the manifest, with the query-time knobs of `config`."""
+    if manifest is None or manifest.ann is None:
+        return None
+    search = {key: (config or DEFAULT_INDEX_CONFIG)[key] for key in SEARCH_PARAMS}
+    return {**DEFAULT_INDEX_CONFIG, **manifest.ann, **search}
+
+def set_search_params(index: faiss.Index, config: Dict):
+    """Apply query-time knobs (nprobe for IVF, efSearch for HNSW)."""
+    params = faiss.ParameterSpace()
+    if config["type"] in ("ivf", "ivfpq"):
+        params.set_index_parameter(index, "nprobe", config["nprobe"])
+    elif config["type"] == "hnsw":
+        params.set_index_parameter(index, "efSearch", config["ef_search"])
+
+def build_ann_index(vectors: np.ndarray, config: Dict) -> faiss.Index:
+    """Train (on a random sample of at most train_size vectors) and fill an index."""
+    vectors = np.ascontiguousarray(vectors, dtype=np.float32)
+    ntotal, dimension = vectors.shape
+    index = faiss.index_factory(dimension, factory_string(config, ntotal, dimension))
+    hnsw = getattr(faiss.downcast_index(index), "hnsw", None)
+    if hnsw is not None:
+        hnsw.efConstruction = config["ef_construction"]
+    if not index.is_trained:
+        rng = np.random.default_rng(0)
+        sample = rng.choice(ntotal, size=min(ntotal, config["train_size"]), replace=False)
+        index.train(vectors[np.sort(sample)])
+    index.add(vectors)
+    set_search_params(index, config)
+    return index
+
+def attach_ann_index(vectorstore: FAISS, folder: str, manifest: IndexManifest,
+                     config: Optional[Dict]) -> FAISS:
+    """Build the configured ANN index from the flat vectors and swap it in.
+
+    The index is written to ann.faiss and its build parameters to the
+    manifest, where open_vector_store picks them up. Positions are
+    preserved, so the docstore mapping stays valid. Only build paths call
+    this (build_index.py, load_or_build).
+    """
+    if not wants_ann(config):
+        return vectorstore
+    print(f"⏳ Building {config['type']} index over {vectorstore.index.ntotal} vectors...")
+    start_time = time.time()
+    try:
+        index = build_ann_index(vectorstore.index.reconstruct_n(0, vectorstore.index.ntotal), config)
+    except ValueError as e:  # Corpus too small for this index: exact search still works
+        print(f"⚠️ {e}; searching the flat index instead.")
+        manifest.ann = None
+        manifest.save(folder)
+        return vectorstore
+    faiss.write_index(index, os.path.join(folder, ANN_INDEX_FILE))
+    manifest.ann = build_params(config)
+    manifest.save(folder)
+    print(f"✅ {config['type']} index built in {time.time() - start_time:.2f}s.")
+    vectorstore.index = index
+    return vectorstore
+
+def split_documents(documents: Iterable[Document], split) -> Iterator[Tuple[Document, List[Document]]]:
+    """(document, chunks) pairs; a splitter with a batch `map` (chunker.StructureChunker) runs in parallel."""
+    if hasattr(split, "map"):
+        return split.map(documents)
+    return ((document, split(document)) for document in documents)
+
+def build_vector_store(documents: Iterable[Document], split: Callable[[Document], List[Document]],
+                       embeddings, embedding_model: str, chunk_params: Dict) -> Tuple[FAISS, IndexManifest]:
+    """Full build: split every document, embed all chunks, record the manifest."""
+    manifest = IndexManifest(embedding_model, chunk_params)
+    all_chunks, all_ids = [], []
+    for document, chunks in split_documents(documents, split):
+        ids = chunk_ids(document.metadata["source"], len(chunks))
+        manifest.documents[document.metadata["source"]] = {
+            "hash": document_hash(document.page_content), "ids": ids}
+        all_chunks.extend(chunks)
+        all_ids.extend(ids)
+    vectorstore = FAISS.from_documents(all_chunks, embeddings, ids=all_ids)
+    return vectorstore, manifest
+
+def sync_vector_store(vectorstore: FAISS, manifest: IndexManifest, documents: Iterable[Document],
+                      split: Callable[[Document], List[Document]]) -> Dict[str, int]:
+    """Apply corpus changes to an existing index in place.
+
+    Documents whose content hash is unchanged are skipped without splitting.
+    Changed documents have their old chunk vectors deleted and their new
+    chunks added; documents that left the corpus are deleted by source URL.
+    """
+    seen = set()
+    stale_ids, new_chunks, new_ids, to_split = [], [], [], []
+    counts = {"added": 0, "changed": 0, "removed": 0, "unchanged": 0}
+    for document in documents:
+        source = document.metadata["source"]
+        seen.add(source)
+        digest = document_hash(document.page_content)
+        entry = manifest.documents.get(source)
+        if entry is not None and entry["hash"] == digest:
+            counts["unchanged"] += 1
+            continue
+        if entry is not None:
+            stale_ids.extend(entry["ids"])
+            counts["changed"] += 1
+        else:
+            counts["added"] += 1
+        to_split.append(document)
+
+    for document, chunks in split_documents(to_split, split):
+        ids = chunk_ids(document.metadata["source"], len(chunks))
+        manifest.documents[document.metadata["source"]] = {"hash": document_hash(document.page_content), "ids": ids}
+        new_chunks.extend(chunks)
+        new_ids.extend(ids)
+
+    for source in [source for source in manifest.documents if source not in seen]:
+        stale_ids.extend(manifest.documents.pop(source)["ids"])
+        counts["removed"] += 1
+
+    if stale_ids:
+        vectorstore.delete(stale_ids)
+    if new_chunks:
+        vectorstore.add_documents(new_chunks, ids=new_ids)
+    return counts
+
+def open_vector_store(folder: str, embeddings, config: Optional[Dict] = None) -> FAISS:
+    """Serving-only open: memory-mapped, no corpus scan, no rebuild (see load_or_build).
+
+    Searches go through the ANN index the manifest records, whatever its
+    build parameters; only nprobe / ef_search are taken from `config`.
+    """
+    manifest = IndexManifest.load(folder)
+    vectorstore = load_store(folder, embeddings)
+    built = serving_config(manifest, config)
+    if wants_ann(config) and (built is None or config["type"] != built["type"]):
+        print(f"⚠️ INDEX_TYPE={config['type']} ignored: '{folder}' was built as "
+              f"{built['type'] if built else 'flat'} (rebuild with build_index.py --index-type {config['type']}).")
+    if built is None:
+        return vectorstore
+    path = os.path.join(folder, ANN_INDEX_FILE)
+    if not os.path.exists(path):
+        print(f"⚠️ {ANN_INDEX_FILE} is missing from '{folder}'; searching the flat index.")
+        return vectorstore
+    index = faiss.read_index(path, MMAP_FLAGS)
+    set_search_params(index, built)
+    vectorstore.index = index
+    return vectorstore
+
+def load_or_build(folder: str, documents: Callable[[], Iterable[Document]],
+                  split: Callable[[Document], List[Document]], embeddings,
+                  embedding_model: str, chunk_params: Dict,
+                  config: Optional[Dict] = None) -> FAISS:
+    """Load the index in `folder`, bringing it up to date with the corpus.
+
+    - no index, no manifest, or a different model / chunking: full rebuild
+    - same corpus fingerprint: used as is
+    - otherwise: only the changed documents are re-embedded (sync_vector_store)
+    `documents` is called to get a fresh (lazy) iterator over the corpus.
+    With a non-flat `config` (see index_config) searches go through the
+    derived ANN index instead of the flat one.
+    """
+    manifest = IndexManifest.load(folder)
+    index_exists = os.path.exists(os.path.join(folder, INDEX_FILE))
+
+    if index_exists and manifest is not None and manifest.compatible(embedding_model, chunk_params):
+        print(f"⏳ Loading existing FAISS index from '{folder}'...")
+        doc_hashes = {doc.metadata["source"]: document_hash(doc.page_content) for doc in documents()}
+        if corpus_fingerprint(doc_hashes) == manifest.corpus_fingerprint:
+            if manifest.ann is None and wants_ann(config):  # First run with INDEX_TYPE set
+                return attach_ann_index(load_store(folder, embeddings), folder, manifest, config)
+            vectorstore = open_vector_store(folder, embeddings, config)
+            print("✅ FAISS index loaded (up to date with the corpus).")
+            return vectorstore
+
+        print("⏳ Corpus changed since the index was built, updating in place...")
+        start_time = time.time()
+        vectorstore = load_store(folder, embeddings, writable=True)
+        counts = sync_vector_store(vectorstore, manifest, documents(), split)
+        save_store(vectorstore, folder)
+        manifest.save(folder)
+        print(f"✅ Index updated in {time.time() - start_time:.2f}s: +{counts['added']} added, "
+              f"~{counts['changed']} changed, -{counts['removed']} removed, {counts['unchanged']} unchanged.")
+        # The vectors moved: rebuild the ANN index with the parameters it was built with
+        return attach_ann_index(vectorstore, folder, manifest, serving_config(manifest, config) or config)
+
+    if index_exists:
+        print("⚠️ Index was built with a different model/chunking (or has no manifest); rebuilding.")
+    print("⏳ Creating new FAISS index...")
+    start_time = time.time()
+    vectorstore, manifest = build_vector_store(documents(), split, embeddings, embedding_model, chunk_params)
+    # Save the index for future fast loads
+    save_store(vectorstore, folder)
+    manifest.save(folder)
+    print(f"✅ FAISS index created and saved in {time.time() - start_time:.2f} seconds.")
+    return attach_ann_index(vectorstore, folder, manifest, config)
@@ -1,91 +1,40 @@
 import os
 import json
-from flask import Flask, request, jsonify, render_template
+import asyncio
+from flask import Flask, Response, request, jsonify, render_template, stream_with_context
 from dotenv import load_dotenv
 
-# --- Load Environment Variables ---
+# --- Load Environment Variables (before the RAG modules read LLM_BACKEND, QUERY_LOG, ...) ---
 load_dotenv()
-GEMINI_API_KEY = os.getenv("GEMINI_API_KEY")
+
+import metrics
+from batch_qa import MAX_BATCH_QUESTIONS, parse_questions, run_batch
+from llm_backends import get_backend
+from rag_service import ServiceNotReady, get_service
 
 # --- Flask App Initialization ---
 app = Flask(__name__)
 
-# --- Configuration & RAG Setup Placeholder ---
-# In a full deployment, this section would contain the RAG initialization 
-# (loading documents, creating/loading FAISS index, setting up RetrievalQA chain).
-
-# Since we cannot run the full RAG setup (LangChain, FAISS) in this environment, 
-# we'll use a placeholder for the context and directly call the Gemini API.
-
-# 1. SIMULATED RAG CONTEXT (The actual RAG system would dynamically retrieve this)
-USER_CONTEXT = """
-**CONTEXT: Capillary Technologies Documentation Summary**
-
-1.  **Authentication:** API requests are authenticated using a Bearer token (`Authorization: Bearer <TOKEN>`). Tokens are generated via the `/auth/token` endpoint using a client ID and secret. Tokens expire every 60 minutes and must be refreshed.
-2.  **Customer Management:** To create a customer, the required fields are: `mobile_number` (unique identifier), `country_code`, and `first_name`. Optional fields include `email`, `birth_date` (format YYYY-MM-DD), and `loyalty_program_id`.
-3.  **Loyalty Campaigns:** Loyalty campaigns are created through the `/campaigns` endpoint. A basic campaign requires a `name`, `type` ('points' or 'discounts'), a `start_date`, and `end_date`. A reward rule must be defined, such as 'Earn 5 points for every $1 spent in the Retail category.'
-"""
-
-SYSTEM_PROMPT = """
-You are an expert technical support chatbot for Capillary Technologies, specializing in APIs, customer management, and loyalty campaigns. 
-Your goal is to answer questions concisely and accurately using ONLY the provided CONTEXT. 
-If the answer is not found in the context, state clearly, "I cannot find the answer in the provided documentation." 
-Always provide a brief, direct answer.
-"""
-# 2. SIMULATED API CALL (This replaces the qa_chain.invoke() in the original script)
+# --- RAG Service: persisted index, embedding model and LLM backend (LLM_BACKEND), loaded once per process ---
+# Under gunicorn (gunicorn.conf.py) the master preloads it before forking workers;
+# otherwise it loads in the background while /ready reports "loading".
+service = get_service()
+if os.getenv("RAG_PRELOAD") == "1":
+    service.warm()
+else:
+    service.warm_in_background()
+
 async def get_rag_answer(query):
     """
-    Simulates the RAG process by constructing a prompt with fixed context 
-    and calling the Gemini API.
-    
-    In a real system, this function would handle:
-    1. Retrieval: vectorstore.similarity_search(query, k=3)
-    2. Prompt Construction: Combining retrieved chunks + query
-    3. Generation: qa_chain.invoke({"query": query})
-    """
-    
-    # 1. Prompt Construction
-    full_prompt = f"""
-        --- CONTEXT RETRIEVED FROM 1456 PAGES ---
-        {USER_CONTEXT}
-        --- END CONTEXT ---
-        
-        USER QUERY: {query}
+    The RAG process:
+    1. Retrieval: hybrid BM25 + FAISS over the persisted index
+    2. Prompt Construction: retrieved chunks (with their URLs) + query
+    3. Generation: the configured backend (llm_backends.py). Gemini: shared keep-alive client, bounded by
+       the semaphore and the 60 RPM limiter, identical in-flight prompts sent once. Local: a CPU model
+       that batches concurrent requests and reuses the system prompt's KV cache
+    Repeat and near-duplicate questions are served from the answer cache instead.
     """
-    
-    # 2. API Payload (Using the standard non-streaming endpoint)
-    api_url = f"https://generativelanguage.googleapis.com/v1beta/models/gemini-2.5-flash-preview-05-20:generateContent?key={GEMINI_API_KEY}"
-    
-    payload = {
-        "contents": [{"parts": [{"text": full_prompt}]}],
-        "systemInstruction": {"parts": [{"text": SYSTEM_PROMPT}]},
-        "generationConfig": {
-            "temperature": 0.1,
-            "maxOutputTokens": 1024,
-        }
-    }
-    
-    # 3. Fetch (using synchronous requests here for simplicity in Flask, 
-    # but actual implementation should use an async library if concurrency is needed)
-    import requests
-    response = requests.post(api_url, headers={'Content-Type': 'application/json'}, json=payload)
-    response.raise_for_status() # Raise error for bad responses (4xx or 5xx)
-    result = response.json()
-    
-    candidate = result.get('candidates', [{}])[0]
-    answer_text = candidate.get('content', {}).get('parts', [{}])[0].get('text', "Error: Model did not return text.")
-    
-    # 4. SIMULATED SOURCE GATHERING (The RAG chain would return actual sources)
-    sources = []
-    lower_answer = answer_text.lower()
-    if 'authentication' in lower_answer:
-        sources.append('https://docs.capillary.tech/api/auth/token')
-    if 'customer' in lower_answer:
-        sources.append('https://docs.capillary.tech/api/customer/create')
-    if 'campaign' in lower_answer:
-        sources.append('https://docs.capillary.tech/api/campaigns/loyalty')
-        
-    return answer_text, sources
+    return await service.aanswer(query)
 
 
 # --- Flask Routes ---
@@ -94,11 +43,18 @@ def index():
     """Renders the chat interface."""
     return render_template("index.html")
 
+@app.route("/ready")
+def ready():
+    """Readiness probe: 200 once the index and models are loaded, 503 while loading (or if loading failed)."""
+    status = service.status()
+    return jsonify(status), 200 if service.ready else 503
+
 @app.route("/ask", methods=["POST"])
-def ask():
+async def ask():
     """Endpoint for user queries. Calls the RAG system and returns the response."""
-    if not GEMINI_API_KEY:
-        return jsonify({"error": "GEMINI_API_KEY not configured on the server."}), 500
+    configuration_error = get_backend().configuration_error()
+    if configuration_error:
+        return jsonify({"error": configuration_error}), 500
         
     data = request.json
     query = data.get("query")
@@ -107,19 +63,103 @@ def ask():
         return jsonify({"error": "Missing query parameter."}), 400
 
     try:
-        # Get answer from the RAG system (simulated or real)
-        answer, sources = get_rag_answer(query)
+        # Get answer from the RAG system ({"answer", "sources"[, "cache"]}); stages and counters go to /metrics
+        # and one JSON line per query to QUERY_LOG
+        with metrics.trace("ask", query):
+            response = await get_rag_answer(query)
         
         # Return the structured response
-        return jsonify({
-            "answer": answer,
-            "sources": sources
-        })
+        return jsonify(response)
 
+    except ServiceNotReady as e:
+        return jsonify({"error": f"Service is not ready: {e}"}), 503
+    except asyncio.TimeoutError:
+        return jsonify({"error": "The language model did not answer in time."}), 504
     except Exception as e:
         print(f"Error processing query: {e}")
         return jsonify({"error": f"Internal server error or API failure: {e}"}), 500
 
+def sse(event, data):
+    """One Server-Sent Events frame."""
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+@app.route("/ask_stream", methods=["POST"])
+def ask_stream():
+    """Streams the answer as SSE: `token` events as the model produces text, then `sources`, then `done`."""
+    configuration_error = get_backend().configuration_error()
+    if configuration_error:
+        return jsonify({"error": configuration_error}), 500
+
+    query = (request.json or {}).get("query")
+    if not query:
+        return jsonify({"error": "Missing query parameter."}), 400
+    if not service.ready:
+        return jsonify({"error": f"Service is not ready: {service.state}."}), 503
+
+    def events():
+        with metrics.trace("ask_stream", query) as query_trace:
+            try:
+                for event in service.stream_answer(query):
+                    yield sse(event.pop("event"), event)
+            except asyncio.TimeoutError as e:
+                query_trace.fail(e)
+                yield sse("error", {"error": "The language model did not answer in time."})
+                return
+            except Exception as e:
+                print(f"Error streaming query: {e}")
+                query_trace.fail(e)
+                yield sse("error", {"error": f"Internal server error or API failure: {e}"})
+                return
+            yield sse("done", {})
+
+    return Response(stream_with_context(events()), mimetype="text/event-stream",
+                    headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+@app.route("/ask_batch", methods=["POST"])
+def ask_batch():
+    """Bulk questions as a JSONL body (or JSON {"questions": [...]}); answers stream back as JSONL as they complete.
+
+    Each line is the input record plus "index" (its line), "answer" and "sources";
+    a question whose LLM call failed carries "error" instead of an answer.
+    """
+    configuration_error = get_backend().configuration_error()
+    if configuration_error:
+        return jsonify({"error": configuration_error}), 500
+
+    try:
+        if request.is_json:
+            lines = [json.dumps(item) for item in (request.json or {}).get("questions", [])]
+        else:
+            lines = request.get_data(as_text=True).splitlines()
+        records = parse_questions(lines)
+    except (ValueError, AttributeError) as e:
+        return jsonify({"error": f"Invalid batch: {e}"}), 400
+    if not records:
+        return jsonify({"error": "No questions in the request body."}), 400
+    if len(records) > MAX_BATCH_QUESTIONS:
+        return jsonify({"error": f"At most {MAX_BATCH_QUESTIONS} questions per batch."}), 413
+    if not service.ready:
+        return jsonify({"error": f"Service is not ready: {service.state}."}), 503
+
+    def lines_out():
+        try:
+            for result in run_batch(service, records):
+                yield json.dumps(result, ensure_ascii=False) + "\n"
+        except Exception as e:
+            print(f"Error answering batch: {e}")
+            yield json.dumps({"error": f"Internal server error or API failure: {e}"}) + "\n"
+
+    return Response(stream_with_context(lines_out()), mimetype="application/x-ndjson",
+                    headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+@app.route("/metrics")
+def metrics_endpoint():
+    """Prometheus text format: per-stage latency histograms, cache / LLM / retrieval counters (this process)."""
+    return Response(metrics.METRICS.render(), mimetype="text/plain; version=0.0.4")
+
 if __name__ == "__main__":
     print("Running Flask app. Access the chat at http://127.0.0.1:5000")
-    app.run(debug=True)
+    # Threaded: each request awaits the shared LLM backend, so slow LLM calls do not queue up
+    # Production: gunicorn -c gunicorn.conf.py withinterface:app (preloads the service, then forks)
+    # No reloader: it would import the app (and load the models) twice
+    app.run(debug=True, threaded=True, use_reloader=False)